@@ -165,3 +165,7 @@ CELERY_TIMEZONE = 'Asia/Kolkata'
 
 
 CASE_SERVICE_URL = "http://localhost:8002/api" 
+
+# Users fetched from user-service are reused for this many seconds per process
+USER_INFO_CACHE_TTL = 30
+USER_INFO_CACHE_SIZE = 5000
@@ -0,0 +1,68 @@
+# advocates/rpc.py
+import threading
+import time
+
+from django.conf import settings
+from advocate_service.celery import app
+
+
+# ------------------------ Short-lived user cache ------------------------
+
+_user_cache = {}
+_user_cache_lock = threading.Lock()
+
+
+def _cache_ttl():
+    return getattr(settings, "USER_INFO_CACHE_TTL", 30)
+
+
+def _cache_max_size():
+    return getattr(settings, "USER_INFO_CACHE_SIZE", 5000)
+
+
+def _cached_users(user_ids):
+    now = time.monotonic()
+    found = {}
+    with _user_cache_lock:
+        for uid in user_ids:
+            entry = _user_cache.get(uid)
+            if entry and entry[0] > now:
+                found[uid] = entry[1]
+    return found
+
+
+def _store_users(users):
+    deadline = time.monotonic() + _cache_ttl()
+    with _user_cache_lock:
+        for user in users:
+            _user_cache[user["id"]] = (deadline, user)
+        overflow = len(_user_cache) - _cache_max_size()
+        if overflow > 0:
+            # dicts keep insertion order, so the first keys are the oldest entries
+            for uid in list(_user_cache)[:overflow]:
+                del _user_cache[uid]
+
+
+def clear_user_cache():
+    with _user_cache_lock:
+        _user_cache.clear()
+
+
+# ------------------------ RPC calls to user-service ------------------------
+
+def get_users_rpc(user_ids, timeout=10):
+    """
+    Fetch several users from user-service in a single Celery RPC.
+    Recently fetched users are served from the per-process cache, so only
+    the ids that are missing from it go over the broker.
+    Returns a dict of user id -> user info; unknown ids are left out.
+    """
+    user_ids = set(user_ids)
+    users = _cached_users(user_ids)
+    missing = sorted(user_ids - users.keys())
+    if missing:
+        result = app.send_task("user_service.tasks.get_users_info", args=[missing]).get(timeout=timeout)
+        fetched = [user for user in result or [] if user.get("id") is not None]
+        _store_users(fetched)
+        users.update({user["id"]: user for user in fetched})
+    return users
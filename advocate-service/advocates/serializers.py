@@ -2,20 +2,27 @@
 
 from rest_framework import serializers
 from .models import AdvocateProfile, AdvocateTeam, Specialization
-from advocate_service.celery import app 
+from .rpc import get_users_rpc
 
 
 # ------------------------ Helper: RPC call to user-service ------------------------
 
-def get_user_rpc(user_id):
-    """Fetch user info from user-service via Celery RPC"""
+def get_team_users_rpc(lead_id, member_ids):
+    """Fetch the lead and all members from user-service in one round trip"""
+    user_ids = set(member_ids)
+    if lead_id is not None:
+        user_ids.add(lead_id)
     try:
-        result = app.send_task("user_service.tasks.get_user_info", args=[user_id]).get(timeout=10)
-        if not result or result.get("id") is None:
-            raise serializers.ValidationError(f"User with id {user_id} not found")
-        return result
+        users = get_users_rpc(user_ids)
     except Exception as e:
-        raise serializers.ValidationError(f"Error fetching user {user_id}: {str(e)}")
+        raise serializers.ValidationError(f"Error fetching users: {str(e)}")
+
+    missing = sorted(user_ids - users.keys())
+    if missing:
+        raise serializers.ValidationError(f"Users not found: {missing}")
+    if lead_id is not None and users[lead_id]["role"] != "advocate":
+        raise serializers.ValidationError("Lead must be an advocate")
+    return users
 
 
 # ------------------------ User Serializer ------------------------
@@ -103,16 +110,10 @@ class AdvocateTeamCreateSerializer(serializers.ModelSerializer):
         member_ids = validated_data.pop("member_ids", [])
         lead_id = validated_data.pop("lead_id")
 
-        # Fetch lead via RPC
-        lead_data = get_user_rpc(lead_id)
-        if lead_data["role"] != "advocate":
-            raise serializers.ValidationError("Lead must be an advocate")
+        get_team_users_rpc(lead_id, member_ids)
 
         team = AdvocateTeam.objects.create(lead_id=lead_id)
-
-        for uid in member_ids:
-            user_data = get_user_rpc(uid)
-            team.members.add(uid)
+        team.members.add(*member_ids)
 
         return team
 
@@ -120,18 +121,14 @@ class AdvocateTeamCreateSerializer(serializers.ModelSerializer):
         member_ids = validated_data.pop("member_ids", None)
         lead_id = validated_data.pop("lead_id", None)
 
+        get_team_users_rpc(lead_id or None, member_ids or [])
+
         if lead_id:
-            lead_data = get_user_rpc(lead_id)
-            if lead_data["role"] != "advocate":
-                raise serializers.ValidationError("Lead must be an advocate")
             instance.lead_id = lead_id
 
         instance.save()
 
         if member_ids is not None:
-            instance.members.clear()
-            for uid in member_ids:
-                user_data = get_user_rpc(uid)
-                instance.members.add(uid)
+            instance.members.set(member_ids)
 
         return instance
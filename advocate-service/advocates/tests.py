@@ -1,3 +1,48 @@
-from django.test import TestCase
+from unittest.mock import MagicMock, patch
 
-# Create your tests here.
+from django.test import SimpleTestCase
+from rest_framework import serializers
+
+from advocates.rpc import clear_user_cache, get_users_rpc
+from advocates.serializers import get_team_users_rpc
+
+
+def rpc_returning(users):
+    result = MagicMock()
+    result.get.return_value = users
+    return result
+
+
+class UserInfoRPCTests(SimpleTestCase):
+
+    def setUp(self):
+        clear_user_cache()
+
+    @patch("advocates.rpc.app.send_task")
+    def test_whole_team_is_fetched_in_one_round_trip(self, send_task):
+        members = [{"id": uid, "username": f"u{uid}", "email": f"u{uid}@x.com", "role": "advocate"} for uid in range(1, 21)]
+        send_task.return_value = rpc_returning(members)
+
+        users = get_team_users_rpc(1, list(range(2, 21)))
+
+        self.assertEqual(len(users), 20)
+        send_task.assert_called_once_with("user_service.tasks.get_users_info", args=[list(range(1, 21))])
+
+    @patch("advocates.rpc.app.send_task")
+    def test_cached_users_are_not_fetched_again(self, send_task):
+        send_task.return_value = rpc_returning([{"id": 1, "username": "a", "email": "a@x.com", "role": "advocate"}])
+        get_users_rpc([1])
+        send_task.return_value = rpc_returning([{"id": 2, "username": "b", "email": "b@x.com", "role": "client"}])
+
+        users = get_users_rpc([1, 2])
+
+        self.assertEqual(set(users), {1, 2})
+        send_task.assert_called_with("user_service.tasks.get_users_info", args=[[2]])
+
+    @patch("advocates.rpc.app.send_task")
+    def test_unknown_members_and_non_advocate_leads_are_rejected(self, send_task):
+        send_task.return_value = rpc_returning([{"id": 1, "username": "a", "email": "a@x.com", "role": "client"}])
+        with self.assertRaises(serializers.ValidationError):
+            get_team_users_rpc(1, [])
+        with self.assertRaises(serializers.ValidationError):
+            get_team_users_rpc(None, [1, 99])
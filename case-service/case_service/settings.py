@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from logging import config
 from pathlib import Path
 
@@ -130,3 +131,8 @@ STATIC_URL = 'static/'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Case events are posted to the notifications endpoint of chat-service
+# (see cases.notifications); nothing is sent while the token is empty
+NOTIFICATIONS_URL = os.environ.get('NOTIFICATIONS_URL', 'http://chat-service:8000/notifications/events/')
+NOTIFICATIONS_SERVICE_TOKEN = os.environ.get('NOTIFICATION_SERVICE_TOKEN', '')
+NOTIFICATIONS_TIMEOUT = 3
@@ -0,0 +1,53 @@
+import json
+import threading
+import urllib.request
+
+from django.conf import settings
+from django.db import transaction
+
+
+def case_recipients(case, client=True, advocate=True, exclude=None):
+    """User-service ids of the people following a case: client, advocate and team."""
+    user_ids = set(case.case_team_members.values_list('user_id', flat=True))
+    if client and case.client_id:
+        user_ids.add(case.client_id)
+    if advocate and case.advocate_id:
+        user_ids.add(case.advocate_id)
+    user_ids.discard(exclude)
+    return sorted(user_ids)
+
+
+def post_events(events):
+    request = urllib.request.Request(
+        settings.NOTIFICATIONS_URL,
+        data=json.dumps({'events': events}).encode(),
+        headers={'Content-Type': 'application/json', 'X-Service-Token': settings.NOTIFICATIONS_SERVICE_TOKEN},
+        method='POST',
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=settings.NOTIFICATIONS_TIMEOUT):
+            pass
+    except Exception as e:
+        print(f"Failed to send case notifications: {e}")
+
+
+def notify_case(case, kind, title, body='', recipients=None):
+    """
+    Hand a case event to chat-service, which stores it in each recipient's
+    inbox and delivers it live or in the next mail digest. Events of one case
+    share a group, so a burst of activity stays one notification per user.
+    Sent after commit from a background thread, so the request never waits
+    on chat-service; failures are only logged.
+    """
+    user_ids = case_recipients(case) if recipients is None else recipients
+    if not user_ids or not settings.NOTIFICATIONS_SERVICE_TOKEN:
+        return
+    event = {
+        'user_ids': user_ids,
+        'kind': kind,
+        'title': title,
+        'body': body,
+        'data': {'case_id': case.id, 'case_number': case.case_number},
+        'group_key': f"case:{case.id}",
+    }
+    transaction.on_commit(lambda: threading.Thread(target=post_events, args=([event],), daemon=True).start())
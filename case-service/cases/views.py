@@ -3,6 +3,7 @@ from rest_framework.response import Response
 from rest_framework import status
 
 from .models import Case, CaseTeamMember, CaseDocument, CaseNote
+from .notifications import case_recipients, notify_case
 from .serializers import (
     CaseSerializer,
     CaseTeamMemberSerializer,
@@ -44,7 +45,8 @@ class CaseDetailView(APIView):
 
         serializer = CaseSerializer(case, data=request.data, partial=True)
         if serializer.is_valid():
-            serializer.save()
+            case = serializer.save()
+            notify_case(case, "case.updated", f"Case {case.case_number} was updated", f"Status: {case.status}")
             return Response(serializer.data)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -64,7 +66,11 @@ class AddCaseTeamMemberView(APIView):
     def post(self, request):
         serializer = CaseTeamMemberSerializer(data=request.data)
         if serializer.is_valid():
-            serializer.save()
+            member = serializer.save()
+            notify_case(
+                member.case, "case.team", f"You were added to case {member.case.case_number}",
+                member.case.title, recipients=[member.user_id],
+            )
             return Response({"message": "Team member added", "data": serializer.data})
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -88,7 +94,14 @@ class UploadCaseDocumentView(APIView):
     def post(self, request):
         serializer = CaseDocumentSerializer(data=request.data)
         if serializer.is_valid():
-            serializer.save()
+            document = serializer.save()
+            recipients = case_recipients(
+                document.case, client=document.visible_to_client, advocate=document.visible_to_advocate
+            )
+            notify_case(
+                document.case, "case.document", f"New document in case {document.case.case_number}",
+                document.document.name, recipients=recipients,
+            )
             return Response({"message": "Document uploaded", "data": serializer.data})
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -105,7 +118,11 @@ class AddCaseNoteView(APIView):
     def post(self, request):
         serializer = CaseNoteSerializer(data=request.data)
         if serializer.is_valid():
-            serializer.save()
+            note = serializer.save()
+            notify_case(
+                note.case, "case.note", f"New note in case {note.case.case_number}", note.note[:100],
+                recipients=case_recipients(note.case, exclude=note.created_by_id),
+            )
             return Response({"message": "Note added", "data": serializer.data})
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
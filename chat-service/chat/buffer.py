@@ -0,0 +1,191 @@
+import asyncio
+import weakref
+from collections import defaultdict
+from datetime import timedelta
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import InterfaceError, OperationalError, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from chat import metrics
+from chat.models import ChatRoom, Message
+from chat.unread import count_new_messages
+
+
+DEFAULT_WRITE_BEHIND = {
+    'ENABLED': False,
+    'MAX_BATCH': 200,         # flush as soon as this many messages are waiting
+    'FLUSH_INTERVAL': 0.05,   # seconds a message may wait before it is flushed
+    'MAX_PENDING': 10000,     # refuse new messages beyond this while the database is unavailable
+    'MAX_RETRY_DELAY': 5,
+    'MAX_ATTEMPTS': 3,        # failures of a batch before it is written row by row
+}
+
+
+def get_write_behind_config():
+    return {**DEFAULT_WRITE_BEHIND, **getattr(settings, 'CHAT_WRITE_BEHIND', {})}
+
+
+def is_transient(error):
+    """Errors of the database being unavailable, as opposed to rejecting the rows."""
+    return isinstance(error, (OperationalError, InterfaceError))
+
+
+class WriteBufferFull(Exception):
+    pass
+
+
+class MessageWriteBuffer:
+    """
+    Write-behind persistence for ChatConsumer.
+
+    Messages are acknowledged and broadcast as soon as they are added, and
+    written to Postgres in micro-batches with bulk_create. last_message_at is
+    updated once per room per flush.
+
+    Ordering guarantees:
+    - timestamps are assigned when a message is accepted and are strictly
+      increasing per room in this worker, so history order is acceptance order
+      no matter when the batch reaches the database;
+    - a batch is written in one transaction; if it fails it goes back in front
+      of everything queued after it and is retried with backoff, never reordered;
+    - a batch that keeps failing for another reason than the database being
+      unavailable (say a row whose room was deleted) is written row by row
+      after max_attempts tries, and the rows still rejected are dropped, so
+      one bad row cannot hold up the worker;
+    - ids are generated before the insert and conflicts are ignored, so a retry
+      of a batch that did commit cannot duplicate messages.
+
+    A crash of the worker loses at most the messages that were still waiting
+    for their flush. That is why the mode is opt-in (CHAT_WRITE_BEHIND).
+    """
+
+    def __init__(self, max_batch=200, flush_interval=0.05, max_pending=10000, max_retry_delay=5, max_attempts=3):
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.max_retry_delay = max_retry_delay
+        self.max_attempts = max_attempts
+        self._pending = []
+        self._lock = asyncio.Lock()
+        self._flush_task = None
+        self._last_timestamps = {}
+        self._failures = 0
+        self.flushed = 0
+        self.flushes = 0
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self._pending)
+
+    def next_timestamp(self, room_id):
+        timestamp = timezone.now()
+        last = self._last_timestamps.get(room_id)
+        if last is not None and timestamp <= last:
+            timestamp = last + timedelta(microseconds=1)
+        self._last_timestamps[room_id] = timestamp
+        return timestamp
+
+    async def add(self, message):
+        if len(self._pending) >= self.max_pending:
+            raise WriteBufferFull("Message buffer is full, try again later")
+        message.timestamp = self.next_timestamp(message.room_id)
+        self._pending.append(message)
+        if len(self._pending) >= self.max_batch:
+            try:
+                await self.flush()
+            except Exception as e:
+                # the message stays queued and a retry is already scheduled
+                print("Write-behind flush failed, retrying:", e)
+        else:
+            self._schedule(self.flush_interval)
+        return message
+
+    def _schedule(self, delay):
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.ensure_future(self._flush_later(delay))
+
+    async def _flush_later(self, delay):
+        await asyncio.sleep(delay)
+        try:
+            await self.flush()
+        except Exception as e:
+            print("Write-behind flush failed, retrying:", e)
+
+    def _retry_later(self):
+        self._flush_task = None
+        self._schedule(min(self.flush_interval * 2 ** self._failures, self.max_retry_delay))
+
+    async def flush(self):
+        async with self._lock:
+            while self._pending:
+                batch = self._pending[:self.max_batch]
+                try:
+                    await database_sync_to_async(self.write_batch)(batch)
+                except Exception as e:
+                    self._failures += 1
+                    if is_transient(e) or self._failures < self.max_attempts:
+                        self._retry_later()
+                        raise
+                    await self._write_rows(len(batch))
+                    continue
+                del self._pending[:len(batch)]
+                self._failures = 0
+                self.flushed += len(batch)
+                self.flushes += 1
+
+    async def _write_rows(self, count):
+        """Write the first count pending messages one at a time, dropping the ones the database rejects."""
+        for _ in range(count):
+            message = self._pending[0]
+            try:
+                await database_sync_to_async(self.write_batch)([message])
+            except Exception as e:
+                if is_transient(e):
+                    self._retry_later()
+                    raise
+                print(f"Write-behind dropped message {message.pk} of room {message.room_id}:", e)
+                metrics.increment('write_behind_dropped')
+                self.dropped += 1
+            else:
+                self.flushed += 1
+            del self._pending[0]
+        self._failures = 0
+        self.flushes += 1
+
+    @staticmethod
+    def write_batch(batch):
+        latest = defaultdict(lambda: None)
+        for message in batch:
+            if latest[message.room_id] is None or message.timestamp > latest[message.room_id]:
+                latest[message.room_id] = message.timestamp
+
+        with transaction.atomic():
+            Message.objects.bulk_create(batch, ignore_conflicts=True)
+            for room_id, timestamp in latest.items():
+                ChatRoom.objects.filter(pk=room_id).filter(
+                    Q(last_message_at__lt=timestamp) | Q(last_message_at__isnull=True)
+                ).update(last_message_at=timestamp)
+        count_new_messages(batch)
+
+
+_buffers = weakref.WeakKeyDictionary()
+
+
+def get_write_buffer():
+    """One buffer per event loop, i.e. per ASGI worker process."""
+    loop = asyncio.get_running_loop()
+    buffer = _buffers.get(loop)
+    if buffer is None:
+        config = get_write_behind_config()
+        buffer = MessageWriteBuffer(
+            max_batch=config['MAX_BATCH'],
+            flush_interval=config['FLUSH_INTERVAL'],
+            max_pending=config['MAX_PENDING'],
+            max_retry_delay=config['MAX_RETRY_DELAY'],
+            max_attempts=config['MAX_ATTEMPTS'],
+        )
+        _buffers[loop] = buffer
+    return buffer
@@ -0,0 +1,52 @@
+import json
+
+import msgpack
+
+
+class JSONCodec:
+    """The default: one JSON text frame per event."""
+    subprotocol = None
+    binary = False
+
+    def encode(self, data):
+        return json.dumps(data)
+
+    def decode(self, text_data=None, bytes_data=None):
+        return json.loads(text_data if text_data is not None else bytes_data)
+
+
+class MsgpackCodec:
+    """Binary MessagePack frames, negotiated with the "chat.msgpack" subprotocol."""
+    subprotocol = 'chat.msgpack'
+    binary = True
+
+    def encode(self, data):
+        return msgpack.packb(data, use_bin_type=True)
+
+    def decode(self, text_data=None, bytes_data=None):
+        if bytes_data is None:
+            return json.loads(text_data)
+        return msgpack.unpackb(bytes_data, raw=False)
+
+
+JSON = JSONCodec()
+MSGPACK = MsgpackCodec()
+
+CODECS = {MSGPACK.subprotocol: MSGPACK}
+
+
+def negotiate(subprotocols):
+    """The codec for the first supported subprotocol the client offered, else JSON."""
+    for subprotocol in subprotocols or []:
+        if subprotocol in CODECS:
+            return CODECS[subprotocol]
+    return JSON
+
+
+def frame_size(payload_size):
+    """Bytes a server-to-client websocket frame with this payload takes on the wire."""
+    if payload_size < 126:
+        return payload_size + 2
+    if payload_size < 65536:
+        return payload_size + 4
+    return payload_size + 10
@@ -1,16 +1,109 @@
-import json
+import asyncio
+import time
+from urllib.parse import parse_qs
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.db.models import Q
+from notifications.buffer import get_notification_buffer
+from . import metrics
+from .buffer import get_write_behind_config, get_write_buffer
+from .codecs import negotiate
+from .fanout import RecentMessageIds, broadcast_message, room_group_name, serialize_message
+from .membership import is_member
 from .models import ChatRoom, Message
+from .pagination import encode_position
+from .presence import RoomPresence, TypingThrottle, get_presence_config
+from .sync import gap_exceeds, missed_batch, resolve_since
+from .throttling import FrameLimiter
+from .unread import count_new_messages
 
 User = get_user_model()
 
 
+DEFAULT_DELIVERY = {
+    'BATCH_WINDOW': 0.005,  # seconds room events wait to be coalesced, for ?batch=1 sockets
+    'MAX_BATCH': 100,
+    'SEND_QUEUE': 256,         # outbound frames buffered per socket
+    'SLOW_CONSUMER': 'close',  # when the buffer is full: 'close' the socket or 'drop' the frame
+    'SYNC_BATCH': 100,         # missed messages per frame when a client reconnects with ?since=
+    'SYNC_MAX': 1000,          # larger gaps are left to REST paging
+}
+
+# Close codes: 4429 for clients that keep flooding after being throttled,
+# 1013 ("try again later") for clients that do not keep up with their room.
+THROTTLED_CLOSE_CODE = 4429
+SLOW_CONSUMER_CLOSE_CODE = 1013
+
+
+def get_delivery_config():
+    return {**DEFAULT_DELIVERY, **getattr(settings, 'CHAT_DELIVERY', {})}
+
+
 class ChatConsumer(AsyncWebsocketConsumer):
+    """
+    The room, the user and their membership are resolved once per socket, so a
+    steady-state message costs a single INSERT. last_message_at on the room is
+    refreshed at most every CHAT_LAST_MESSAGE_AT_INTERVAL seconds per socket
+    and once more on disconnect.
+
+    Besides chat messages, clients send {"type": "heartbeat"} to stay online
+    and {"type": "typing", "typing": true|false}. Presence and typing live in
+    Redis and on the channel layer only (see chat.presence); a snapshot of the
+    room's presence is sent right after the greeting.
+
+    Frames are JSON text unless the client offers the "chat.msgpack"
+    subprotocol, which switches both directions to binary MessagePack. With
+    ?batch=1, events that arrive within CHAT_DELIVERY['BATCH_WINDOW'] of each
+    other go out as one {"type": "batch", "events": [...]} frame.
+
+    Incoming frames are rate limited per socket and per user (see
+    chat.throttling); outgoing frames go through a bounded queue drained by
+    a writer task, so a client that stops reading is closed (or has frames
+    dropped) instead of holding memory and the room's fan-out hostage.
+
+    A reconnecting client passes ?since=<last message id | history cursor |
+    ISO timestamp>. What it missed is replayed as {"type": "sync.batch"}
+    frames and a final {"type": "sync.done"} before any live event; if the
+    gap is over CHAT_DELIVERY['SYNC_MAX'] it gets {"type": "sync.gap",
+    "after": <cursor>} and pages the history endpoint with after=<cursor>.
+
+    Participants who are not in the room get notifications for its messages,
+    collected per worker and written once a second (see notifications.buffer).
+    """
+
     async def connect(self):
         self.room_name = self.scope['url_route']['kwargs']['room_name']
-        self.room_group_name = f"chat_{self.room_name}"
+        self.room_group_name = room_group_name(self.room_name)
+        self.delivered = RecentMessageIds()
+        self.write_behind = get_write_behind_config()['ENABLED']
+        self.room_touch_interval = getattr(settings, 'CHAT_LAST_MESSAGE_AT_INTERVAL', 1.0)
+        self.room_touched_at = 0.0
+        self.untouched_message = None
+        self.user = None
+        self.presence = None
+        self.typing = TypingThrottle(get_presence_config()['TYPING_INTERVAL'])
+        query = parse_qs(self.scope.get('query_string', b'').decode())
+        self.setup_delivery(negotiate(self.scope.get('subprotocols')), query.get('batch') == ['1'])
+
+        self.room = await self.get_room()
+        if self.room is None:
+            await self.close(code=4404)
+            return
+
+        # JWTAuthMiddleware verified the token; resolve the user and their
+        # membership once, here, instead of on every frame.
+        scope_user = self.scope.get('user')
+        if scope_user is None or not scope_user.is_authenticated:
+            await self.close(code=4401)
+            return
+        self.user = await self.get_participant_user(scope_user.id)
+        if self.user is None:
+            await self.close(code=4403)
+            return
+        self.limiter = FrameLimiter(self.user.id)
+        metrics.increment('sockets_open')
 
         # Join room group
         await self.channel_layer.group_add(
@@ -18,49 +111,317 @@ class ChatConsumer(AsyncWebsocketConsumer):
             self.channel_name
         )
 
-        await self.accept()
-        await self.send(text_data=json.dumps({
+        await self.accept(subprotocol=self.codec.subprotocol or self.scope.get('auth_subprotocol'))
+        await self.send_event({
             'message': f'Connected to room {self.room_name}'
-        }))
+        })
+
+        self.presence = RoomPresence(self.room.pk)
+        await self.join_presence()
+        try:
+            snapshot = await self.presence.snapshot()
+        except Exception as e:
+            print("Presence snapshot failed:", e)
+        else:
+            await self.send_event({'type': 'presence.snapshot', **snapshot})
+
+        since = query.get('since', [None])[0]
+        if since:
+            await self.sync_missed(since)
 
     async def disconnect(self, close_code):
+        if getattr(self, 'outbox_flush', None) is not None:
+            self.outbox_flush.cancel()
+        if getattr(self, 'sender', None) is not None:
+            self.sender.cancel()
+        if getattr(self, 'limiter', None) is not None:
+            metrics.increment('sockets_open', -1)
         await self.channel_layer.group_discard(
             self.room_group_name,
             self.channel_name
         )
+        if getattr(self, 'presence', None) is not None:
+            await self.leave_presence()
+        if self.write_behind:
+            try:
+                await get_write_buffer().flush()
+            except Exception as e:
+                print("Write-behind flush failed on disconnect:", e)
+        elif getattr(self, 'untouched_message', None) is not None:
+            await self.touch_room(self.untouched_message)
 
-    async def receive(self, text_data):
-        text_data_json = json.loads(text_data)
-        message = text_data_json.get('message')
-        sender_id = text_data_json.get('sender_id')
+    async def receive(self, text_data=None, bytes_data=None):
+        metrics.increment('frames_received')
+        refused = self.limiter.allow()
+        if refused:
+            await self.throttled(refused)
+            return
 
-        saved_message = await self.save_message(sender_id, message)
+        data = self.codec.decode(text_data, bytes_data)
+        message = data.get('message')
+        sender_id = data.get('sender_id')
 
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'chat_message',
-                'message': saved_message
-            }
-        )
+        # sender_id is optional; the sender is always the token's user
+        if sender_id is not None and str(sender_id) != str(self.user.id):
+            await self.send_event({'error': "sender_id does not match this connection"})
+            return
+
+        frame_type = data.get('type', 'message')
+        if frame_type == 'heartbeat':
+            await self.heartbeat()
+            return
+        if frame_type == 'typing':
+            await self.send_typing(bool(data.get('typing')))
+            return
+
+        self.typing.reset()
+
+        if self.write_behind:
+            saved_message = await self.buffer_message(message)
+        else:
+            saved_message = await self.save_message(message)
+        if 'error' in saved_message:
+            await self.send_event(saved_message)
+            return
+
+        # The consumer is already async, so deliver straight over the channel layer
+        await broadcast_message(self.room_name, saved_message, self.channel_layer)
+        get_notification_buffer().add(saved_message)
+
+    async def throttled(self, scope):
+        """Tell the client once per streak of refused frames; close it if the streak goes on."""
+        metrics.increment(f'frames_throttled_{scope}')
+        if self.limiter.exhausted:
+            metrics.increment('throttled_disconnects')
+            await self.close(code=THROTTLED_CLOSE_CODE)
+        elif self.limiter.throttled == 1:
+            await self.send_event({'error': "rate limited", 'retry_after': round(self.limiter.retry_after(), 3)})
 
     async def chat_message(self, event):
-        await self.send(text_data=json.dumps({
+        message_id = event['message'].get('id')
+        if message_id and self.delivered.seen(message_id):
+            return
+        await self.send_event({
             'message': event['message']
-        }))
+        }, coalesce=True)
+
+    async def presence_update(self, event):
+        if event['user_id'] == self.user.id:
+            return
+        await self.send_event({
+            'type': 'presence',
+            'user_id': event['user_id'],
+            'status': event['status'],
+            'last_seen': event.get('last_seen'),
+        }, coalesce=True)
+
+    async def typing_update(self, event):
+        if event['user_id'] == self.user.id:
+            return
+        await self.send_event({
+            'type': 'typing',
+            'user_id': event['user_id'],
+            'typing': event['typing'],
+        }, coalesce=True)
+
+    def setup_delivery(self, codec, batching):
+        config = get_delivery_config()
+        self.codec = codec
+        self.batch_window = config['BATCH_WINDOW'] if batching else 0
+        self.max_batch = config['MAX_BATCH']
+        self.sync_batch = config['SYNC_BATCH']
+        self.sync_max = config['SYNC_MAX']
+        self.outbox = []
+        self.outbox_flush = None
+        self.send_queue = asyncio.Queue(maxsize=config['SEND_QUEUE'])
+        self.slow_consumer_policy = config['SLOW_CONSUMER']
+        self.sender = None
+        self.closing = False
+
+    async def send_event(self, data, coalesce=False):
+        """
+        Send one event to the client. Room events (coalesce=True) wait in the
+        outbox for the batch window when batching is on; anything else flushes
+        the outbox first so the client sees events in order.
+        """
+        if coalesce and self.batch_window:
+            self.outbox.append(data)
+            if len(self.outbox) >= self.max_batch:
+                await self.flush_outbox()
+            elif self.outbox_flush is None:
+                self.outbox_flush = asyncio.ensure_future(self.flush_outbox_later())
+            return
+        if self.outbox:
+            await self.flush_outbox()
+        await self.send_frame(data)
+
+    async def send_frame(self, data):
+        """Queue one encoded frame for the writer task; never waits on the client."""
+        if self.closing:
+            return
+        if self.sender is None:
+            self.sender = asyncio.ensure_future(self.drain_send_queue())
+        try:
+            self.send_queue.put_nowait(self.codec.encode(data))
+        except asyncio.QueueFull:
+            await self.slow_consumer()
+
+    async def drain_send_queue(self):
+        while True:
+            frame = await self.send_queue.get()
+            try:
+                if self.codec.binary:
+                    await self.send(bytes_data=frame)
+                else:
+                    await self.send(text_data=frame)
+            finally:
+                self.send_queue.task_done()
+
+    async def slow_consumer(self):
+        metrics.increment('frames_dropped')
+        if self.slow_consumer_policy != 'close':
+            return
+        metrics.increment('slow_consumer_disconnects')
+        self.closing = True
+        self.sender.cancel()
+        await self.close(code=SLOW_CONSUMER_CLOSE_CODE)
+
+    async def flush_outbox_later(self):
+        await asyncio.sleep(self.batch_window)
+        self.outbox_flush = None
+        await self.flush_outbox()
+
+    async def flush_outbox(self):
+        events, self.outbox = self.outbox, []
+        if len(events) == 1:
+            await self.send_frame(events[0])
+        elif events:
+            await self.send_frame({'type': 'batch', 'events': events})
+
+    async def sync_missed(self, since):
+        """
+        Replay the messages after `since` in bounded batches. The socket is
+        already in the room group, so live events queue up meanwhile and are
+        handled once connect returns; the replayed ids are recorded so those
+        that also arrive live are dropped.
+        """
+        try:
+            position = await self.get_since_position(since)
+        except ValueError:
+            await self.send_event({'error': "invalid since"})
+            return
+        if position is None or await self.gap_exceeds(position):
+            await self.send_event({'type': 'sync.gap', 'after': encode_position(*position) if position else None})
+            return
+
+        count = 0
+        while count < self.sync_max:
+            batch, position = await self.get_missed_batch(position, min(self.sync_batch, self.sync_max - count))
+            if not batch:
+                break
+            for message in batch:
+                self.delivered.seen(message['id'])
+            await self.send_event({'type': 'sync.batch', 'messages': batch})
+            count += len(batch)
+            if len(batch) < self.sync_batch:
+                break
+        await self.send_event({'type': 'sync.done', 'count': count, 'after': encode_position(*position)})
+
+    async def join_presence(self):
+        try:
+            came_online = await self.presence.join(self.user.id, self.channel_name)
+        except Exception as e:
+            print("Presence update failed:", e)
+            return
+        if came_online:
+            await self.channel_layer.group_send(self.room_group_name, {
+                'type': 'presence_update', 'user_id': self.user.id, 'status': 'online',
+            })
+
+    async def leave_presence(self):
+        try:
+            last_seen = await self.presence.leave(self.user.id, self.channel_name)
+        except Exception as e:
+            print("Presence update failed:", e)
+            return
+        if self.typing.typing:
+            await self.channel_layer.group_send(self.room_group_name, {
+                'type': 'typing_update', 'user_id': self.user.id, 'typing': False,
+            })
+        if last_seen is not None:
+            await self.channel_layer.group_send(self.room_group_name, {
+                'type': 'presence_update', 'user_id': self.user.id, 'status': 'offline', 'last_seen': last_seen,
+            })
+
+    async def heartbeat(self):
+        try:
+            await self.presence.heartbeat(self.user.id, self.channel_name)
+        except Exception as e:
+            print("Presence update failed:", e)
+
+    async def send_typing(self, typing):
+        if self.typing.allow(typing):
+            await self.channel_layer.group_send(self.room_group_name, {
+                'type': 'typing_update', 'user_id': self.user.id, 'typing': typing,
+            })
 
     @database_sync_to_async
-    def save_message(self, sender_id, content):
+    def get_since_position(self, since):
+        return resolve_since(self.room, since)
+
+    @database_sync_to_async
+    def gap_exceeds(self, position):
+        return gap_exceeds(self.room, position, self.sync_max)
+
+    @database_sync_to_async
+    def get_missed_batch(self, position, limit):
+        """Serialized messages after `position`, and the position after them."""
+        messages = missed_batch(self.room, position, limit)
+        if messages:
+            position = (messages[-1].timestamp, messages[-1].id)
+        return [serialize_message(message) for message in messages], position
+
+    @database_sync_to_async
+    def get_room(self):
+        return ChatRoom.objects.filter(name=self.room_name).first()
+
+    @database_sync_to_async
+    def get_participant_user(self, user_id):
+        if not is_member(user_id, self.room.pk):
+            return None
+        return User.objects.only('id', 'username').filter(id=user_id).first()
+
+    @database_sync_to_async
+    def save_message(self, content):
+        try:
+            now = time.monotonic()
+            touch_room = now - self.room_touched_at >= self.room_touch_interval
+            msg = Message(room=self.room, sender=self.user, content=content)
+            msg.broadcast_on_save = False
+            msg.save(touch_room=touch_room)
+            count_new_messages([msg])
+            if touch_room:
+                self.room_touched_at = now
+                self.untouched_message = None
+            else:
+                self.untouched_message = msg
+            return serialize_message(msg, self.user)
+        except Exception as e:
+            return {'error': str(e)}
+
+    @database_sync_to_async
+    def touch_room(self, message):
+        ChatRoom.objects.filter(pk=self.room.pk).filter(
+            Q(last_message_at__lt=message.timestamp) | Q(last_message_at__isnull=True)
+        ).update(last_message_at=message.timestamp)
+
+    async def buffer_message(self, content):
+        """
+        Write-behind variant of save_message: the message is acknowledged and
+        broadcast right away and persisted by the next buffer flush.
+        """
         try:
-            sender = User.objects.get(id=sender_id)
-            room = ChatRoom.objects.get(name=self.room_name)
-            msg = Message.objects.create(room=room, sender=sender, content=content)
-            return {
-                'id': str(msg.id),
-                'room': str(room.id),
-                'sender': sender.username,
-                'content': msg.content,
-                'timestamp': msg.timestamp.isoformat()
-            }
+            msg = await get_write_buffer().add(Message(room=self.room, sender=self.user, content=content))
+            return serialize_message(msg, self.user)
         except Exception as e:
             return {'error': str(e)}
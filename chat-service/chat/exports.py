@@ -0,0 +1,241 @@
+import csv
+import hashlib
+import json
+import os
+import tempfile
+import zipfile
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.http import content_disposition_header
+
+from chat.models import ChatExport, Message
+from chat.uploads import BLOCK_SIZE
+
+
+DEFAULT_EXPORTS = {
+    'CHUNK_SIZE': 2000,        # rows per fetch from the server-side cursor
+    'TTL': 7 * 24 * 3600,      # seconds a background export is kept
+}
+
+FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+COLUMNS = [
+    'id', 'timestamp', 'sender_id', 'sender', 'content', 'reply_to', 'edited', 'deleted',
+    'attachment_path', 'attachment_name', 'attachment_type', 'attachment_size',
+]
+
+MANIFEST_COLUMNS = [
+    'message_id', 'timestamp', 'sender', 'name', 'type', 'size', 'sha256', 'archive_path', 'status',
+]
+
+
+def get_export_config():
+    return {**DEFAULT_EXPORTS, **getattr(settings, 'CHAT_EXPORTS', {})}
+
+
+class Echo:
+    """csv.writer target that hands back each formatted row instead of buffering it."""
+
+    def write(self, value):
+        return value
+
+
+def room_messages(room):
+    """
+    Every message of the room, oldest first, read through a server-side
+    cursor. No lower bound on timestamp: imported history or a skewed
+    worker clock can date messages before the room itself.
+    """
+    return Message.objects.filter(room_id=room.pk).order_by('timestamp', 'id').values_list(
+        'id', 'timestamp', 'sender_id', 'sender__username', 'content', 'reply_to_id', 'edited', 'deleted',
+        'file', 'file_type',
+    ).iterator(chunk_size=get_export_config()['CHUNK_SIZE'])
+
+
+def attachment_size(path):
+    try:
+        return default_storage.size(path)
+    except OSError:
+        return None
+
+
+def export_rows(room, sizes=True):
+    """
+    One dict per message, in COLUMNS order; the attachment columns are the
+    message's manifest entry. sizes=False skips the storage lookup of each
+    attachment's size, for callers that read the file anyway.
+    """
+    for message_id, timestamp, sender_id, sender, content, reply_to, edited, deleted, path, file_type in room_messages(room):
+        yield {
+            'id': str(message_id),
+            'timestamp': timestamp.isoformat(),
+            'sender_id': sender_id,
+            'sender': sender,
+            'content': content,
+            'reply_to': str(reply_to) if reply_to else None,
+            'edited': edited,
+            'deleted': deleted,
+            'attachment_path': path or None,
+            'attachment_name': os.path.basename(path) if path else None,
+            'attachment_type': file_type if path else None,
+            'attachment_size': attachment_size(path) if path and sizes else None,
+        }
+
+
+def format_lines(rows, export_format):
+    if export_format == 'csv':
+        writer = csv.writer(Echo())
+        yield writer.writerow(COLUMNS)
+        for row in rows:
+            yield writer.writerow(['' if row[column] is None else row[column] for column in COLUMNS])
+    else:
+        for row in rows:
+            yield json.dumps(row, ensure_ascii=False) + '\n'
+
+
+def iter_blocks(lines, block_size=BLOCK_SIZE):
+    """Join lines into blocks of about block_size bytes, so the response is not written row by row."""
+    block, size = [], 0
+    for line in lines:
+        data = line.encode('utf-8')
+        block.append(data)
+        size += len(data)
+        if size >= block_size:
+            yield b''.join(block)
+            block, size = [], 0
+    if block:
+        yield b''.join(block)
+
+
+async def aiter_blocks(blocks):
+    """
+    Serve a sync export to an ASGI server, which would otherwise read it into
+    memory whole. Every block is pulled on the same thread, the one holding
+    the connection the server-side cursor lives on.
+    """
+    while True:
+        block = await sync_to_async(next, thread_sensitive=True)(blocks, None)
+        if block is None:
+            return
+        yield block
+
+
+def export_response(request, room, export_format):
+    """
+    Stream the room's transcript as NDJSON or CSV. Memory stays flat
+    whatever the size of the room: rows come CHUNK_SIZE at a time from a
+    server-side cursor and go out in blocks as they are formatted.
+    """
+    blocks = iter_blocks(format_lines(export_rows(room), export_format))
+    if isinstance(getattr(request, '_request', request), ASGIRequest):
+        blocks = aiter_blocks(blocks)
+    response = StreamingHttpResponse(blocks, content_type=f"{FORMATS[export_format]}; charset=utf-8")
+    response['Content-Disposition'] = content_disposition_header(
+        as_attachment=True, filename=f"{room.name}.{export_format}",
+    )
+    response['Cache-Control'] = 'no-store'
+    return response
+
+
+def copy_attachment(archive, path, archive_path):
+    """Copy a stored attachment into the archive in blocks. Returns its size and SHA-256."""
+    sha256 = hashlib.sha256()
+    size = 0
+    with default_storage.open(path, 'rb') as source, archive.open(archive_path, 'w', force_zip64=True) as target:
+        while True:
+            block = source.read(BLOCK_SIZE)
+            if not block:
+                break
+            sha256.update(block)
+            size += len(block)
+            target.write(block)
+    return size, sha256.hexdigest()
+
+
+def copy_into(archive, name, source):
+    source.seek(0)
+    with archive.open(name, 'w', force_zip64=True) as entry:
+        while True:
+            block = source.read(BLOCK_SIZE)
+            if not block:
+                break
+            entry.write(block)
+
+
+def write_archive(export, target):
+    """
+    Write the export's zip to `target` in one pass over the room: the
+    transcript, the attachments under attachments/<message id>/ and
+    manifest.csv, which lists each attachment with its SHA-256 or marks it
+    missing when storage no longer has it. Returns the message and
+    attachment counts.
+    """
+    counts = {'messages': 0, 'attachments': 0}
+    with zipfile.ZipFile(target, 'w', compression=zipfile.ZIP_DEFLATED, allowZip64=True) as archive, \
+            tempfile.TemporaryFile() as transcript, tempfile.TemporaryFile() as manifest:
+        writer = csv.writer(Echo())
+        manifest.write(writer.writerow(MANIFEST_COLUMNS).encode('utf-8'))
+
+        def archived(rows):
+            for row in rows:
+                counts['messages'] += 1
+                if row['attachment_path']:
+                    archive_path = f"attachments/{row['id']}/{row['attachment_name']}"
+                    try:
+                        size, sha256 = copy_attachment(archive, row['attachment_path'], archive_path)
+                        status = 'included'
+                        counts['attachments'] += 1
+                    except OSError as e:
+                        print(f"Attachment {row['attachment_path']} missing from export {export.pk}: {e}")
+                        size, sha256, archive_path, status = None, '', '', 'missing'
+                    row['attachment_size'] = size
+                    manifest.write(writer.writerow([
+                        row['id'], row['timestamp'], row['sender'] or '', row['attachment_name'],
+                        row['attachment_type'] or '', '' if size is None else size, sha256, archive_path, status,
+                    ]).encode('utf-8'))
+                yield row
+
+        for block in iter_blocks(format_lines(archived(export_rows(export.room, sizes=False)), export.format)):
+            transcript.write(block)
+        copy_into(archive, f"transcript.{export.format}", transcript)
+        copy_into(archive, 'manifest.csv', manifest)
+    return counts['messages'], counts['attachments']
+
+
+def run_export(export):
+    """Build a background export into storage, recording the outcome on the ChatExport."""
+    ChatExport.objects.filter(pk=export.pk).update(status='running')
+    try:
+        with tempfile.TemporaryFile() as target:
+            messages, attachments = write_archive(export, target)
+            target.seek(0)
+            export.file.save(f"{export.room.name}_{export.pk}.zip", File(target), save=False)
+    except Exception as e:
+        print(f"Chat export {export.pk} failed: {e}")
+        export.status, export.error = 'failed', str(e)
+    else:
+        export.status, export.messages, export.attachments = 'done', messages, attachments
+    export.finished_at = timezone.now()
+    export.save(update_fields=['status', 'error', 'file', 'messages', 'attachments', 'finished_at'])
+    return export
+
+
+def cleanup_expired_exports():
+    cutoff = timezone.now() - timedelta(seconds=get_export_config()['TTL'])
+    count = 0
+    for export in ChatExport.objects.filter(created_at__lt=cutoff).iterator():
+        if export.file:
+            export.file.delete(save=False)
+        export.delete()
+        count += 1
+    return count
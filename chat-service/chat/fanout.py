@@ -0,0 +1,61 @@
+from collections import deque
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+
+
+def room_group_name(room_name):
+    return f"chat_{room_name}"
+
+
+def serialize_message(message, sender=None):
+    """
+    Payload delivered to websocket clients for a saved message.
+    Clients (and ChatConsumer itself) dedupe on its `id`.
+    """
+    sender = sender if sender is not None else message.sender
+    return {
+        'id': str(message.id),
+        'room': str(message.room_id),
+        'sender': sender.username if sender else None,
+        'sender_id': sender.id if sender else None,
+        'content': message.content,
+        'file_name': message.file_name,
+        'file_type': message.file_type,
+        'timestamp': message.timestamp.isoformat(),
+    }
+
+
+def message_event(payload):
+    return {'type': 'chat_message', 'message': payload}
+
+
+async def broadcast_message(room_name, payload, channel_layer=None):
+    """Direct fan-out for writers that are already async (ChatConsumer)."""
+    channel_layer = channel_layer or get_channel_layer()
+    await channel_layer.group_send(room_group_name(room_name), message_event(payload))
+
+
+def broadcast_message_sync(room_name, payload):
+    async_to_sync(broadcast_message)(room_name, payload)
+
+
+class RecentMessageIds:
+    """
+    Bounded record of the message ids already delivered on one socket, so a
+    message that reaches the consumer twice is only sent to the client once.
+    """
+
+    def __init__(self, size=512):
+        self._order = deque()
+        self._ids = set()
+        self.size = size
+
+    def seen(self, message_id):
+        if message_id in self._ids:
+            return True
+        self._ids.add(message_id)
+        self._order.append(message_id)
+        if len(self._order) > self.size:
+            self._ids.discard(self._order.popleft())
+        return False
@@ -0,0 +1,47 @@
+import hashlib
+
+from channels_redis.core import RedisChannelLayer
+
+
+def jump_hash(key, buckets):
+    """
+    Jump consistent hash (Lamping & Veach): maps a 64-bit key to one of
+    `buckets` shards. Going from n to n + 1 shards moves only 1/(n + 1) of
+    the keys, all of them to the new shard.
+    """
+    shard, candidate = -1, 0
+    while candidate < buckets:
+        shard = candidate
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        candidate = int((shard + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return shard
+
+
+def shard_key(value):
+    """
+    64-bit hash of a group or channel name. Process-local channels
+    ("specific.<client>!<id>") hash on the part up to the "!", so a direct
+    send lands on the shard the owning worker receives from.
+    """
+    if isinstance(value, bytes):
+        value = value.decode("utf8")
+    if "!" in value:
+        value = value[:value.index("!") + 1]
+    return int.from_bytes(hashlib.blake2b(value.encode("utf8"), digest_size=8).digest(), "big")
+
+
+class ShardedRedisChannelLayer(RedisChannelLayer):
+    """
+    RedisChannelLayer spread over several Redis instances (CONFIG["hosts"]).
+
+    Every room group lives on one shard: group_add, group_discard and the
+    group lookup of group_send go to the shard of the group, and each member
+    channel receives on the shard of its worker. Adding an n-th shard moves
+    1/n of the groups, whose sockets rejoin when they reconnect; the stock
+    crc32 ranges move about half of them whatever n is.
+    """
+
+    def consistent_hash(self, value):
+        if self.ring_size == 1:
+            return 0
+        return jump_hash(shard_key(value), self.ring_size)
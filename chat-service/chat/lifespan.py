@@ -0,0 +1,49 @@
+import asyncio
+import sys
+
+from chat.buffer import get_write_behind_config, get_write_buffer
+from notifications.buffer import get_notification_buffer
+
+
+async def flush_worker_buffers():
+    """
+    Write out what this worker still holds: unsaved messages of the
+    write-behind buffer, then the chat notifications of the last interval.
+    Runs once, when the worker shuts down; the buffers' own timers handle
+    everything before that.
+    """
+    if get_write_behind_config()['ENABLED']:
+        try:
+            await get_write_buffer().flush()
+        except Exception as e:
+            print("Write-behind flush failed on shutdown:", e)
+    await get_notification_buffer().flush()
+
+
+async def lifespan(scope, receive, send):
+    """ASGI lifespan handler, for servers that send lifespan events (uvicorn, hypercorn)."""
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await flush_worker_buffers()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+def flush_on_reactor_shutdown():
+    """
+    Daphne sends no lifespan events, but runs the application on Twisted's
+    asyncio reactor: flush from a "before shutdown" trigger, which the
+    reactor waits for before it stops. A no-op under other servers.
+    """
+    reactor = sys.modules.get('twisted.internet.reactor')
+    if reactor is None:
+        return False
+    from twisted.internet.defer import Deferred
+
+    reactor.addSystemEventTrigger(
+        'before', 'shutdown', lambda: Deferred.fromFuture(asyncio.ensure_future(flush_worker_buffers())),
+    )
+    return True
@@ -0,0 +1,173 @@
+import asyncio
+import multiprocessing
+import os
+import queue
+import shutil
+import subprocess
+import time
+
+import redis
+from django.core.management.base import BaseCommand, CommandError
+
+from chat.layers import ShardedRedisChannelLayer
+
+
+MESSAGE = {
+    'type': 'chat_message',
+    'message': {
+        'sender': "advocate",
+        'content': "Update on the case: the hearing has been moved, please review the new documents.",
+        'timestamp': "2025-01-01T12:00:00+00:00",
+    },
+}
+
+
+def bench_worker(hosts, worker, options, barrier, results):
+    """One ASGI worker's share of the load, in its own process so the client side scales with the shards."""
+    results.put(asyncio.run(drive_worker(hosts, worker, options, barrier)))
+
+
+async def drive_worker(hosts, worker, options, barrier):
+    layer = ShardedRedisChannelLayer(hosts=hosts, capacity=100000, expiry=60)
+    groups = [f"bench_{worker}_{i}" for i in range(options["rooms"] // options["processes"] or 1)]
+    channels = []
+    for group in groups:
+        for _ in range(options["members"]):
+            channel = await layer.new_channel()
+            await layer.group_add(group, channel)
+            channels.append(channel)
+
+    received = 0
+
+    async def receive(channel):
+        nonlocal received
+        while True:
+            await layer.receive(channel)
+            received += 1
+
+    sent = 0
+
+    async def send(offset, deadline):
+        nonlocal sent
+        index = offset
+        while time.perf_counter() < deadline:
+            await layer.group_send(groups[index % len(groups)], MESSAGE)
+            sent += 1
+            index += options["concurrency"]
+
+    await asyncio.get_running_loop().run_in_executor(None, barrier.wait)
+    receivers = [asyncio.ensure_future(receive(channel)) for channel in channels]
+    started = time.perf_counter()
+    deadline = started + options["seconds"]
+    await asyncio.gather(*(send(offset, deadline) for offset in range(options["concurrency"])))
+    elapsed = time.perf_counter() - started
+    # deliveries still in flight at the deadline count, as long as they arrive promptly
+    drain_until = time.perf_counter() + 2
+    while received < sent * options["members"] and time.perf_counter() < drain_until:
+        await asyncio.sleep(0.05)
+    for receiver in receivers:
+        receiver.cancel()
+    await asyncio.gather(*receivers, return_exceptions=True)
+    await layer.close_pools()
+    return sent, received, elapsed
+
+
+class Command(BaseCommand):
+    help = (
+        "Group messages/sec through ShardedRedisChannelLayer as the number of Redis shards grows. "
+        "Starts local redis-server processes unless --hosts lists existing ones; the load comes "
+        "from --processes worker processes, each with its own rooms and member channels."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--shards", default="1,2,4", help="Comma-separated shard counts to compare.")
+        parser.add_argument("--hosts", default="",
+                            help="Comma-separated Redis URLs to use instead of starting redis-server. Flushed!")
+        parser.add_argument("--redis-server", default="redis-server")
+        parser.add_argument("--base-port", type=int, default=7400)
+        parser.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+        parser.add_argument("--rooms", type=int, default=400)
+        parser.add_argument("--members", type=int, default=4, help="Channels in each room group.")
+        parser.add_argument("--concurrency", type=int, default=50, help="group_send calls in flight per process.")
+        parser.add_argument("--seconds", type=float, default=5.0)
+
+    def handle(self, *args, **options):
+        counts = sorted({int(count) for count in options["shards"].split(",")})
+        servers = []
+        if options["hosts"]:
+            hosts = [host.strip() for host in options["hosts"].split(",") if host.strip()]
+            if counts[-1] > len(hosts):
+                raise CommandError(f"{counts[-1]} shards need {counts[-1]} --hosts, got {len(hosts)}.")
+        else:
+            hosts, servers = self.start_servers(counts[-1], options)
+        try:
+            self.stdout.write(
+                f"{options['processes']} processes, {options['rooms']} rooms of {options['members']}, "
+                f"{options['seconds']:.0f}s per run"
+            )
+            self.stdout.write(f"{'shards':>6} {'sends/s':>10} {'deliveries/s':>13} {'lost':>6}")
+            baseline = None
+            for count in counts:
+                sent, received, elapsed = self.run(hosts[:count], options)
+                rate = received / elapsed
+                baseline = baseline or rate
+                self.stdout.write(
+                    f"{count:>6} {sent / elapsed:>10.0f} {rate:>13.0f} {sent * options['members'] - received:>6}"
+                    f"  ({rate / baseline:.1f}x)"
+                )
+        finally:
+            for server in servers:
+                server.terminate()
+                server.wait()
+
+    def start_servers(self, count, options):
+        executable = shutil.which(options["redis_server"])
+        if executable is None:
+            raise CommandError(f"{options['redis_server']} not found; install Redis or pass --hosts.")
+        servers, hosts = [], []
+        for port in range(options["base_port"], options["base_port"] + count):
+            servers.append(subprocess.Popen(
+                [executable, "--port", str(port), "--bind", "127.0.0.1", "--save", "", "--appendonly", "no"],
+                stdout=subprocess.DEVNULL,
+            ))
+            hosts.append(f"redis://127.0.0.1:{port}")
+        for host in hosts:
+            self.wait_for(host)
+        return hosts, servers
+
+    @staticmethod
+    def wait_for(host, timeout=10):
+        client = redis.Redis.from_url(host, socket_connect_timeout=1)
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                return client.ping()
+            except redis.ConnectionError:
+                if time.monotonic() > deadline:
+                    raise CommandError(f"Redis at {host} did not come up.")
+                time.sleep(0.1)
+
+    def run(self, hosts, options):
+        for host in hosts:
+            redis.Redis.from_url(host).flushall()
+        load = {key: options[key] for key in ("processes", "rooms", "members", "concurrency", "seconds")}
+        context = multiprocessing.get_context("spawn")
+        barrier = context.Barrier(options["processes"])
+        results = context.Queue()
+        workers = [
+            context.Process(target=bench_worker, args=(hosts, worker, load, barrier, results))
+            for worker in range(options["processes"])
+        ]
+        for worker in workers:
+            worker.start()
+        try:
+            outcomes = [results.get(timeout=options["seconds"] + 60) for _ in workers]
+        except queue.Empty:
+            for worker in workers:
+                worker.kill()
+            raise CommandError("A benchmark process did not report back; see its traceback above.")
+        for worker in workers:
+            worker.join()
+        sent = sum(outcome[0] for outcome in outcomes)
+        received = sum(outcome[1] for outcome in outcomes)
+        return sent, received, max(outcome[2] for outcome in outcomes)
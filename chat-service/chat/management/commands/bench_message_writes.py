@@ -0,0 +1,55 @@
+import asyncio
+import time
+import uuid
+
+from channels.db import database_sync_to_async
+from django.core.management.base import BaseCommand
+
+from chat.buffer import MessageWriteBuffer
+from chat.models import ChatRoom, Message
+
+
+class Command(BaseCommand):
+    help = "Messages/sec one worker persists with per-message saves versus the write-behind buffer."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--messages", type=int, default=5000)
+        parser.add_argument("--rooms", type=int, default=10)
+        parser.add_argument("--batch", type=int, default=200)
+        parser.add_argument("--flush-interval", type=float, default=0.05)
+
+    def handle(self, *args, **options):
+        rooms = [
+            ChatRoom.objects.create(name=f"bench_{uuid.uuid4().hex}", room_type="group")
+            for _ in range(options["rooms"])
+        ]
+        try:
+            direct = asyncio.run(self.direct(rooms, options["messages"]))
+            buffered = asyncio.run(self.buffered(rooms, options))
+        finally:
+            ChatRoom.objects.filter(pk__in=[room.pk for room in rooms]).delete()
+
+        self.stdout.write(f"{'per-message save':<24} {direct:>10.0f} msg/s")
+        self.stdout.write(f"{'write-behind buffer':<24} {buffered:>10.0f} msg/s  ({buffered / direct:.1f}x)")
+
+    async def direct(self, rooms, count):
+        def save(room, i):
+            message = Message(room=room, content=f"direct {i}")
+            message.broadcast_on_save = False
+            message.save()
+
+        start = time.perf_counter()
+        for i in range(count):
+            await database_sync_to_async(save)(rooms[i % len(rooms)], i)
+        return count / (time.perf_counter() - start)
+
+    async def buffered(self, rooms, options):
+        count = options["messages"]
+        buffer = MessageWriteBuffer(max_batch=options["batch"], flush_interval=options["flush_interval"])
+        start = time.perf_counter()
+        for i in range(count):
+            await buffer.add(Message(room=rooms[i % len(rooms)], content=f"buffered {i}"))
+        await buffer.flush()
+        elapsed = time.perf_counter() - start
+        assert buffer.flushed == count
+        return count / elapsed
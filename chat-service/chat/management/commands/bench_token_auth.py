@@ -0,0 +1,94 @@
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import jwt
+import requests
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+
+from chat.utils.auth import get_token_cache, validate_token, verify_token_locally
+
+
+class _ValidateTokenHandler(BaseHTTPRequestHandler):
+    """Stand-in for user-service's /auth/validate-token/ endpoint."""
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        body = json.dumps({"valid": True, "id": 1, "role": "client"}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Command(BaseCommand):
+    help = "Compare local JWT verification (with and without the cache) against remote introspection."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--iterations", type=int, default=2000)
+
+    def handle(self, *args, **options):
+        iterations = options["iterations"]
+        jwt_settings = settings.SIMPLE_JWT
+        token = jwt.encode(
+            {
+                "token_type": "access",
+                "user_id": 1,
+                "role": "client",
+                "jti": uuid.uuid4().hex,
+                "exp": int(time.time()) + 3600,
+            },
+            jwt_settings["SIGNING_KEY"],
+            algorithm=jwt_settings.get("ALGORITHM", "HS256"),
+        )
+
+        server = ThreadingHTTPServer(("127.0.0.1", 0), _ValidateTokenHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base_url = f"http://127.0.0.1:{server.server_address[1]}"
+        cache = get_token_cache()
+
+        def remote_unpooled():
+            requests.get(f"{base_url}/auth/validate-token/", headers={"Authorization": f"Bearer {token}"}, timeout=3)
+
+        def remote_pooled():
+            cache.clear()
+            validate_token(token)
+
+        def local_uncached():
+            verify_token_locally(token)
+
+        def local_cached():
+            validate_token(token)
+
+        try:
+            with override_settings(USER_SERVICE_URL=base_url):
+                with override_settings(TOKEN_VERIFICATION={"MODE": "remote"}):
+                    self._run("remote, new connection per call", remote_unpooled, iterations)
+                    self._run("remote, pooled keep-alive session", remote_pooled, iterations)
+                with override_settings(TOKEN_VERIFICATION={"MODE": "local"}):
+                    self._run("local signature check, no cache", local_uncached, iterations)
+                    cache.clear()
+                    self._run("local, cached claims", local_cached, iterations)
+                    self.stdout.write(f"cache stats: {cache.stats()}")
+        finally:
+            server.shutdown()
+            cache.clear()
+
+    def _run(self, label, func, iterations):
+        func()
+        start = time.perf_counter()
+        for _ in range(iterations):
+            func()
+        elapsed = time.perf_counter() - start
+        self.stdout.write(
+            f"{label:<40} {iterations / elapsed:>12.0f} ops/s {elapsed / iterations * 1e6:>10.1f} us/op"
+        )
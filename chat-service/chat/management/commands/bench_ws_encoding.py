@@ -0,0 +1,86 @@
+import asyncio
+import time
+import uuid
+from types import SimpleNamespace
+
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from django.utils import timezone
+
+from chat.codecs import JSON, MSGPACK, frame_size
+from chat.consumers import ChatConsumer
+from chat.fanout import RecentMessageIds
+
+
+def sample_message(i, room_id):
+    return {
+        'id': str(uuid.uuid4()),
+        'room': room_id,
+        'sender': f"advocate{i % 7}",
+        'sender_id': i % 7,
+        'content': f"Update {i} on the case: the hearing has been moved, please review the new documents.",
+        'file_name': None,
+        'file_type': None,
+        'timestamp': timezone.now().isoformat(),
+    }
+
+
+class Command(BaseCommand):
+    help = "Bytes on the wire and consumer CPU per N room events for JSON vs msgpack, per-event vs batched frames."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--messages", type=int, default=10000)
+        parser.add_argument("--burst", type=int, default=20,
+                            help="Events arriving together within one batch window.")
+        parser.add_argument("--max-batch", type=int, default=100)
+
+    def handle(self, *args, **options):
+        room_id = str(uuid.uuid4())
+        events = [{'type': 'chat_message', 'message': sample_message(i, room_id)} for i in range(options["messages"])]
+
+        self.stdout.write(f"{options['messages']} messages, bursts of {options['burst']}")
+        self.stdout.write(f"{'mode':<18} {'frames':>8} {'wire KiB':>10} {'CPU ms':>9}")
+        baseline = None
+        for name, codec, batching in [
+            ("json", JSON, False),
+            ("msgpack", MSGPACK, False),
+            ("json batched", JSON, True),
+            ("msgpack batched", MSGPACK, True),
+        ]:
+            frames, wire, cpu = asyncio.run(self.deliver(events, codec, batching, options))
+            baseline = baseline or cpu
+            self.stdout.write(
+                f"{name:<18} {frames:>8} {wire / 1024:>10.1f} {cpu * 1000:>9.1f}  ({baseline / cpu:.1f}x)"
+            )
+
+    async def deliver(self, events, codec, batching, options):
+        """Drive ChatConsumer.chat_message directly and record what it would put on the socket."""
+        sent = []
+
+        async def base_send(message):
+            sent.append(message)
+
+        # the window is closed by hand after each burst, so the timer never fires
+        with override_settings(CHAT_DELIVERY={
+            'BATCH_WINDOW': 3600, 'MAX_BATCH': options["max_batch"], 'SEND_QUEUE': options["burst"],
+        }):
+            consumer = ChatConsumer()
+            consumer.setup_delivery(codec, batching)
+        consumer.base_send = base_send
+        consumer.user = SimpleNamespace(id=-1)
+        consumer.delivered = RecentMessageIds()
+
+        started = time.process_time()
+        for start in range(0, len(events), options["burst"]):
+            for event in events[start:start + options["burst"]]:
+                await consumer.chat_message(event)
+            if batching and consumer.outbox_flush is not None:
+                consumer.outbox_flush.cancel()
+                consumer.outbox_flush = None
+                await consumer.flush_outbox()
+            await consumer.send_queue.join()
+        cpu = time.process_time() - started
+        consumer.sender.cancel()
+
+        wire = sum(frame_size(len(m.get('bytes') or m.get('text', '').encode())) for m in sent)
+        return len(sent), wire, cpu
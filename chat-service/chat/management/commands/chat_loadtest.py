@@ -0,0 +1,279 @@
+import asyncio
+import contextlib
+import io
+import json
+import random
+import resource
+import time
+import tracemalloc
+import uuid
+
+import jwt
+import msgpack
+import redis
+from asgiref.sync import sync_to_async
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import override_settings
+
+from chat.middleware import JWTAuthMiddleware
+from chat.models import ChatRoom, Message, Participant, User
+from chat.routing import websocket_urlpatterns
+from notifications.models import Notification
+
+
+MARKER = "loadtest|"
+# Nothing listens here, so Redis calls fail with an immediate "connection refused".
+UNREACHABLE_REDIS = "redis://127.0.0.1:1/0"
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def make_token(user):
+    jwt_settings = settings.SIMPLE_JWT
+    payload = {
+        'token_type': 'access',
+        'user_id': user.id,
+        'username': user.username,
+        'jti': uuid.uuid4().hex,
+        'exp': int(time.time()) + 3600,
+    }
+    return jwt.encode(payload, jwt_settings['SIGNING_KEY'], algorithm=jwt_settings.get('ALGORITHM', 'HS256'))
+
+
+class Client:
+    """One simulated socket: sends marked messages and timestamps every copy it receives."""
+
+    def __init__(self, application, room, user, msgpack_frames, batch):
+        query = f"token={make_token(user)}" + ("&batch=1" if batch else "")
+        subprotocols = ["chat.msgpack"] if msgpack_frames else None
+        self.communicator = WebsocketCommunicator(application, f"/ws/chat/{room.name}/?{query}", subprotocols=subprotocols)
+        self.room = room
+        self.msgpack = msgpack_frames
+        self.latencies = []
+        self.sent = 0
+        self.errors = 0
+
+    async def connect(self):
+        connected, _ = await self.communicator.connect(timeout=30)
+        if not connected:
+            raise RuntimeError("Connection refused")
+
+    async def send(self):
+        data = {'message': f"{MARKER}{time.perf_counter_ns()}"}
+        if self.msgpack:
+            await self.communicator.send_to(bytes_data=msgpack.packb(data))
+        else:
+            await self.communicator.send_to(text_data=json.dumps(data))
+        self.sent += 1
+
+    async def read(self):
+        while True:
+            output = await self.communicator.receive_output(timeout=None)
+            if output['type'] != 'websocket.send':
+                return
+            received = time.perf_counter_ns()
+            if output.get('bytes') is not None:
+                frame = msgpack.unpackb(output['bytes'], raw=False)
+            else:
+                frame = json.loads(output['text'])
+            for event in frame['events'] if frame.get('type') == 'batch' else [frame]:
+                message = event.get('message')
+                if isinstance(message, dict) and message.get('content', '').startswith(MARKER):
+                    self.latencies.append((received - int(message['content'][len(MARKER):])) / 1e6)
+                elif 'error' in event:
+                    self.errors += 1
+
+
+class Command(BaseCommand):
+    help = (
+        "Load test one chat worker: N simulated websocket clients in this process send at a "
+        "fixed rate; reports fan-out latency percentiles, throughput and memory per connection. "
+        "Uses the configured database; the channel layer is in-memory unless --layer redis."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--clients", type=int, default=200)
+        parser.add_argument("--rooms", type=int, default=10, help="Clients are spread evenly over this many rooms.")
+        parser.add_argument("--senders", type=float, default=0.1, help="Fraction of clients that send.")
+        parser.add_argument("--rate", type=float, default=1.0, help="Messages per second per sender.")
+        parser.add_argument("--duration", type=float, default=10.0, help="Seconds of sending.")
+        parser.add_argument("--drain", type=float, default=5.0, help="Seconds to wait for in-flight deliveries.")
+        parser.add_argument("--layer", choices=["memory", "redis"], default="memory")
+        parser.add_argument("--redis-url", default=None,
+                            help="Redis for presence, unread counters and --layer redis (default: REDIS_URL).")
+        parser.add_argument("--msgpack", action="store_true", help="Negotiate binary msgpack frames.")
+        parser.add_argument("--batch", action="store_true", help="Connect with ?batch=1.")
+        parser.add_argument("--write-behind", action="store_true", help="Persist through the write-behind buffer.")
+        parser.add_argument("--keep-limits", action="store_true",
+                            help="Keep CHAT_THROTTLE instead of lifting it for the run.")
+        parser.add_argument("--seed", type=int, default=None)
+
+    def handle(self, *args, **options):
+        random.seed(options["seed"])
+        redis_url = options["redis_url"] or settings.REDIS_URL
+        if not self.redis_available(redis_url):
+            if options["layer"] == "redis":
+                raise CommandError(f"--layer redis needs a reachable Redis, {redis_url} is not.")
+            self.stdout.write(self.style.WARNING(
+                f"Redis is not reachable at {redis_url}: presence and unread counters are left "
+                "failing fast and their cost is not part of these numbers."
+            ))
+            redis_url = UNREACHABLE_REDIS
+        overrides = {
+            'REDIS_URL': redis_url,
+            'CHANNEL_LAYERS': self.channel_layers(options["layer"], redis_url),
+            'CHAT_WRITE_BEHIND': {**settings.CHAT_WRITE_BEHIND, 'ENABLED': options["write_behind"]},
+            'TOKEN_VERIFICATION': {**settings.TOKEN_VERIFICATION, 'MODE': 'local', 'REMOTE_FALLBACK': False},
+        }
+        if not options["keep_limits"]:
+            overrides['CHAT_THROTTLE'] = {'CONNECTION_RATE': 1e9, 'CONNECTION_BURST': 1e9, 'USER_RATE': 1e9, 'USER_BURST': 1e9}
+
+        # the service reports its own failures with print(); keep them out of the report
+        service_log = io.StringIO()
+        with override_settings(**overrides), contextlib.redirect_stdout(service_log):
+            rooms, users = self.create_fixtures(options["clients"], options["rooms"])
+            try:
+                report = asyncio.run(self.run(rooms, users, options))
+            finally:
+                Message.objects.filter(room__in=rooms).delete()
+                ChatRoom.objects.filter(pk__in=[room.pk for room in rooms]).delete()
+                self.delete_users(users)
+
+        self.write_report(report, options)
+        lines = service_log.getvalue().count("\n")
+        if lines:
+            self.stdout.write(f"service log: {lines} lines, first: {service_log.getvalue().splitlines()[0]}")
+
+    @staticmethod
+    def channel_layers(layer, redis_url):
+        if layer == "redis":
+            return {'default': {'BACKEND': 'chat.layers.ShardedRedisChannelLayer', 'CONFIG': {'hosts': [redis_url]}}}
+        return {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+
+    @staticmethod
+    def redis_available(url):
+        try:
+            return redis.Redis.from_url(url, socket_connect_timeout=1, socket_timeout=1).ping()
+        except redis.RedisError:
+            return False
+
+    @staticmethod
+    def create_fixtures(clients, room_count):
+        run = uuid.uuid4().hex[:8]
+        rooms = [ChatRoom.objects.create(name=f"loadtest_{run}_{i}", room_type="group") for i in range(room_count)]
+        users = User.objects.bulk_create([
+            User(username=f"loadtest_{run}_{i}", role="client") for i in range(clients)
+        ])
+        Participant.objects.bulk_create([
+            Participant(room=rooms[i % room_count], user=user) for i, user in enumerate(users)
+        ])
+        return rooms, users
+
+    @staticmethod
+    def delete_users(users):
+        # users belongs to user-service; a model delete() would also clear
+        # auth relation tables that do not exist in this database
+        Notification.objects.filter(user__in=users).delete()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"DELETE FROM {connection.ops.quote_name(User._meta.db_table)} WHERE id = ANY(%s)",
+                [[user.pk for user in users]],
+            )
+
+    async def run(self, rooms, users, options):
+        application = JWTAuthMiddleware(URLRouter(websocket_urlpatterns))
+        # only traced while connecting: tracing the send phase would skew the latencies
+        tracemalloc.start()
+        memory_before = tracemalloc.get_traced_memory()[0]
+
+        clients = [
+            Client(application, rooms[i % len(rooms)], user, options["msgpack"], options["batch"])
+            for i, user in enumerate(users)
+        ]
+        connect_started = time.perf_counter()
+        await asyncio.gather(*(client.connect() for client in clients))
+        connect_time = time.perf_counter() - connect_started
+        readers = [asyncio.ensure_future(client.read()) for client in clients]
+        await asyncio.sleep(0.5)  # greetings and presence snapshots
+        memory_connected = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        for client in clients:
+            client.latencies.clear()
+
+        senders = random.sample(clients, max(1, round(len(clients) * options["senders"])))
+        started = time.perf_counter()
+        await asyncio.gather(*(self.send_loop(client, options["rate"], options["duration"]) for client in senders))
+        send_time = time.perf_counter() - started
+
+        expected = sum(client.sent * self.room_size(client.room, clients) for client in senders)
+        deadline = time.perf_counter() + options["drain"]
+        while sum(len(client.latencies) for client in clients) < expected and time.perf_counter() < deadline:
+            await asyncio.sleep(0.05)
+        elapsed = time.perf_counter() - started
+
+        for reader in readers:
+            reader.cancel()
+        await asyncio.gather(*readers, return_exceptions=True)
+        await asyncio.gather(*(client.communicator.disconnect() for client in clients), return_exceptions=True)
+        # the consumers' queries ran on the sync worker thread; do not leave its connection behind
+        await sync_to_async(connections.close_all)()
+
+        latencies = [latency for client in clients for latency in client.latencies]
+        return {
+            'clients': len(clients),
+            'senders': len(senders),
+            'connect_time': connect_time,
+            'sent': sum(client.sent for client in senders),
+            'send_time': send_time,
+            'expected': expected,
+            'delivered': len(latencies),
+            'elapsed': elapsed,
+            'latencies': latencies,
+            'errors': sum(client.errors for client in clients),
+            'memory_per_connection': (memory_connected - memory_before) / len(clients),
+            'max_rss_kib': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        }
+
+    @staticmethod
+    def room_size(room, clients):
+        return sum(1 for client in clients if client.room is room)
+
+    @staticmethod
+    async def send_loop(client, rate, duration):
+        interval = 1.0 / rate
+        await asyncio.sleep(random.uniform(0, interval))  # spread senders over the first interval
+        next_send = time.perf_counter()
+        end = next_send + duration
+        while next_send < end:
+            await client.send()
+            next_send += interval
+            await asyncio.sleep(max(0.0, next_send - time.perf_counter()))
+
+    def write_report(self, report, options):
+        latencies = report['latencies']
+        layer = options["layer"] + (", msgpack" if options["msgpack"] else "") + (", batched" if options["batch"] else "")
+        self.stdout.write(
+            f"{report['clients']} clients in {options['rooms']} rooms ({layer}), "
+            f"{report['senders']} senders at {options['rate']:g} msg/s for {options['duration']:g}s"
+        )
+        self.stdout.write(f"connect      {report['connect_time']:.2f}s for all clients "
+                          f"({report['clients'] / report['connect_time']:.0f} connections/s)")
+        self.stdout.write(f"sent         {report['sent']} messages ({report['sent'] / report['send_time']:.0f} msg/s)")
+        self.stdout.write(f"delivered    {report['delivered']}/{report['expected']} "
+                          f"({report['delivered'] / report['elapsed']:.0f} deliveries/s), {report['errors']} errors")
+        self.stdout.write(
+            "latency ms   "
+            f"p50 {percentile(latencies, 0.50):.1f}  p95 {percentile(latencies, 0.95):.1f}  "
+            f"p99 {percentile(latencies, 0.99):.1f}  max {max(latencies, default=0):.1f}"
+        )
+        self.stdout.write(f"memory       {report['memory_per_connection'] / 1024:.1f} KiB per connection (Python heap), "
+                          f"max RSS {report['max_rss_kib'] / 1024:.0f} MiB")
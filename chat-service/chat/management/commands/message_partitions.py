@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from chat.partitions import archive_cold_partitions, ensure_partitions, list_partitions
+
+
+class Command(BaseCommand):
+    help = "Create upcoming monthly message partitions and archive cold ones."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--ahead", type=int, default=None,
+                            help="Months to prepare beyond the current one (default: CHAT_PARTITIONS['MONTHS_AHEAD']).")
+        parser.add_argument("--archive", action="store_true",
+                            help="Detach and archive partitions older than the hot window.")
+        parser.add_argument("--hot-months", type=int, default=None,
+                            help="Months kept in Postgres when archiving (default: CHAT_PARTITIONS['HOT_MONTHS']).")
+        parser.add_argument("--list", action="store_true", help="Only list the attached partitions.")
+
+    def handle(self, *args, **options):
+        if not options["list"]:
+            for name in ensure_partitions(options["ahead"]):
+                self.stdout.write(f"Created {name}")
+            if options["archive"]:
+                for path in archive_cold_partitions(options["hot_months"]):
+                    self.stdout.write(f"Archived to {path}")
+        for month, name in list_partitions():
+            self.stdout.write(f"{month:%Y-%m}  {name}")
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from chat.unread import rebuild_unread_counters
+
+
+class Command(BaseCommand):
+    help = "Rebuild the Redis unread counters from Postgres, e.g. after a Redis flush."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user", type=int, action="append", dest="user_ids",
+                            help="Only rebuild these users (repeatable).")
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        rebuilt = rebuild_unread_counters(options["user_ids"], batch_size=options["batch_size"])
+        self.stdout.write(f"Rebuilt unread counters for {rebuilt} users")
@@ -0,0 +1,57 @@
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = (
+        "Serve the ASGI application with several daphne worker processes sharing one listening "
+        "socket. The workers meet through the channel layer (CHANNEL_REDIS_SHARDS)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="0.0.0.0")
+        parser.add_argument("--port", type=int, default=8000)
+        parser.add_argument("--workers", type=int, default=int(os.environ.get("CHAT_ASGI_WORKERS", os.cpu_count() or 1)))
+        parser.add_argument("--application", default="chat_service.asgi:application")
+
+    def handle(self, *args, **options):
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind((options["host"], options["port"]))
+        listener.listen(1024)
+        # each worker accepts from the inherited socket; the kernel spreads the connections
+        command = [sys.executable, "-m", "daphne", "--fd", str(listener.fileno()), options["application"]]
+
+        def start():
+            return subprocess.Popen(command, pass_fds=[listener.fileno()])
+
+        workers = [start() for _ in range(options["workers"])]
+        self.stdout.write(f"Serving on {options['host']}:{options['port']} with {len(workers)} workers")
+
+        stopping = False
+
+        def stop(signum, frame):
+            nonlocal stopping
+            stopping = True
+            for worker in workers:
+                worker.terminate()
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+        try:
+            while not stopping:
+                for index, worker in enumerate(workers):
+                    if worker.poll() is not None and not stopping:
+                        print(f"ASGI worker {worker.pid} exited with {worker.returncode}, restarting")
+                        workers[index] = start()
+                time.sleep(1)
+        finally:
+            for worker in workers:
+                worker.wait()
+            listener.close()
@@ -0,0 +1,101 @@
+import redis
+from django.conf import settings
+from django.http import Http404
+
+from chat import unread
+from chat.models import Participant
+
+
+# Marks a cached set as loaded, so users without any room are cached too
+LOADED = ""
+
+
+def user_rooms_key(user_id):
+    """Set of the ids of the rooms a user actively participates in, loaded from Postgres on demand."""
+    return f"chat:user:{user_id}:rooms"
+
+
+def user_rooms_version_key(user_id):
+    """Bumped on every invalidation, so a fill that read Postgres before it is discarded."""
+    return f"chat:user:{user_id}:rooms:version"
+
+
+def load_user_rooms(user_id):
+    return {
+        str(room_id) for room_id in
+        Participant.objects.filter(user_id=user_id, is_removed=False).order_by().values_list("room_id", flat=True)
+    }
+
+
+def get_user_rooms(user_id):
+    """
+    Ids (as strings) of the user's rooms: one SMEMBERS, or one indexed query
+    on a miss. The fill watches the version key: a membership change that
+    commits while the query runs aborts it, instead of the pre-change rooms
+    being cached for CHAT_ROOM_MEMBERS_TTL.
+    """
+    key = user_rooms_key(user_id)
+    try:
+        pipe = unread.get_redis().pipeline()
+        pipe.watch(key, user_rooms_version_key(user_id))
+        rooms = pipe.smembers(key)
+    except redis.RedisError as e:
+        print("Membership cache unavailable:", e)
+        return load_user_rooms(user_id)
+    try:
+        if rooms:
+            rooms.discard(LOADED)
+            return rooms
+        rooms = load_user_rooms(user_id)
+        pipe.multi()
+        pipe.sadd(key, LOADED, *rooms)
+        pipe.expire(key, settings.CHAT_ROOM_MEMBERS_TTL)
+        pipe.execute()
+    except redis.WatchError:
+        pass  # invalidated meanwhile; the next check loads again
+    except redis.RedisError as e:
+        print("Membership cache update failed:", e)
+    finally:
+        pipe.reset()
+    return rooms
+
+
+def is_member(user_id, room_id):
+    """
+    Whether the user is an active participant of the room. A cached user
+    costs one Redis round trip and no query; the first check after a miss
+    loads all of the user's rooms at once.
+    """
+    key = user_rooms_key(user_id)
+    try:
+        pipe = unread.get_redis().pipeline(transaction=False)
+        pipe.exists(key)
+        pipe.sismember(key, str(room_id))
+        cached, member = pipe.execute()
+    except redis.RedisError as e:
+        # straight to Postgres: get_user_rooms would wait out the same timeout again
+        print("Membership cache unavailable:", e)
+        return str(room_id) in load_user_rooms(user_id)
+    if cached:
+        return bool(member)
+    return str(room_id) in get_user_rooms(user_id)
+
+
+def require_member(user_id, room_id):
+    """404 for rooms the user is not in, like the joined lookups this replaces."""
+    if not is_member(user_id, room_id):
+        raise Http404("No ChatRoom matches the given query.")
+
+
+def forget_membership(room_id, user_id):
+    """Drop the cached member set of the room and room set of the user after a membership change."""
+    try:
+        pipe = unread.get_redis().pipeline(transaction=False)
+        pipe.delete(unread.members_key(room_id), user_rooms_key(user_id))
+        pipe.incr(user_rooms_version_key(user_id))
+        pipe.expire(user_rooms_version_key(user_id), settings.CHAT_ROOM_MEMBERS_TTL)
+        pipe.incr(unread.members_version_key(room_id))
+        pipe.expire(unread.members_version_key(room_id), settings.CHAT_ROOM_MEMBERS_TTL)
+        pipe.execute()
+    except redis.RedisError as e:
+        print("Membership cache invalidation failed:", e)
@@ -0,0 +1,23 @@
+import threading
+from collections import Counter
+
+
+# Process-local counters: every ASGI worker reports its own. Scrape each
+# worker, or sum across them, to get the fleet-wide picture.
+_lock = threading.Lock()
+_counters = Counter()
+
+
+def increment(name, value=1):
+    with _lock:
+        _counters[name] += value
+
+
+def snapshot():
+    with _lock:
+        return dict(_counters)
+
+
+def reset():
+    with _lock:
+        _counters.clear()
@@ -0,0 +1,62 @@
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from channels.middleware import BaseMiddleware
+
+from chat.utils.auth import validate_token
+
+
+# Browsers cannot set headers on a websocket, so clients either append
+# ?token=<jwt> or offer the subprotocols ["bearer", "<jwt>"].
+TOKEN_SUBPROTOCOL = 'bearer'
+
+
+class TokenUser:
+    """The verified claims of a websocket's access token, exposed as scope['user']."""
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(self, user_data):
+        self.id = self.pk = user_data['id']
+        self.username = user_data.get('username')
+        self.role = user_data.get('role')
+        self.claims = user_data
+
+    def __str__(self):
+        return f"TokenUser {self.id}"
+
+
+def get_token(scope):
+    """Returns (token, subprotocol the token was offered with, if any)."""
+    subprotocols = scope.get('subprotocols') or []
+    if TOKEN_SUBPROTOCOL in subprotocols:
+        index = subprotocols.index(TOKEN_SUBPROTOCOL)
+        if index + 1 < len(subprotocols):
+            return subprotocols[index + 1], TOKEN_SUBPROTOCOL
+    query = parse_qs(scope.get('query_string', b'').decode())
+    token = query.get('token', [None])[0]
+    return token, None
+
+
+class JWTAuthMiddleware(BaseMiddleware):
+    """
+    Verifies the access token once, during the handshake. Sockets without a
+    valid token are closed before they are accepted, so consumers can rely on
+    scope['user'] being a TokenUser.
+    """
+
+    async def __call__(self, scope, receive, send):
+        token, subprotocol = get_token(scope)
+        # validate_token may fall back to user-service over HTTP; keep it off the loop
+        user_data = await sync_to_async(validate_token, thread_sensitive=False)(token) if token else None
+        if not user_data:
+            return await self.reject(receive, send)
+
+        scope = dict(scope, user=TokenUser(user_data), auth_subprotocol=subprotocol)
+        return await super().__call__(scope, receive, send)
+
+    @staticmethod
+    async def reject(receive, send):
+        message = await receive()
+        if message['type'] == 'websocket.connect':
+            await send({'type': 'websocket.close', 'code': 4401})
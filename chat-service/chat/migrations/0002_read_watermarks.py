@@ -0,0 +1,45 @@
+# Generated by Django 5.2.7 on 2026-10-18 18:07
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def read_by_to_watermarks(apps, schema_editor):
+    """Each participant's watermark becomes the latest message they had marked read."""
+    Message = apps.get_model('chat', 'Message')
+    Participant = apps.get_model('chat', 'Participant')
+    ReadBy = Message.read_by.through
+    latest_read = (
+        ReadBy.objects.filter(message__room_id=OuterRef('room_id'), user_id=OuterRef('user_id'))
+        .order_by('-message__timestamp', '-message_id')
+    )
+    Participant.objects.update(
+        last_read_message_id=Subquery(latest_read.values('message_id')[:1]),
+        last_read_at=Subquery(latest_read.values('message__timestamp')[:1]),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='participant',
+            name='last_read_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='participant',
+            name='last_read_message',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='chat.message'),
+        ),
+        migrations.RunPython(read_by_to_watermarks, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='message',
+            name='read_by',
+        ),
+    ]
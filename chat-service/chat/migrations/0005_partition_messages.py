@@ -0,0 +1,120 @@
+"""
+Turn chat_message into a table range-partitioned by month on "timestamp".
+
+Postgres requires the partition key in every unique constraint, so the
+primary key becomes (id, timestamp) and the foreign keys pointing at a
+message lose their database constraint. Existing rows are copied into the
+new partitions, which takes a while on a large table: run it in a
+maintenance window.
+"""
+from datetime import datetime, timezone
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+PARENT = 'chat_message'
+DEFAULT_PARTITION = 'chat_message_default'
+OLD = 'chat_message_old'
+MONTHS_AHEAD = 2
+
+
+def month_start(value):
+    return datetime(value.year, value.month, 1, tzinfo=timezone.utc)
+
+
+def next_month(month):
+    return month.replace(year=month.year + month.month // 12, month=month.month % 12 + 1)
+
+
+def definitions(cursor):
+    """Secondary indexes and outgoing foreign keys of chat_message."""
+    cursor.execute(
+        "SELECT pg_get_indexdef(indexrelid) FROM pg_index WHERE indrelid = %s::regclass AND NOT indisprimary",
+        [PARENT],
+    )
+    indexes = [row[0].replace(' ON ONLY ', ' ON ') for row in cursor.fetchall()]
+    cursor.execute(
+        "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint WHERE conrelid = %s::regclass AND contype = 'f'",
+        [PARENT],
+    )
+    return indexes, cursor.fetchall()
+
+
+def stored_columns(cursor, table):
+    """Columns that can be copied, i.e. everything except generated ones."""
+    cursor.execute(
+        "SELECT quote_ident(attname) FROM pg_attribute "
+        "WHERE attrelid = %s::regclass AND attnum > 0 AND NOT attisdropped AND attgenerated = '' "
+        "ORDER BY attnum",
+        [table],
+    )
+    return ', '.join(row[0] for row in cursor.fetchall())
+
+
+def rebuild(cursor, partitioned):
+    indexes, foreign_keys = definitions(cursor)
+    columns = stored_columns(cursor, PARENT)
+
+    cursor.execute(f"ALTER TABLE {PARENT} RENAME TO {OLD}")
+    like = f"LIKE {OLD} INCLUDING DEFAULTS INCLUDING GENERATED INCLUDING STORAGE"
+    if partitioned:
+        cursor.execute(f'CREATE TABLE {PARENT} ({like}) PARTITION BY RANGE ("timestamp")')
+        cursor.execute(f"CREATE TABLE {DEFAULT_PARTITION} PARTITION OF {PARENT} DEFAULT")
+        cursor.execute(f'SELECT min("timestamp") FROM {OLD}')
+        first = cursor.fetchone()[0]
+        now = datetime.now(timezone.utc)
+        month = month_start(min(first, now) if first else now)
+        last = month_start(now)
+        for _ in range(MONTHS_AHEAD):
+            last = next_month(last)
+        while month <= last:
+            cursor.execute(
+                f"CREATE TABLE {PARENT}_p{month:%Y_%m} PARTITION OF {PARENT} FOR VALUES FROM (%s) TO (%s)",
+                [month, next_month(month)],
+            )
+            month = next_month(month)
+    else:
+        cursor.execute(f"CREATE TABLE {PARENT} ({like})")
+
+    cursor.execute(f"INSERT INTO {PARENT} ({columns}) SELECT {columns} FROM {OLD}")
+    # drops the partitions too when going backwards
+    cursor.execute(f"DROP TABLE {OLD}")
+
+    primary_key = '(id, "timestamp")' if partitioned else '(id)'
+    cursor.execute(f"ALTER TABLE {PARENT} ADD CONSTRAINT {PARENT}_pkey PRIMARY KEY {primary_key}")
+    for index in indexes:
+        cursor.execute(index)
+    for name, definition in foreign_keys:
+        cursor.execute(f"ALTER TABLE {PARENT} ADD CONSTRAINT {name} {definition}")
+
+
+def partition_messages(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        rebuild(cursor, partitioned=True)
+
+
+def unpartition_messages(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        rebuild(cursor, partitioned=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0004_upload_sessions'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='message',
+            name='reply_to',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='replies', to='chat.message'),
+        ),
+        migrations.AlterField(
+            model_name='participant',
+            name='last_read_message',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='chat.message'),
+        ),
+        migrations.RunPython(partition_messages, unpartition_messages),
+    ]
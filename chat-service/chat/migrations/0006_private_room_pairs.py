@@ -0,0 +1,62 @@
+# Generated by Django 5.2.7 on 2026-10-18 18:47
+
+from collections import defaultdict
+
+from django.db import migrations, models
+
+
+def backfill_pairs(apps, schema_editor):
+    """
+    Key the existing private rooms of exactly two users by their pair. Where
+    clients created several rooms for the same pair, the oldest one keeps
+    the key and the others stay reachable by id only.
+    """
+    ChatRoom = apps.get_model('chat', 'ChatRoom')
+    Participant = apps.get_model('chat', 'Participant')
+    members = defaultdict(set)
+    rows = Participant.objects.filter(room__room_type='private').values_list('room_id', 'user_id')
+    for room_id, user_id in rows.iterator(chunk_size=2000):
+        members[room_id].add(user_id)
+
+    taken = set()
+    rooms = []
+    for room in ChatRoom.objects.filter(room_type='private').order_by('created_at').only('id').iterator(chunk_size=2000):
+        users = members.get(room.id, ())
+        if len(users) != 2:
+            continue
+        pair = tuple(sorted(users))
+        if pair in taken:
+            continue
+        taken.add(pair)
+        room.pair_low, room.pair_high = pair
+        rooms.append(room)
+    ChatRoom.objects.bulk_update(rooms, ['pair_low', 'pair_high'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0005_partition_messages'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatroom',
+            name='pair_high',
+            field=models.IntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='chatroom',
+            name='pair_low',
+            field=models.IntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(backfill_pairs, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='chatroom',
+            constraint=models.UniqueConstraint(condition=models.Q(('room_type', 'private')), fields=('pair_low', 'pair_high'), name='chatroom_private_pair_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='chatroom',
+            constraint=models.CheckConstraint(condition=models.Q(('pair_low__lt', models.F('pair_high'))), name='chatroom_pair_ordered'),
+        ),
+    ]
@@ -1,10 +1,15 @@
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector, SearchVectorField
+from django.db.models import F, Func, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce, Substr
 from django.conf import settings
 from django.utils import timezone
 from django.contrib.auth.models import AbstractUser
 from django.core.exceptions import ValidationError
 import uuid
 import mimetypes
+from datetime import datetime, timezone as dt_timezone
 
 
 class User(AbstractUser):
@@ -17,6 +22,108 @@ class User(AbstractUser):
 
 
 
+def subquery_count(queryset):
+    return Coalesce(
+        Subquery(
+            queryset.order_by()
+            .annotate(total=Func(F('pk'), function='COUNT', output_field=models.IntegerField()))
+            .values('total')
+        ),
+        0
+    )
+
+
+# Stand-ins for a participant that has not read anything yet, so watermark
+# comparisons never have to deal with NULL.
+NEVER_READ_AT = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+NEVER_READ_ID = uuid.UUID(int=0)
+
+
+def read_watermark_q(read_at, read_id):
+    """
+    Messages after a read watermark in history order (timestamp, id). The
+    arguments may be values or expressions such as OuterRef.
+    """
+    return Q(timestamp__gt=read_at) | Q(timestamp=read_at, id__gt=read_id)
+
+
+class ChatRoomQuerySet(models.QuerySet):
+
+    def inbox(self, user_id):
+        """
+        Rooms of a user with participant count, last message preview and unread
+        count annotated onto each row, so the whole inbox is a single query.
+        """
+        latest = Message.objects.filter(room=OuterRef('pk')).order_by('-timestamp', '-id')
+        unread = (
+            Message.objects.filter(room=OuterRef('pk'), deleted=False)
+            .filter(read_watermark_q(OuterRef('read_at'), OuterRef('read_id')))
+            .exclude(sender_id=user_id)
+        )
+        return (
+            self.filter(participants__user_id=user_id)
+            .annotate(
+                # reuses the participants join of the filter above
+                read_at=Coalesce(F('participants__last_read_at'), Value(NEVER_READ_AT)),
+                read_id=Coalesce(F('participants__last_read_message_id'), Value(NEVER_READ_ID)),
+            )
+            .annotate(
+                participant_count=subquery_count(Participant.objects.filter(room=OuterRef('pk'))),
+                unread_count=subquery_count(unread),
+                last_message_id=Subquery(latest.values('id')[:1]),
+                last_message_preview=Subquery(latest.annotate(preview=Substr('content', 1, 100)).values('preview')[:1]),
+                last_message_sender_id=Subquery(latest.values('sender_id')[:1]),
+                last_message_sender=Subquery(latest.values('sender__username')[:1]),
+            )
+            .order_by(F('last_message_at').desc(nulls_last=True), '-created_at')
+        )
+
+    def private_room(self, user_id, other_id):
+        """The one-to-one room of two users, looked up through chatroom_private_pair_uniq."""
+        low, high = sorted((user_id, other_id))
+        return self.filter(room_type='private', pair_low=low, pair_high=high).first()
+
+    def get_or_create_private(self, user_id, other_id):
+        """
+        Returns (room, created). Two requests creating the same pair at once
+        both insert, the unique index rejects the second one, and it returns
+        the winner's room instead.
+        """
+        room = self.private_room(user_id, other_id)
+        if room is not None:
+            return room, False
+        low, high = sorted((user_id, other_id))
+        try:
+            with transaction.atomic():
+                room = ChatRoom(room_type='private', pair_low=low, pair_high=high)
+                room.name = f"private_{room.id.hex}"
+                room.save(force_insert=True)
+                # created one by one so the membership signals refresh both users' cached rooms
+                Participant.objects.create(room=room, user_id=low)
+                Participant.objects.create(room=room, user_id=high)
+        except IntegrityError:
+            room = self.filter(room_type='private', pair_low=low, pair_high=high).first()
+            if room is None:
+                raise
+            return room, False
+        return room, True
+
+
+class ParticipantQuerySet(models.QuerySet):
+
+    def with_unread_count(self):
+        """Annotate each participant's unread count, computed from its read watermark."""
+        unread = (
+            Message.objects.filter(room_id=OuterRef('room_id'), deleted=False)
+            .filter(read_watermark_q(OuterRef('read_at'), OuterRef('read_id')))
+            .exclude(sender_id=OuterRef('user_id'))
+        )
+        return self.annotate(
+            read_at=Coalesce(F('last_read_at'), Value(NEVER_READ_AT)),
+            read_id=Coalesce(F('last_read_message_id'), Value(NEVER_READ_ID)),
+        ).annotate(unread_count=subquery_count(unread))
+
+
 class ChatRoom(models.Model):
     ROOM_TYPES = [
         ('private', 'Private'),
@@ -28,9 +135,21 @@ class ChatRoom(models.Model):
     room_type = models.CharField(max_length=10, choices=ROOM_TYPES, default='private')
     created_at = models.DateTimeField(auto_now_add=True)
     last_message_at = models.DateTimeField(null=True, blank=True)
+    # The two users of a private room, smaller id first, so a pair has one
+    # canonical key; empty for group rooms.
+    pair_low = models.IntegerField(null=True, blank=True, editable=False)
+    pair_high = models.IntegerField(null=True, blank=True, editable=False)
+
+    objects = ChatRoomQuerySet.as_manager()
 
     class Meta:
         ordering = ['-last_message_at']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['pair_low', 'pair_high'], name='chatroom_private_pair_uniq', condition=Q(room_type='private'),
+            ),
+            models.CheckConstraint(condition=Q(pair_low__lt=F('pair_high')), name='chatroom_pair_ordered'),
+        ]
 
     def __str__(self):
         return self.name
@@ -50,6 +169,15 @@ class Participant(models.Model):
     joined_at = models.DateTimeField(auto_now_add=True)
     is_muted = models.BooleanField(default=False)
     is_removed = models.BooleanField(default=False)
+    # Read watermark: everything up to and including this message is read.
+    # No database constraint: chat_message is partitioned, so ids alone are
+    # not unique there, and archived partitions take their rows with them.
+    last_read_message = models.ForeignKey(
+        'Message', null=True, blank=True, on_delete=models.SET_NULL, related_name='+', db_constraint=False
+    )
+    last_read_at = models.DateTimeField(null=True, blank=True)
+
+    objects = ParticipantQuerySet.as_manager()
 
     class Meta:
         unique_together = ('room', 'user')  
@@ -58,6 +186,33 @@ class Participant(models.Model):
     def __str__(self):
         return f"{self.user.username} in {self.room.name}"
 
+    @property
+    def read_watermark(self):
+        return (self.last_read_at or NEVER_READ_AT, self.last_read_message_id or NEVER_READ_ID)
+
+    def mark_read(self, message):
+        """
+        Advance the watermark to message. It never moves backwards, so late or
+        out-of-order requests are harmless. Returns True if it moved.
+        """
+        moved = Participant.objects.filter(pk=self.pk).filter(
+            Q(last_read_at__isnull=True)
+            | Q(last_read_at__lt=message.timestamp)
+            | Q(last_read_at=message.timestamp, last_read_message_id__lt=message.id)
+        ).update(last_read_message=message, last_read_at=message.timestamp)
+        if moved:
+            self.last_read_message = message
+            self.last_read_at = message.timestamp
+        return bool(moved)
+
+    def unread_messages(self):
+        read_at, read_id = self.read_watermark
+        return (
+            Message.objects.filter(room_id=self.room_id, deleted=False)
+            .filter(read_watermark_q(read_at, read_id))
+            .exclude(sender_id=self.user_id)
+        )
+
 
 
 class Message(models.Model):
@@ -76,32 +231,55 @@ class Message(models.Model):
     file_name = models.CharField(max_length=255, blank=True, null=True)
     file_type = models.CharField(max_length=50, blank=True, null=True)
     timestamp = models.DateTimeField(default=timezone.now)
-    read_by = models.ManyToManyField(User, related_name='read_messages', blank=True)
     edited = models.BooleanField(default=False)
     deleted = models.BooleanField(default=False)
     status = models.CharField(max_length=10, choices=MESSAGE_STATUS, default='sent')
-    reply_to = models.ForeignKey('self', null=True, blank=True, on_delete=models.SET_NULL, related_name='replies')
+    reply_to = models.ForeignKey(
+        'self', null=True, blank=True, on_delete=models.SET_NULL, related_name='replies', db_constraint=False
+    )
+    # Maintained by Postgres on every write; searched through the GIN index below.
+    search_vector = models.GeneratedField(
+        expression=SearchVector('content', config='english'),
+        output_field=SearchVectorField(),
+        db_persist=True,
+    )
+
+    # Writers that broadcast the message themselves set this to False so the
+    # post_save fallback in chat.signals does not fan it out a second time.
+    broadcast_on_save = True
 
     class Meta:
+        # The table is range-partitioned by month on timestamp (migration 0005,
+        # chat.partitions); its primary key in Postgres is (id, timestamp).
         ordering = ['timestamp']
         indexes = [
             models.Index(fields=['room', 'timestamp']),
             models.Index(fields=['sender', 'timestamp']),
+            GinIndex(fields=['search_vector'], name='chat_message_search_idx'),
         ]
 
-    def save(self, *args, **kwargs):
+    def save(self, *args, touch_room=True, **kwargs):
         if self.file:
             self.file_name = self.file.name
             self.file_type, _ = mimetypes.guess_type(self.file.name)
         super().save(*args, **kwargs)
-        self.room.last_message_at = self.timestamp
-        self.room.save(update_fields=['last_message_at'])
+        if touch_room:
+            self.room.last_message_at = self.timestamp
+            self.room.save(update_fields=['last_message_at'])
+
+    def readers(self):
+        """Participants whose read watermark has reached this message."""
+        return self.room.participants.filter(
+            Q(last_read_at__gt=self.timestamp)
+            | Q(last_read_at=self.timestamp, last_read_message_id__gte=self.id)
+        )
 
     def mark_read(self, user):
-        self.read_by.add(user)
+        participant = Participant.objects.filter(room_id=self.room_id, user=user).first()
+        return participant is not None and participant.mark_read(self)
 
     def is_read_by(self, user):
-        return self.read_by.filter(pk=user.pk).exists()
+        return self.readers().filter(user=user).exists()
 
     def clean(self):
         if not self.content and not self.file:
@@ -111,3 +289,84 @@ class Message(models.Model):
         sender_name = self.sender.username if self.sender else "Deleted User"
         preview = self.content[:20] + ("..." if len(self.content) > 20 else "")
         return f"{sender_name} @ {self.timestamp}: {preview}"
+
+
+class UploadSession(models.Model):
+    """
+    A resumable, chunked attachment upload. Chunks are stored as they arrive
+    and assembled into Message.file storage when the client completes it.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    room = models.ForeignKey(ChatRoom, on_delete=models.CASCADE, related_name='uploads')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='chat_uploads')
+    file_name = models.CharField(max_length=255)
+    file_type = models.CharField(max_length=50, blank=True, null=True)
+    total_size = models.BigIntegerField()
+    chunk_size = models.IntegerField()
+    sha256 = models.CharField(max_length=64, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['created_at']
+
+    @property
+    def total_chunks(self):
+        return max(1, -(-self.total_size // self.chunk_size))
+
+    def expected_chunk_size(self, index):
+        if index == self.total_chunks - 1:
+            return self.total_size - index * self.chunk_size
+        return self.chunk_size
+
+    def chunk_path(self, index):
+        return f"chat_uploads/{self.id}/{index:06d}.part"
+
+    def __str__(self):
+        return f"{self.file_name} ({self.total_size} bytes) by {self.user_id}"
+
+
+class UploadChunk(models.Model):
+    session = models.ForeignKey(UploadSession, on_delete=models.CASCADE, related_name='chunks')
+    index = models.IntegerField()
+    size = models.IntegerField()
+    sha256 = models.CharField(max_length=64)
+
+    class Meta:
+        unique_together = ('session', 'index')
+        ordering = ['index']
+
+
+class ChatExport(models.Model):
+    """
+    A room transcript built in the background (chat.exports.run_export), for
+    rooms too large to stream in one request: a zip of the transcript, the
+    attachments and a manifest of them with their checksums.
+    """
+    FORMATS = [
+        ('ndjson', 'NDJSON'),
+        ('csv', 'CSV'),
+    ]
+    STATUSES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    room = models.ForeignKey(ChatRoom, on_delete=models.CASCADE, related_name='exports')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='chat_exports')
+    format = models.CharField(max_length=10, choices=FORMATS, default='ndjson')
+    status = models.CharField(max_length=10, choices=STATUSES, default='pending')
+    file = models.FileField(upload_to='chat_exports/', blank=True, null=True)
+    messages = models.IntegerField(default=0)
+    attachments = models.IntegerField(default=0)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.format} export of {self.room_id} ({self.status})"
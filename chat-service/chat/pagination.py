@@ -0,0 +1,172 @@
+import base64
+import binascii
+import uuid
+from datetime import datetime, timedelta
+
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+
+
+def encode_position(timestamp, message_id):
+    raw = f"{timestamp.isoformat()}|{message_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def encode_cursor(message):
+    return encode_position(message.timestamp, message.id)
+
+
+def decode_cursor(value):
+    try:
+        timestamp, message_id = base64.urlsafe_b64decode(value.encode()).decode().split("|")
+        return datetime.fromisoformat(timestamp), uuid.UUID(message_id)
+    except (ValueError, binascii.Error, UnicodeDecodeError):
+        raise ValidationError({"cursor": "Invalid cursor."})
+
+
+class MessageCursorPagination:
+    """
+    Keyset pagination over (timestamp, id), served by the (room, timestamp) index.
+
+    Without a cursor the latest page is returned. `before=<cursor>` walks back
+    into older history and `after=<cursor>` fetches newer messages. Every page
+    is returned oldest first, and its `before`/`after` cursors point at its first
+    and last message.
+
+    Given a `floor` (the room's creation time) the page is read in time
+    windows, newest first, each bounded on "timestamp" so Postgres only scans
+    the monthly partitions it covers. Windows start at WINDOW and double
+    until the page is full or the floor is reached; the window reaching the
+    floor is open below, as imported history or a skewed worker clock can
+    date messages before their room.
+    """
+    page_size = 50
+    max_page_size = 200
+    window = timedelta(days=31)
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params.get("limit", self.page_size))
+        except ValueError:
+            raise ValidationError({"limit": "Must be an integer."})
+        return max(1, min(size, self.max_page_size))
+
+    def paginate_queryset(self, queryset, request, floor=None):
+        limit = self.get_page_size(request)
+        before = request.query_params.get("before")
+        after = request.query_params.get("after")
+        if before and after:
+            raise ValidationError({"cursor": "Use either 'before' or 'after', not both."})
+
+        if after:
+            timestamp, message_id = decode_cursor(after)
+            queryset = (
+                queryset.filter(timestamp__gte=timestamp)
+                .exclude(timestamp=timestamp, id__lte=message_id)
+                .order_by("timestamp", "id")
+            )
+            windows = self.newer_windows(timestamp) if floor else [(None, None)]
+            rows = self.fetch(queryset, windows, limit + 1)
+            self.has_more = len(rows) > limit
+            return rows[:limit]
+
+        upper = timezone.now()
+        if before:
+            timestamp, message_id = decode_cursor(before)
+            queryset = (
+                queryset.filter(timestamp__lte=timestamp)
+                .exclude(timestamp=timestamp, id__gte=message_id)
+            )
+            upper = timestamp
+        windows = self.older_windows(upper, floor) if floor else [(None, None)]
+        rows = self.fetch(queryset.order_by("-timestamp", "-id"), windows, limit + 1)
+        self.has_more = len(rows) > limit
+        rows = rows[:limit]
+        rows.reverse()
+        return rows
+
+    @staticmethod
+    def fetch(queryset, windows, count):
+        rows = []
+        for start, end in windows:
+            window = queryset
+            if start is not None:
+                window = window.filter(timestamp__gte=start)
+            if end is not None:
+                window = window.filter(timestamp__lt=end)
+            rows.extend(window[:count - len(rows)])
+            if len(rows) >= count:
+                break
+        return rows
+
+    def older_windows(self, upper, floor):
+        """[start, end) windows walking back from `upper` to `floor`; the first is open above, the last below."""
+        end, span = None, self.window
+        while True:
+            start = upper - span if end is None else end - span
+            if start <= floor:
+                yield None, end
+                return
+            yield start, end
+            end, span = start, span * 2
+
+    def newer_windows(self, lower):
+        """[start, end) windows walking forward from `lower`; the last is open above."""
+        start, span, now = lower, self.window, timezone.now()
+        while start + span < now:
+            yield start, start + span
+            start, span = start + span, span * 2
+        yield start, None
+
+    def get_paginated_response(self, page, data):
+        return Response({
+            "results": data,
+            "has_more": self.has_more,
+            "before": encode_cursor(page[0]) if page else None,
+            "after": encode_cursor(page[-1]) if page else None,
+        })
+
+
+class SearchCursorPagination(MessageCursorPagination):
+    """
+    Keyset pagination for search results ordered by (rank, timestamp, id),
+    all descending. `cursor=<cursor>` continues after the last row of a page.
+    """
+    page_size = 20
+    max_page_size = 100
+
+    @staticmethod
+    def encode(row):
+        raw = f"{row.rank!r}|{row.timestamp.isoformat()}|{row.id}"
+        return base64.urlsafe_b64encode(raw.encode()).decode()
+
+    @staticmethod
+    def decode(value):
+        try:
+            rank, timestamp, message_id = base64.urlsafe_b64decode(value.encode()).decode().split("|")
+            return float(rank), datetime.fromisoformat(timestamp), uuid.UUID(message_id)
+        except (ValueError, binascii.Error, UnicodeDecodeError):
+            raise ValidationError({"cursor": "Invalid cursor."})
+
+    def paginate_queryset(self, queryset, request):
+        limit = self.get_page_size(request)
+        cursor = request.query_params.get("cursor")
+        if cursor:
+            rank, timestamp, message_id = self.decode(cursor)
+            queryset = queryset.filter(
+                Q(rank__lt=rank)
+                | Q(rank=rank, timestamp__lt=timestamp)
+                | Q(rank=rank, timestamp=timestamp, id__lt=message_id)
+            )
+        rows = list(queryset.order_by("-rank", "-timestamp", "-id")[:limit + 1])
+        self.has_more = len(rows) > limit
+        return rows[:limit]
+
+    def get_paginated_response(self, page, data):
+        return Response({
+            "results": data,
+            "has_more": self.has_more,
+            "cursor": self.encode(page[-1]) if page and self.has_more else None,
+        })
@@ -0,0 +1,154 @@
+import gzip
+import re
+import tempfile
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+
+from chat.models import Message
+
+
+DEFAULT_PARTITIONS = {
+    'MONTHS_AHEAD': 2,               # partitions kept ready beyond the current month
+    'HOT_MONTHS': 0,                 # months kept in Postgres before archiving; 0 never archives
+    'ARCHIVE_PREFIX': 'chat_archive/',
+}
+
+PARENT = Message._meta.db_table
+DEFAULT_PARTITION = f"{PARENT}_default"
+PARTITION_RE = re.compile(rf"^{PARENT}_p(\d{{4}})_(\d{{2}})$")
+
+
+def get_partition_config():
+    return {**DEFAULT_PARTITIONS, **getattr(settings, 'CHAT_PARTITIONS', {})}
+
+
+def month_start(value):
+    return datetime(value.year, value.month, 1, tzinfo=timezone.utc)
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return month.replace(year=index // 12, month=index % 12 + 1)
+
+
+def partition_name(month):
+    return f"{PARENT}_p{month:%Y_%m}"
+
+
+def partition_month(name):
+    match = PARTITION_RE.match(name)
+    return datetime(int(match[1]), int(match[2]), 1, tzinfo=timezone.utc) if match else None
+
+
+def list_partitions():
+    """Monthly partitions currently attached to the message table, oldest first."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT inhrelid::regclass::text FROM pg_inherits WHERE inhparent = %s::regclass",
+            [PARENT],
+        )
+        names = [row[0] for row in cursor.fetchall()]
+    return sorted((month, name) for name in names if (month := partition_month(name)))
+
+
+def stored_columns():
+    return ', '.join(
+        connection.ops.quote_name(field.column)
+        for field in Message._meta.concrete_fields
+        if not field.generated
+    )
+
+
+def table_exists(cursor, name):
+    cursor.execute("SELECT to_regclass(%s) IS NOT NULL", [name])
+    return cursor.fetchone()[0]
+
+
+def create_partition(month):
+    """
+    Attach the partition for a month. Rows that already landed in the default
+    partition for that month are moved into it, since Postgres refuses to
+    attach a range the default partition still holds rows for.
+    """
+    name = partition_name(month)
+    bounds = [month, add_months(month, 1)]
+    columns = stored_columns()
+    with transaction.atomic(), connection.cursor() as cursor:
+        if table_exists(cursor, name):
+            return False
+        cursor.execute(
+            f"CREATE TABLE {name} (LIKE {PARENT} INCLUDING DEFAULTS INCLUDING GENERATED INCLUDING STORAGE)"
+        )
+        cursor.execute(
+            f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} "
+            f'WHERE "timestamp" >= %s AND "timestamp" < %s RETURNING {columns}) '
+            f"INSERT INTO {name} ({columns}) SELECT {columns} FROM moved",
+            bounds,
+        )
+        cursor.execute(f"ALTER TABLE {PARENT} ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s)", bounds)
+    return True
+
+
+def ensure_partitions(months_ahead=None):
+    """Create the partitions from this month to `months_ahead` months out. Returns the new ones."""
+    if months_ahead is None:
+        months_ahead = get_partition_config()['MONTHS_AHEAD']
+    current = month_start(datetime.now(timezone.utc))
+    created = []
+    for offset in range(months_ahead + 1):
+        month = add_months(current, offset)
+        if create_partition(month):
+            created.append(partition_name(month))
+    return created
+
+
+def archive_path(month):
+    return f"{get_partition_config()['ARCHIVE_PREFIX']}{partition_name(month)}.csv.gz"
+
+
+def archive_partition(month):
+    """
+    Detach a month from the message table, store its rows as gzipped CSV
+    under ARCHIVE_PREFIX and drop it. The detach is its own short transaction
+    so the export does not hold a lock on the message table; a run that fails
+    halfway can simply be repeated. Returns the storage path.
+    """
+    name = partition_name(month)
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_inherits WHERE inhparent = %s::regclass AND inhrelid = to_regclass(%s)",
+            [PARENT, name],
+        )
+        if cursor.fetchone():
+            cursor.execute(f"ALTER TABLE {PARENT} DETACH PARTITION {name}")
+        elif not table_exists(cursor, name):
+            raise ValueError(f"No partition {name} to archive.")
+
+    path = archive_path(month)
+    with tempfile.TemporaryFile() as archive, connection.cursor() as cursor:
+        with gzip.GzipFile(fileobj=archive, mode='wb') as compressed:
+            # the search vector is generated, so it is rebuilt on restore instead of stored
+            cursor.copy_expert(
+                f'COPY (SELECT {stored_columns()} FROM {name} ORDER BY "timestamp", id) '
+                f"TO STDOUT WITH (FORMAT csv, HEADER)",
+                compressed,
+            )
+        archive.seek(0)
+        default_storage.delete(path)
+        default_storage.save(path, File(archive, name=path))
+        cursor.execute(f"DROP TABLE {name}")
+    return path
+
+
+def archive_cold_partitions(hot_months=None):
+    """Archive every partition older than the last `hot_months` months. Returns the storage paths."""
+    if hot_months is None:
+        hot_months = get_partition_config()['HOT_MONTHS']
+    if not hot_months:
+        return []
+    cutoff = add_months(month_start(datetime.now(timezone.utc)), -hot_months)
+    return [archive_partition(month) for month, _ in list_partitions() if month < cutoff]
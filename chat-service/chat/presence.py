@@ -0,0 +1,160 @@
+import asyncio
+import time
+import weakref
+from datetime import datetime, timezone
+
+import redis.asyncio as aioredis
+from django.conf import settings
+
+
+DEFAULT_PRESENCE = {
+    'TTL': 60,                       # a connection counts as online this long after its last heartbeat
+    'TYPING_INTERVAL': 3,            # at most one "typing" broadcast per socket per interval (seconds)
+    'LAST_SEEN_TTL': 30 * 24 * 3600,
+}
+
+
+def get_presence_config():
+    return {**DEFAULT_PRESENCE, **getattr(settings, 'CHAT_PRESENCE', {})}
+
+
+_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_redis():
+    """redis.asyncio connections are bound to a loop, so keep one client per event loop."""
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        client = aioredis.Redis.from_url(
+            settings.REDIS_URL,
+            decode_responses=True,
+            socket_connect_timeout=settings.REDIS_SOCKET_TIMEOUT,
+            socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+        )
+        _clients[loop] = client
+    return client
+
+
+def online_key(room_id):
+    """ZSET of "<user_id>|<channel_name>" scored by the connection's expiry time."""
+    return f"chat:presence:{room_id}"
+
+
+def last_seen_key(room_id):
+    """Hash of user_id -> ISO time the user's last connection to the room closed."""
+    return f"chat:last_seen:{room_id}"
+
+
+def _member(user_id, channel_name):
+    return f"{user_id}|{channel_name}"
+
+
+def _users(members):
+    return {int(member.split('|', 1)[0]) for member in members}
+
+
+def online_users(room_ids, client):
+    """
+    {room_id: ids of the users connected to it} for several rooms in one
+    round trip, for sync callers; `client` is a redis.Redis with decoded responses.
+    """
+    now = time.time()
+    pipe = client.pipeline(transaction=False)
+    for room_id in room_ids:
+        pipe.zrangebyscore(online_key(room_id), now, '+inf')
+    return {room_id: _users(members) for room_id, members in zip(room_ids, pipe.execute())}
+
+
+class RoomPresence:
+    """
+    Who is connected to a room, kept entirely in Redis. Every socket is one
+    entry that expires TTL seconds after its last heartbeat, so connections of
+    a crashed worker disappear on their own. A user is online while any of
+    their sockets is.
+    """
+
+    def __init__(self, room_id, client=None, config=None):
+        self.room_id = room_id
+        self.client = client or get_async_redis()
+        self.config = config or get_presence_config()
+
+    def _touch(self, pipe, user_id, channel_name):
+        now = time.time()
+        key = online_key(self.room_id)
+        pipe.zremrangebyscore(key, '-inf', now)
+        pipe.zrange(key, 0, -1)
+        pipe.zadd(key, {_member(user_id, channel_name): now + self.config['TTL']})
+        pipe.expire(key, self.config['TTL'] * 2)
+
+    async def join(self, user_id, channel_name):
+        """Register a socket. Returns True if the user just came online."""
+        pipe = self.client.pipeline(transaction=True)
+        self._touch(pipe, user_id, channel_name)
+        _, before, _, _ = await pipe.execute()
+        return user_id not in _users(before)
+
+    async def heartbeat(self, user_id, channel_name):
+        pipe = self.client.pipeline(transaction=True)
+        self._touch(pipe, user_id, channel_name)
+        await pipe.execute()
+
+    async def leave(self, user_id, channel_name):
+        """
+        Drop a socket. Returns the user's last-seen time if this was their last
+        socket in the room, otherwise None.
+        """
+        key = online_key(self.room_id)
+        pipe = self.client.pipeline(transaction=True)
+        pipe.zrem(key, _member(user_id, channel_name))
+        pipe.zremrangebyscore(key, '-inf', time.time())
+        pipe.zrange(key, 0, -1)
+        _, _, remaining = await pipe.execute()
+        if user_id in _users(remaining):
+            return None
+
+        last_seen = datetime.now(timezone.utc).isoformat()
+        pipe = self.client.pipeline(transaction=False)
+        pipe.hset(last_seen_key(self.room_id), str(user_id), last_seen)
+        pipe.expire(last_seen_key(self.room_id), self.config['LAST_SEEN_TTL'])
+        await pipe.execute()
+        return last_seen
+
+    async def snapshot(self):
+        key = online_key(self.room_id)
+        pipe = self.client.pipeline(transaction=False)
+        pipe.zremrangebyscore(key, '-inf', time.time())
+        pipe.zrange(key, 0, -1)
+        pipe.hgetall(last_seen_key(self.room_id))
+        _, members, last_seen = await pipe.execute()
+        online = _users(members)
+        return {
+            'online': sorted(online),
+            'last_seen': {user_id: seen for user_id, seen in last_seen.items() if int(user_id) not in online},
+        }
+
+
+class TypingThrottle:
+    """
+    Per-socket limiter for typing broadcasts: "typing" goes out at most once
+    per interval while the user keeps typing, "stopped" only after a "typing".
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.typing = False
+        self.sent_at = 0.0
+
+    def allow(self, typing):
+        now = time.monotonic()
+        if typing:
+            if self.typing and now - self.sent_at < self.interval:
+                return False
+            self.sent_at = now
+        elif not self.typing:
+            return False
+        self.typing = typing
+        return True
+
+    def reset(self):
+        self.typing = False
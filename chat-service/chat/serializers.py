@@ -1,5 +1,6 @@
 from rest_framework import serializers
-from .models import ChatRoom, Participant, Message, User
+from .models import ChatExport, ChatRoom, Participant, Message, UploadSession, User
+from .uploads import get_upload_config
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -17,6 +18,12 @@ class ParticipantSerializer(serializers.ModelSerializer):
         fields = ['id', 'user', 'role', 'joined_at', 'is_muted', 'is_removed']
 
 
+class ReadReceiptSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Participant
+        fields = ['user_id', 'last_read_message', 'last_read_at']
+
+
 class ChatRoomSerializer(serializers.ModelSerializer):
     participants = ParticipantSerializer(many=True, read_only=True)
     total_participants = serializers.SerializerMethodField()
@@ -26,9 +33,43 @@ class ChatRoomSerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'room_type', 'created_at', 'last_message_at', 'participants', 'total_participants']
 
     def get_total_participants(self, obj):
+        if hasattr(obj, 'participant_count'):
+            return obj.participant_count
         return obj.participants.count()
 
 
+class PrivateRoomSerializer(serializers.Serializer):
+    user_id = serializers.IntegerField()
+
+
+class MarkReadSerializer(serializers.Serializer):
+    message_id = serializers.UUIDField(required=False, allow_null=True)
+
+
+class ChatRoomInboxSerializer(serializers.ModelSerializer):
+    """
+    One inbox row, built from the annotations of ChatRoom.objects.inbox().
+    Participants are not included; they are fetched per room on demand.
+    """
+    total_participants = serializers.IntegerField(source='participant_count', read_only=True)
+    unread_count = serializers.IntegerField(read_only=True)
+    last_message = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ChatRoom
+        fields = ['id', 'name', 'room_type', 'created_at', 'last_message_at', 'total_participants', 'unread_count', 'last_message']
+
+    def get_last_message(self, obj):
+        if obj.last_message_id is None:
+            return None
+        return {
+            'id': str(obj.last_message_id),
+            'preview': obj.last_message_preview,
+            'sender_id': obj.last_message_sender_id,
+            'sender': obj.last_message_sender,
+        }
+
+
 
 class MessageSerializer(serializers.ModelSerializer):
     sender = UserSerializer(read_only=True)
@@ -55,3 +96,54 @@ class MessageSerializer(serializers.ModelSerializer):
         if request and hasattr(request, 'user'):
             validated_data['sender'] = request.user
         return super().create(validated_data)
+
+
+class MessageSearchResultSerializer(serializers.ModelSerializer):
+    sender = serializers.CharField(source='sender.username', default=None, read_only=True)
+    rank = serializers.FloatField(read_only=True)
+    headline = serializers.CharField(read_only=True)
+
+    class Meta:
+        model = Message
+        fields = ['id', 'room', 'sender', 'sender_id', 'timestamp', 'rank', 'headline']
+
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    total_chunks = serializers.IntegerField(read_only=True)
+    received_chunks = serializers.SerializerMethodField()
+
+    class Meta:
+        model = UploadSession
+        fields = [
+            'id', 'room', 'file_name', 'file_type', 'total_size', 'sha256',
+            'chunk_size', 'total_chunks', 'received_chunks', 'created_at'
+        ]
+        read_only_fields = ['id', 'room', 'chunk_size', 'created_at']
+
+    def get_received_chunks(self, obj):
+        return list(obj.chunks.values_list('index', flat=True))
+
+    def validate_total_size(self, value):
+        max_size = get_upload_config()['MAX_SIZE']
+        if not 0 < value <= max_size:
+            raise serializers.ValidationError(f"Must be between 1 and {max_size} bytes.")
+        return value
+
+    def validate_sha256(self, value):
+        if value and (len(value) != 64 or any(c not in '0123456789abcdef' for c in value.lower())):
+            raise serializers.ValidationError("Must be a hex SHA-256 digest.")
+        return value.lower()
+
+
+class UploadCompleteSerializer(serializers.Serializer):
+    content = serializers.CharField(default='', allow_blank=True, trim_whitespace=False)
+    reply_to = serializers.UUIDField(required=False, allow_null=True)
+
+
+class ChatExportSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ChatExport
+        fields = [
+            'id', 'room', 'format', 'status', 'messages', 'attachments', 'error', 'created_at', 'finished_at'
+        ]
+        read_only_fields = ['id', 'room', 'status', 'messages', 'attachments', 'error', 'created_at', 'finished_at']
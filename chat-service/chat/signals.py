@@ -1,15 +1,36 @@
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
-from chat.models import Message
+from chat.models import Message, Participant
 from chat.tasks import send_realtime_notification
+from chat.membership import forget_membership
+from chat.unread import clear_unread
 
 @receiver(post_save, sender=Message)
 def handle_new_messages(sender, instance, created, **kwargs):
-    if created:
-        send_realtime_notification.delay(
-            room_name=instance.room.name,
-            sender_id=instance.sender.id if instance.sender else None,
-            message_content=instance.content,
-            file_name=instance.file_name,
-            file_type=instance.file_type
-        )
+    """
+    Fan-out fallback for messages written outside the websocket (REST, admin).
+    ChatConsumer broadcasts its own writes and clears broadcast_on_save.
+    """
+    if created and instance.broadcast_on_save:
+        message_id = str(instance.id)
+        transaction.on_commit(lambda: send_realtime_notification.delay(message_id=message_id))
+
+
+@receiver(post_save, sender=Participant)
+@receiver(post_delete, sender=Participant)
+def handle_membership_change(sender, instance, created=False, **kwargs):
+    """
+    Drop the cached member set of the room (unread counters) and room set of
+    the user (permission checks); a removed participant also loses the room's
+    counter.
+    """
+    room_id, user_id = instance.room_id, instance.user_id
+    removed = instance.is_removed or kwargs.get('signal') is post_delete
+
+    def invalidate():
+        forget_membership(room_id, user_id)
+        if removed:
+            clear_unread(user_id, room_id)
+
+    transaction.on_commit(invalidate)
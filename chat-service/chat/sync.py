@@ -0,0 +1,56 @@
+import uuid
+from datetime import datetime, timezone
+
+from rest_framework.exceptions import ValidationError
+
+from chat.models import NEVER_READ_ID, Message, read_watermark_q
+from chat.pagination import decode_cursor
+
+
+def resolve_since(room, value):
+    """
+    The (timestamp, id) position a reconnecting client resumes after. `value`
+    is the id of the last message it saw, the `after` cursor of a history
+    page or an ISO timestamp. Returns None for a message id that is not in
+    the room (any more); raises ValueError for anything else.
+    """
+    try:
+        message_id = uuid.UUID(value)
+    except ValueError:
+        pass
+    else:
+        return Message.objects.filter(room=room, id=message_id).values_list('timestamp', 'id').first()
+
+    try:
+        timestamp = datetime.fromisoformat(value)
+    except ValueError:
+        try:
+            return decode_cursor(value)
+        except ValidationError:
+            raise ValueError(f"Invalid since: {value!r}")
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    # everything at that instant is resent; clients dedupe on id
+    return timestamp, NEVER_READ_ID
+
+
+def missed(room, position):
+    """
+    Live messages after `position` in history order. The lower bound on
+    timestamp lets the (room, timestamp) index and partition pruning skip
+    everything the client already has.
+    """
+    timestamp, message_id = position
+    return (
+        Message.objects.filter(room=room, deleted=False, timestamp__gte=timestamp)
+        .filter(read_watermark_q(timestamp, message_id))
+        .order_by('timestamp', 'id')
+    )
+
+
+def missed_batch(room, position, limit):
+    return list(missed(room, position).select_related('sender')[:limit])
+
+
+def gap_exceeds(room, position, limit):
+    return missed(room, position)[limit:limit + 1].exists()
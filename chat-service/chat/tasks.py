@@ -1,25 +1,67 @@
 from celery import shared_task
-from asgiref.sync import async_to_sync
-from channels.layers import get_channel_layer
-from chat.models import ChatRoom, Message
-from django.contrib.auth import get_user_model
+from chat.fanout import broadcast_message_sync, serialize_message
+from chat.exports import cleanup_expired_exports, run_export
+from chat.models import ChatExport, Message
+from chat.partitions import archive_cold_partitions, ensure_partitions
+from chat.unread import count_new_messages, rebuild_unread_counters
+from chat.uploads import cleanup_stale_uploads
+from notifications.services import fan_out_sync, notify_chat_messages
 
-User = get_user_model()
 
 @shared_task
-def send_realtime_notification(room_name, sender_id, message_content, file_name=None, file_type=None):
+def send_realtime_notification(message_id):
     """
     Sends message to WebSocket group after it is saved in DB
     """
-    channel_layer = get_channel_layer()
-
-    async_to_sync(channel_layer.group_send)(
-        f"chat_{room_name}",
-        {
-            "type": "chat_message",
-            "sender_id": sender_id,
-            "message": message_content,
-            "file_name": file_name,
-            "file_type": file_type
-        },
-    )
+    message = Message.objects.select_related("room", "sender").filter(id=message_id).first()
+    if message is None:
+        return
+    count_new_messages([message])
+    payload = serialize_message(message)
+    broadcast_message_sync(message.room.name, payload)
+    fan_out_sync(notify_chat_messages([payload]))
+
+
+@shared_task
+def rebuild_unread_counters_task(user_ids=None):
+    """
+    Reconcile the Redis unread counters with Postgres
+    """
+    return rebuild_unread_counters(user_ids)
+
+
+@shared_task
+def cleanup_stale_uploads_task():
+    """
+    Discards upload sessions that were never completed
+    """
+    return cleanup_stale_uploads()
+
+
+@shared_task
+def maintain_message_partitions_task():
+    """
+    Creates the upcoming monthly message partitions and archives cold ones
+    """
+    created = ensure_partitions()
+    archived = archive_cold_partitions()
+    return {"created": created, "archived": archived}
+
+
+@shared_task
+def export_chat_room_task(export_id):
+    """
+    Builds a requested room export into storage
+    """
+    export = ChatExport.objects.select_related("room").filter(id=export_id, status="pending").first()
+    if export is None:
+        return None
+    return run_export(export).status
+
+
+@shared_task
+def cleanup_expired_exports_task():
+    """
+    Deletes room exports older than CHAT_EXPORTS['TTL']
+    """
+    return cleanup_expired_exports()
@@ -1,3 +1,1343 @@
-from django.test import TestCase
+import asyncio
+import csv
+import gzip
+import hashlib
+import io
+import json
+import os
+import tempfile
+import time
+import uuid
+import zipfile
+from datetime import datetime, timedelta, timezone as dt_timezone
+from types import SimpleNamespace
+from unittest import skipUnless
+from unittest.mock import patch
+from urllib.parse import urlencode
 
-# Create your tests here.
+import jwt
+import msgpack
+import redis
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+from django.conf import settings
+from django.core.management import call_command
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.handlers.asgi import ASGIRequest
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import ApplicationCommunicator, WebsocketCommunicator
+from django.db import IntegrityError, connection
+from django.db.backends.utils import CursorWrapper
+from django.test.utils import CaptureQueriesContext
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from chat import metrics
+from chat.buffer import MessageWriteBuffer
+from chat.codecs import negotiate
+from chat.consumers import ChatConsumer
+from chat.exports import COLUMNS, export_response
+from chat.fanout import RecentMessageIds
+from chat.layers import ShardedRedisChannelLayer, jump_hash, shard_key
+from chat.lifespan import lifespan
+from chat.membership import forget_membership, get_user_rooms, is_member
+from chat.middleware import JWTAuthMiddleware
+from chat.models import ChatExport, ChatRoom, ChatRoomQuerySet, Message, Participant, UploadSession, User
+from chat.pagination import encode_cursor
+from chat.partitions import (
+    DEFAULT_PARTITION, add_months, archive_cold_partitions, create_partition, ensure_partitions,
+    list_partitions, month_start, partition_name,
+)
+from chat.routing import websocket_urlpatterns
+from chat.tasks import export_chat_room_task
+from chat.unread import count_new_messages, get_room_members, rebuild_unread_counters
+from chat.utils.auth import TokenCache, get_token_cache, validate_token
+from notifications.buffer import get_notification_buffer
+from notifications.models import Notification
+
+
+IN_MEMORY_CHANNEL_LAYERS = {"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}}
+
+
+def make_token(user_id=1, expires_in=3600, **claims):
+    payload = {
+        "token_type": "access",
+        "user_id": user_id,
+        "jti": uuid.uuid4().hex,
+        "exp": int(time.time()) + expires_in,
+        **claims,
+    }
+    return jwt.encode(payload, settings.SIMPLE_JWT["SIGNING_KEY"], algorithm="HS256")
+
+
+class FakeRedisMixin:
+    """Points chat.unread at an in-process Redis when fakeredis is installed."""
+
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis(decode_responses=True) if fakeredis else None
+        if self.redis is not None:
+            self.async_redis = fakeredis.FakeAsyncRedis(decode_responses=True)
+            for target, client in [("chat.unread.get_redis", self.redis), ("chat.presence.get_async_redis", self.async_redis)]:
+                patcher = patch(target, return_value=client)
+                patcher.start()
+                self.addCleanup(patcher.stop)
+        super().setUp()
+
+
+class TokenCacheTests(SimpleTestCase):
+
+    def test_lru_eviction_and_counters(self):
+        cache = TokenCache(max_size=2, ttl=60)
+        cache.set("a", {"id": 1})
+        cache.set("b", {"id": 2})
+        self.assertEqual(cache.get("a"), {"id": 1})
+        cache.set("c", {"id": 3})
+
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("c"), {"id": 3})
+        self.assertEqual(cache.stats()["hits"], 2)
+        self.assertEqual(cache.stats()["misses"], 1)
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    def test_entries_never_outlive_token_expiry(self):
+        cache = TokenCache(max_size=10, ttl=60)
+        cache.set("expired", {"id": 1}, expires_at=time.time() - 1)
+        self.assertIsNone(cache.get("expired"))
+
+
+class ShardedChannelLayerTests(SimpleTestCase):
+
+    def test_adding_a_shard_only_moves_groups_onto_it(self):
+        groups = [f"chat_case_{i}" for i in range(4000)]
+        before = [jump_hash(shard_key(group), 4) for group in groups]
+        after = [jump_hash(shard_key(group), 5) for group in groups]
+
+        moved = [(old, new) for old, new in zip(before, after) if old != new]
+        self.assertTrue(all(new == 4 for _, new in moved))
+        self.assertAlmostEqual(len(moved) / len(groups), 1 / 5, delta=0.03)
+        for shard in range(4):
+            self.assertAlmostEqual(before.count(shard) / len(groups), 1 / 4, delta=0.03)
+
+    def test_process_local_channels_hash_like_their_receive_queue(self):
+        layer = ShardedRedisChannelLayer(hosts=[f"redis://127.0.0.1:{port}" for port in range(7400, 7408)])
+        channel = "specific.3f2a9c!0b1e"
+
+        self.assertEqual(layer.consistent_hash(channel), layer.consistent_hash(layer.non_local_name(channel)))
+        self.assertEqual(layer.consistent_hash("chat_case_1"), layer.consistent_hash(b"chat_case_1"))
+        self.assertEqual(ShardedRedisChannelLayer(hosts=["redis://127.0.0.1:7400"]).consistent_hash(channel), 0)
+
+
+@override_settings(TOKEN_VERIFICATION={"MODE": "local", "REMOTE_FALLBACK": False})
+class ValidateTokenTests(SimpleTestCase):
+
+    def setUp(self):
+        get_token_cache().clear()
+
+    def test_valid_token_is_verified_locally_and_cached(self):
+        token = make_token(user_id=7, role="advocate")
+        with patch("chat.utils.auth.introspect_token_remotely") as remote:
+            self.assertEqual(validate_token(token)["id"], 7)
+            self.assertEqual(validate_token(token)["role"], "advocate")
+        remote.assert_not_called()
+        self.assertEqual(get_token_cache().stats()["hits"], 1)
+
+    def test_expired_or_forged_tokens_are_rejected(self):
+        forged = jwt.encode({"token_type": "access", "user_id": 1}, "wrong-key", algorithm="HS256")
+        self.assertIsNone(validate_token(make_token(expires_in=-10)))
+        self.assertIsNone(validate_token(forged))
+
+    @override_settings(TOKEN_VERIFICATION={"MODE": "local", "REMOTE_FALLBACK": True})
+    def test_remote_fallback_for_tokens_rejected_locally(self):
+        forged = jwt.encode({"token_type": "access", "user_id": 1}, "rotated-key", algorithm="HS256")
+        with patch("chat.utils.auth.introspect_token_remotely", return_value={"valid": True, "id": 1}) as remote:
+            self.assertEqual(validate_token(forged)["id"], 1)
+        remote.assert_called_once_with(forged)
+
+
+@patch("chat.signals.send_realtime_notification.delay")
+class MessageHistoryTests(FakeRedisMixin, APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username="client", role="client")
+        cls.other = User.objects.create(username="advocate", role="advocate")
+        cls.room = ChatRoom.objects.create(name="case_42", room_type="group")
+        Participant.objects.create(room=cls.room, user=cls.user)
+        Participant.objects.create(room=cls.room, user=cls.other)
+        start = timezone.now() - timedelta(days=1)
+        ChatRoom.objects.filter(pk=cls.room.pk).update(created_at=start)
+        with patch("chat.signals.send_realtime_notification.delay"):
+            cls.messages = [
+                Message.objects.create(
+                    room=cls.room,
+                    sender=cls.user if i % 2 else cls.other,
+                    content=f"message {i}",
+                    timestamp=start + timedelta(seconds=i // 2),  # pairs share a timestamp
+                )
+                for i in range(25)
+            ]
+        # history order is (timestamp, id); ids break the ties between pairs
+        cls.history = [m.content for m in sorted(cls.messages, key=lambda m: (m.timestamp, m.id))]
+        cls.url = reverse("message-list-create", args=[cls.room.id])
+
+    def setUp(self):
+        super().setUp()
+        get_token_cache().clear()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {make_token(user_id=self.user.id)}")
+
+    def contents(self, response):
+        return [message["content"] for message in response.data["results"]]
+
+    def test_latest_page_then_walk_back_with_before(self, mock_notify):
+        response = self.client.get(self.url, {"limit": 10})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.contents(response), self.history[15:])
+        self.assertTrue(response.data["has_more"])
+
+        seen = self.contents(response)
+        while response.data["has_more"]:
+            response = self.client.get(self.url, {"limit": 10, "before": response.data["before"]})
+            seen = self.contents(response) + seen
+        self.assertEqual(seen, self.history)
+
+    def test_messages_dated_before_the_room_stay_reachable(self, mock_notify):
+        imported = Message.objects.create(room=self.room, sender=self.other, content="imported", timestamp=self.room.created_at - timedelta(days=90))
+        response = self.client.get(self.url, {"limit": 5, "before": self.client.get(self.url, {"limit": 25}).data["before"]})
+
+        self.assertEqual(self.contents(response), ["imported"])
+        self.assertFalse(response.data["has_more"])
+        self.assertEqual(response.data["results"][0]["id"], str(imported.id))
+
+    def test_after_returns_newer_messages(self, mock_notify):
+        first = self.client.get(self.url, {"limit": 5, "before": self.client.get(self.url, {"limit": 20}).data["before"]})
+        self.assertEqual(self.contents(first), self.history[:5])
+
+        response = self.client.get(self.url, {"limit": 3, "after": first.data["after"]})
+        self.assertEqual(self.contents(response), self.history[5:8])
+        self.assertTrue(response.data["has_more"])
+
+    def test_page_is_loaded_with_a_single_joined_query(self, mock_notify):
+        self.client.get(self.url)
+        # JWTAuthentication's user lookup, the room, messages joined with senders;
+        # membership comes from the cache, or from Postgres when there is no Redis
+        with self.assertNumQueries(3 if self.redis is not None else 4):
+            response = self.client.get(self.url, {"limit": 200})
+        self.assertEqual(len(response.data["results"]), 25)
+        self.assertEqual(self.contents(response), self.history)
+
+    def test_invalid_cursor_is_rejected(self, mock_notify):
+        response = self.client.get(self.url, {"before": "not-a-cursor"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@patch("chat.signals.send_realtime_notification.delay")
+class MessagePartitionTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username="client", role="client")
+        cls.room = ChatRoom.objects.create(name="case_17", room_type="group")
+        Participant.objects.create(room=cls.room, user=cls.user)
+        cls.cold_month = datetime(2020, 1, 1, tzinfo=dt_timezone.utc)
+        ChatRoom.objects.filter(pk=cls.room.pk).update(created_at=cls.cold_month - timedelta(days=30))
+        with patch("chat.signals.send_realtime_notification.delay"):
+            cls.archived = Message.objects.create(
+                room=cls.room, sender=cls.user, content="from the archive", timestamp=cls.cold_month + timedelta(days=14)
+            )
+            cls.recent = [Message.objects.create(room=cls.room, sender=cls.user, content=f"recent {i}") for i in range(3)]
+        cls.url = reverse("message-list-create", args=[cls.room.id])
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=media.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        get_token_cache().clear()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {make_token(user_id=self.user.id)}")
+
+    def partition_of(self, message):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT tableoid::regclass::text FROM chat_message WHERE id = %s", [message.id])
+            return cursor.fetchone()[0]
+
+    def test_rows_move_into_the_partition_for_their_month(self, mock_notify):
+        current = month_start(timezone.now())
+        self.assertEqual(self.partition_of(self.recent[0]), partition_name(current))
+        self.assertEqual(self.partition_of(self.archived), DEFAULT_PARTITION)
+
+        self.assertTrue(create_partition(self.cold_month))
+        self.assertFalse(create_partition(self.cold_month))
+        self.assertEqual(self.partition_of(self.archived), "chat_message_p2020_01")
+
+        ensure_partitions(months_ahead=4)
+        months = [month for month, _ in list_partitions()]
+        self.assertEqual(months[-5:], [add_months(current, offset) for offset in range(5)])
+
+    def test_history_pages_only_scan_the_partitions_they_need(self, mock_notify):
+        create_partition(self.cold_month)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, {"limit": 2})
+        self.assertEqual([m["content"] for m in response.data["results"]], ["recent 1", "recent 2"])
+
+        [sql] = [q["sql"] for q in queries if q["sql"].startswith('SELECT "chat_message"')]
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN {sql}")
+            plan = "\n".join(row[0] for row in cursor.fetchall())
+        self.assertIn(partition_name(month_start(timezone.now())), plan)
+        self.assertNotIn("chat_message_p2020_01", plan)
+
+        # walking back still reaches old months, through wider windows
+        response = self.client.get(self.url, {"limit": 2, "before": response.data["before"]})
+        self.assertEqual([m["content"] for m in response.data["results"]], ["from the archive", "recent 0"])
+        self.assertFalse(response.data["has_more"])
+
+    def test_cold_partitions_are_archived_compressed_and_dropped(self, mock_notify):
+        create_partition(self.cold_month)
+        paths = archive_cold_partitions(hot_months=12)
+        self.assertEqual(paths, ["chat_archive/chat_message_p2020_01.csv.gz"])
+
+        with default_storage.open(paths[0], "rb") as archive:
+            rows = list(csv.DictReader(io.TextIOWrapper(gzip.GzipFile(fileobj=archive), encoding="utf-8")))
+        self.assertEqual([(row["id"], row["content"]) for row in rows], [(str(self.archived.id), "from the archive")])
+        self.assertNotIn("search_vector", rows[0])
+
+        self.assertFalse(Message.objects.filter(pk=self.archived.pk).exists())
+        self.assertEqual(Message.objects.filter(room=self.room).count(), 3)
+        self.assertNotIn(self.cold_month, [month for month, _ in list_partitions()])
+
+
+@patch("chat.signals.send_realtime_notification.delay")
+class MessageSearchTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username="client", role="client")
+        cls.other = User.objects.create(username="advocate", role="advocate")
+        cls.room = ChatRoom.objects.create(name="case_15", room_type="group")
+        cls.foreign_room = ChatRoom.objects.create(name="case_16", room_type="group")
+        Participant.objects.create(room=cls.room, user=cls.user)
+        Participant.objects.create(room=cls.room, user=cls.other)
+        Participant.objects.create(room=cls.foreign_room, user=cls.other)
+        with patch("chat.signals.send_realtime_notification.delay"):
+            cls.best = Message.objects.create(room=cls.room, sender=cls.other, content="The hearing, the hearing and the hearing date")
+            for i in range(6):
+                Message.objects.create(room=cls.room, sender=cls.other, content=f"Hearing notes part {i} for the court")
+            Message.objects.create(room=cls.room, sender=cls.other, content="hearing transcript", deleted=True)
+            Message.objects.create(room=cls.room, sender=cls.user, content="Unrelated invoice")
+            Message.objects.create(room=cls.foreign_room, sender=cls.other, content="Secret hearing strategy")
+        cls.url = reverse("message-search")
+
+    def setUp(self):
+        get_token_cache().clear()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {make_token(user_id=self.user.id)}")
+
+    def test_results_are_ranked_highlighted_and_scoped(self, mock_notify):
+        response = self.client.get(self.url, {"q": "hearings"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.data["results"]
+
+        self.assertEqual(len(results), 7)  # stemmed match; no deleted or foreign-room messages
+        self.assertEqual(results[0]["id"], str(self.best.id))
+        self.assertEqual([r["rank"] for r in results], sorted((r["rank"] for r in results), reverse=True))
+        self.assertIn("<mark>hearing</mark>", results[0]["headline"])
+        self.assertEqual(results[0]["sender"], "advocate")
+
+    def test_keyset_pages_cover_every_match_once(self, mock_notify):
+        seen = []
+        params = {"q": "court OR hearing", "limit": 3}
+        while True:
+            response = self.client.get(self.url, params)
+            seen += [r["id"] for r in response.data["results"]]
+            if not response.data["has_more"]:
+                break
+            params["cursor"] = response.data["cursor"]
+        self.assertEqual(len(seen), 7)
+        self.assertEqual(len(set(seen)), 7)
+
+    def test_room_filter_and_validation(self, mock_notify):
+        response = self.client.get(self.url, {"q": "strategy", "room": str(self.foreign_room.id)})
+        self.assertEqual(response.data["results"], [])
+        self.assertEqual(self.client.get(self.url, {"q": "invoice", "room": str(self.room.id)}).data["results"][0]["sender"], "client")
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(self.url, {"q": "x", "room": "nope"}).status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@patch("chat.signals.send_realtime_notification.delay")
+class ChunkedUploadTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username="client", role="client")
+        cls.room = ChatRoom.objects.create(name="case_16", room_type="group")
+        Participant.objects.create(room=cls.room, user=cls.user)
+        cls.payload = bytes(range(256)) * 10  # 2560 bytes -> chunks of 1024, 1024, 512
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings_override = override_settings(
+            MEDIA_ROOT=media.name,
+            CHAT_UPLOADS={"CHUNK_SIZE": 1024, "MAX_SIZE": 10_000, "ACCEL_REDIRECT_PREFIX": ""},
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.media = media.name
+        get_token_cache().clear()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {make_token(user_id=self.user.id)}")
+
+    def start(self):
+        response = self.client.post(reverse("upload-create", args=[self.room.id]), {
+            "file_name": "evidence.pdf", "total_size": len(self.payload),
+            "sha256": hashlib.sha256(self.payload).hexdigest(),
+        })
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return response.data
+
+    def put_chunk(self, session, index, data=None):
+        data = data if data is not None else self.payload[index * 1024:(index + 1) * 1024]
+        return self.client.put(
+            reverse("upload-chunk", args=[session["id"], index]), data,
+            content_type="application/octet-stream", HTTP_X_CHUNK_SHA256=hashlib.sha256(data).hexdigest(),
+        )
+
+    def upload(self):
+        session = self.start()
+        for index in range(session["total_chunks"]):
+            self.put_chunk(session, index)
+        response = self.client.post(reverse("upload-complete", args=[session["id"]]), {"content": "see attached"})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return Message.objects.get(pk=response.data["id"])
+
+    def test_interrupted_upload_resumes_and_assembles(self, mock_notify):
+        session = self.start()
+        self.assertEqual((session["total_chunks"], session["received_chunks"]), (3, []))
+        self.assertEqual(self.put_chunk(session, 0).status_code, status.HTTP_200_OK)
+
+        corrupt = self.client.put(
+            reverse("upload-chunk", args=[session["id"], 1]), b"x" * 1024,
+            content_type="application/octet-stream", HTTP_X_CHUNK_SHA256="0" * 64,
+        )
+        self.assertEqual(corrupt.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.put_chunk(session, 2, b"short").status_code, status.HTTP_400_BAD_REQUEST)
+
+        incomplete = self.client.post(reverse("upload-complete", args=[session["id"]]))
+        self.assertEqual(incomplete.data["missing_chunks"], [1, 2])
+        resumed = self.client.get(reverse("upload-detail", args=[session["id"]]))
+        self.assertEqual(resumed.data["received_chunks"], [0])
+
+        self.put_chunk(session, 2)
+        self.put_chunk(session, 1)
+        response = self.client.post(reverse("upload-complete", args=[session["id"]]), {"content": "see attached"})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        message = Message.objects.get(pk=response.data["id"])
+        with message.file.open("rb") as stored:
+            self.assertEqual(stored.read(), self.payload)
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertFalse(os.listdir(os.path.join(self.media, "chat_uploads", session["id"])))
+
+    def test_malformed_reply_to_is_rejected(self, mock_notify):
+        session = self.start()
+        for index in range(session["total_chunks"]):
+            self.put_chunk(session, index)
+
+        response = self.client.post(reverse("upload-complete", args=[session["id"]]), {"reply_to": "42"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("reply_to", response.data)
+        self.assertTrue(UploadSession.objects.filter(pk=session["id"]).exists())
+
+    def test_removed_participant_cannot_continue_an_upload(self, mock_notify):
+        session = self.start()
+        Participant.objects.filter(room=self.room, user=self.user).update(is_removed=True)
+
+        self.assertEqual(self.put_chunk(session, 0).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.get(reverse("upload-detail", args=[session["id"]])).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertFalse(UploadSession.objects.get(pk=session["id"]).chunks.exists())
+
+    def test_download_streams_with_range_support(self, mock_notify):
+        url = reverse("message-file", args=[self.upload().id])
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(b"".join(response.streaming_content), self.payload)
+        self.assertEqual(response["Accept-Ranges"], "bytes")
+
+        response = self.client.get(url, HTTP_RANGE="bytes=100-199")
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(response["Content-Range"], f"bytes 100-199/{len(self.payload)}")
+        self.assertEqual(b"".join(response.streaming_content), self.payload[100:200])
+
+        response = self.client.get(url, HTTP_RANGE="bytes=-10")
+        self.assertEqual(b"".join(response.streaming_content), self.payload[-10:])
+        self.assertEqual(self.client.get(url, HTTP_RANGE="bytes=5000-").status_code, 416)
+
+    def test_download_can_be_handed_to_the_proxy(self, mock_notify):
+        message = self.upload()
+        with override_settings(CHAT_UPLOADS={"ACCEL_REDIRECT_PREFIX": "/protected/"}):
+            response = self.client.get(reverse("message-file", args=[message.id]))
+        self.assertEqual(response["X-Accel-Redirect"], f"/protected/{message.file.name}")
+        self.assertEqual(response.content, b"")
+
+
+@patch("chat.signals.send_realtime_notification.delay")
+class ChatExportTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username="advocate", role="advocate")
+        cls.outsider = User.objects.create(username="outsider", role="client")
+        cls.room = ChatRoom.objects.create(name="case_21", room_type="group")
+        Participant.objects.create(room=cls.room, user=cls.user)
+        cls.payload = b"%PDF-1.4 evidence" * 100
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=media.name, CHAT_EXPORTS={"CHUNK_SIZE": 2})
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        get_token_cache().clear()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {make_token(user_id=self.user.id)}")
+
+        start = timezone.now()
+        self.messages = [
+            Message.objects.create(room=self.room, sender=self.user, content=f"Note {i}, \"quoted\"", timestamp=start + timedelta(seconds=i))
+            for i in range(4)
+        ]
+        attached = Message(room=self.room, sender=self.user, content="", timestamp=start + timedelta(seconds=5))
+        attached.file.save("brief.pdf", ContentFile(self.payload), save=False)
+        attached.save()
+        self.messages.append(attached)
+
+    def url(self, export_format):
+        return reverse("chatroom-export", args=[self.room.id, export_format])
+
+    def test_ndjson_streams_every_message_with_its_attachment(self, mock_notify):
+        response = self.client.get(self.url("ndjson"))
+
+        self.assertTrue(response.streaming)
+        self.assertEqual(response["Content-Type"], "application/x-ndjson; charset=utf-8")
+        rows = [json.loads(line) for line in b"".join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([row["id"] for row in rows], [str(m.id) for m in self.messages])
+        self.assertEqual(rows[0]["content"], 'Note 0, "quoted"')
+        self.assertIsNone(rows[0]["attachment_path"])
+        self.assertEqual(rows[-1]["attachment_name"], os.path.basename(self.messages[-1].file.name))
+        self.assertEqual((rows[-1]["attachment_type"], rows[-1]["attachment_size"]), ("application/pdf", len(self.payload)))
+
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {make_token(user_id=self.outsider.id)}")
+        self.assertEqual(self.client.get(self.url("ndjson")).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_messages_dated_before_the_room_are_exported(self, mock_notify):
+        imported = Message.objects.create(room=self.room, sender=self.user, content="Imported", timestamp=self.room.created_at - timedelta(days=30))
+
+        response = self.client.get(self.url("ndjson"))
+
+        rows = [json.loads(line) for line in b"".join(response.streaming_content).decode().splitlines()]
+        self.assertEqual(rows[0]["id"], str(imported.id))
+        self.assertEqual(len(rows), 6)
+
+    def test_csv_and_unknown_formats(self, mock_notify):
+        response = self.client.get(self.url("csv"))
+        rows = list(csv.reader(io.StringIO(b"".join(response.streaming_content).decode())))
+
+        self.assertEqual(rows[0], COLUMNS)
+        self.assertEqual(len(rows), 6)
+        self.assertEqual(rows[1][COLUMNS.index("content")], 'Note 0, "quoted"')
+        self.assertEqual(rows[-1][COLUMNS.index("attachment_size")], str(len(self.payload)))
+        self.assertEqual(self.client.get(self.url("xml")).status_code, status.HTTP_400_BAD_REQUEST)
+
+    async def test_asgi_requests_are_streamed_from_an_async_iterator(self, mock_notify):
+        request = ASGIRequest({"type": "http", "method": "GET", "path": "/", "query_string": b"", "headers": []}, io.BytesIO())
+        response = export_response(request, self.room, "ndjson")
+
+        self.assertTrue(response.is_async)
+        body = b"".join([block async for block in response.streaming_content])
+        self.assertEqual(len(body.splitlines()), 5)
+
+    def test_background_export_zips_transcript_manifest_and_attachments(self, mock_notify):
+        lost = Message(room=self.room, sender=self.user, content="", file="chat_files/lost.pdf", timestamp=timezone.now() + timedelta(minutes=1))
+        lost.save()
+
+        with patch("chat.views.export_chat_room_task.delay", side_effect=export_chat_room_task), \
+                self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse("export-create", args=[self.room.id]), {"format": "csv"}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+
+        detail = self.client.get(reverse("export-detail", args=[response.data["id"]])).data
+        self.assertEqual((detail["status"], detail["messages"], detail["attachments"]), ("done", 6, 1))
+        download = self.client.get(reverse("export-file", args=[response.data["id"]]))
+        archive = zipfile.ZipFile(io.BytesIO(b"".join(download.streaming_content)))
+
+        transcript = list(csv.reader(io.StringIO(archive.read("transcript.csv").decode())))
+        manifest = list(csv.DictReader(io.StringIO(archive.read("manifest.csv").decode())))
+        self.assertEqual(len(transcript), 7)
+        self.assertEqual([entry["status"] for entry in manifest], ["included", "missing"])
+        self.assertEqual(manifest[0]["sha256"], hashlib.sha256(self.payload).hexdigest())
+        self.assertEqual(archive.read(manifest[0]["archive_path"]), self.payload)
+
+    def test_others_cannot_see_an_export(self, mock_notify):
+        export = ChatExport.objects.create(room=self.room, user=self.user)
+        self.assertEqual(self.client.get(reverse("export-file", args=[export.id])).status_code, status.HTTP_404_NOT_FOUND)
+
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {make_token(user_id=self.outsider.id)}")
+        self.assertEqual(self.client.get(reverse("export-detail", args=[export.id])).status_code, status.HTTP_404_NOT_FOUND)
+
+
+@patch("chat.signals.send_realtime_notification.delay")
+class InboxTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username="client", role="client")
+        cls.advocates = [User.objects.create(username=f"advocate{i}", role="advocate") for i in range(3)]
+
+    def setUp(self):
+        get_token_cache().clear()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {make_token(user_id=self.user.id)}")
+
+    def create_room(self, name, messages=0):
+        room = ChatRoom.objects.create(name=name, room_type="group")
+        Participant.objects.create(room=room, user=self.user)
+        for advocate in self.advocates:
+            Participant.objects.create(room=room, user=advocate)
+        for i in range(messages):
+            Message.objects.create(room=room, sender=self.advocates[i % 3], content=f"{name} update {i}")
+        return room
+
+    def test_query_count_does_not_depend_on_room_count(self, mock_notify):
+        self.create_room("first", messages=2)
+        with self.assertNumQueries(2):  # JWTAuthentication's user lookup + the inbox
+            self.client.get(reverse("chatroom-list-create"))
+
+        for i in range(10):
+            self.create_room(f"room{i}", messages=3)
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse("chatroom-list-create"))
+        self.assertEqual(len(response.data), 11)
+
+    def test_rows_carry_counts_and_last_message_preview(self, mock_notify):
+        room = self.create_room("case_7", messages=3)
+        Message.objects.create(room=room, sender=self.user, content="my own reply")
+        Message.objects.get(content="case_7 update 0").mark_read(self.user)
+        self.create_room("empty")
+
+        rows = {row["name"]: row for row in self.client.get(reverse("chatroom-list-create")).data}
+
+        self.assertEqual(list(rows), ["case_7", "empty"])
+        self.assertEqual(rows["case_7"]["total_participants"], 4)
+        self.assertEqual(rows["case_7"]["unread_count"], 2)
+        self.assertEqual(rows["case_7"]["last_message"]["preview"], "my own reply")
+        self.assertEqual(rows["case_7"]["last_message"]["sender"], "client")
+        self.assertNotIn("participants", rows["case_7"])
+        self.assertIsNone(rows["empty"]["last_message"])
+
+        response = self.client.get(reverse("chatroom-participants", args=[room.id]))
+        self.assertEqual(len(response.data), 4)
+
+
+class PrivateRoomTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.client_user = User.objects.create(username="client", role="client")
+        cls.advocate = User.objects.create(username="advocate", role="advocate")
+
+    def setUp(self):
+        get_token_cache().clear()
+
+    def open(self, user, other_id):
+        return self.client.post(
+            reverse("chatroom-private"), {"user_id": other_id}, format="json",
+            HTTP_AUTHORIZATION=f"Bearer {make_token(user_id=user.id)}",
+        )
+
+    def test_both_users_get_the_same_room(self):
+        created = self.open(self.client_user, self.advocate.id)
+        found = self.open(self.advocate, self.client_user.id)
+
+        self.assertEqual(created.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(found.status_code, status.HTTP_200_OK)
+        self.assertEqual(created.data["id"], found.data["id"])
+        self.assertEqual((found.data["room_type"], found.data["total_participants"]), ("private", 2))
+        room = ChatRoom.objects.get()
+        self.assertEqual((room.pair_low, room.pair_high), tuple(sorted((self.client_user.id, self.advocate.id))))
+
+    def test_existing_room_is_a_single_lookup_on_the_pair(self):
+        room, _ = ChatRoom.objects.get_or_create_private(self.client_user.id, self.advocate.id)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(ChatRoom.objects.private_room(self.advocate.id, self.client_user.id), room)
+        self.assertEqual(len(queries), 1)
+        self.assertIn('"pair_low" =', queries[0]["sql"])
+
+    def test_losing_a_concurrent_create_returns_the_winners_room(self):
+        winner, _ = ChatRoom.objects.get_or_create_private(self.client_user.id, self.advocate.id)
+        # the loser's lookup ran before the winner committed
+        with patch.object(ChatRoomQuerySet, "private_room", return_value=None):
+            room, created = ChatRoom.objects.get_or_create_private(self.advocate.id, self.client_user.id)
+
+        self.assertEqual((room, created), (winner, False))
+        self.assertEqual(ChatRoom.objects.count(), 1)
+        self.assertEqual(Participant.objects.count(), 2)
+
+    def test_rejects_self_and_unknown_users(self):
+        self.assertEqual(self.open(self.client_user, self.client_user.id).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.open(self.client_user, 999999).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertFalse(ChatRoom.objects.exists())
+
+
+@patch("chat.signals.send_realtime_notification.delay")
+class ReadWatermarkTests(FakeRedisMixin, APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username="client", role="client")
+        cls.other = User.objects.create(username="advocate", role="advocate")
+        cls.room = ChatRoom.objects.create(name="case_3", room_type="group")
+        cls.participant = Participant.objects.create(room=cls.room, user=cls.user)
+        Participant.objects.create(room=cls.room, user=cls.other)
+        start = timezone.now() - timedelta(hours=1)
+        with patch("chat.signals.send_realtime_notification.delay"):
+            messages = [
+                Message.objects.create(room=cls.room, sender=cls.other, content=f"m{i}", timestamp=start + timedelta(seconds=i // 2))
+                for i in range(6)
+            ]
+        cls.messages = sorted(messages, key=lambda m: (m.timestamp, m.id))
+        cls.url = reverse("chatroom-read", args=[cls.room.id])
+
+    def setUp(self):
+        super().setUp()
+        get_token_cache().clear()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {make_token(user_id=self.user.id)}")
+
+    def test_watermark_advances_and_never_moves_back(self, mock_notify):
+        response = self.client.post(self.url, {"message_id": str(self.messages[2].id)})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["unread_count"], 3)
+
+        response = self.client.post(self.url, {"message_id": str(self.messages[0].id)})
+        self.assertEqual(response.data["last_read_message"], self.messages[2].id)
+        self.assertEqual(response.data["unread_count"], 3)
+
+        response = self.client.post(self.url)
+        self.assertEqual(response.data["last_read_message"], self.messages[-1].id)
+        self.assertEqual(response.data["unread_count"], 0)
+
+    def test_malformed_message_id_is_rejected(self, mock_notify):
+        response = self.client.post(self.url, {"message_id": "not-a-uuid"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("message_id", response.data)
+
+    def test_unread_count_is_one_range_count(self, mock_notify):
+        self.participant.mark_read(self.messages[3])
+        with self.assertNumQueries(1):
+            self.assertEqual(self.participant.unread_messages().count(), 2)
+
+    def test_read_receipts_come_from_the_watermarks(self, mock_notify):
+        self.messages[1].mark_read(self.user)
+        self.assertTrue(self.messages[0].is_read_by(self.user))
+        self.assertTrue(self.messages[1].is_read_by(self.user))
+        self.assertFalse(self.messages[2].is_read_by(self.user))
+        self.assertFalse(self.messages[0].is_read_by(self.other))
+
+        response = self.client.get(self.url)
+        receipts = {row["user_id"]: row["last_read_message"] for row in response.data}
+        self.assertEqual(receipts, {self.user.id: self.messages[1].id, self.other.id: None})
+
+    def test_outsiders_cannot_read_or_see_receipts(self, mock_notify):
+        outsider = User.objects.create(username="outsider", role="client")
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {make_token(user_id=outsider.id)}")
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.post(self.url).status_code, status.HTTP_404_NOT_FOUND)
+
+
+@skipUnless(fakeredis, "fakeredis is not installed")
+@patch("chat.signals.send_realtime_notification.delay")
+class UnreadCounterTests(FakeRedisMixin, APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.client_user = User.objects.create(username="client", role="client")
+        cls.advocates = [User.objects.create(username=f"advocate{i}", role="advocate") for i in range(2)]
+        cls.room = ChatRoom.objects.create(name="case_11", room_type="group")
+        cls.other_room = ChatRoom.objects.create(name="case_12", room_type="group")
+        for user in [cls.client_user, *cls.advocates]:
+            Participant.objects.create(room=cls.room, user=user)
+        Participant.objects.create(room=cls.other_room, user=cls.client_user)
+        Participant.objects.create(room=cls.other_room, user=cls.advocates[0])
+
+    def setUp(self):
+        super().setUp()
+        get_token_cache().clear()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {make_token(user_id=self.client_user.id)}")
+
+    def send(self, room, sender, count=1):
+        messages = [Message.objects.create(room=room, sender=sender, content="hi") for _ in range(count)]
+        count_new_messages(messages)
+        return messages
+
+    def unread(self):
+        response = self.client.get(reverse("unread-counters"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_fan_out_counts_for_everyone_but_the_sender(self, mock_notify):
+        self.send(self.room, self.advocates[0], count=2)
+        self.send(self.room, self.client_user)
+        self.send(self.other_room, self.advocates[0])
+
+        with self.assertNumQueries(1):  # JWTAuthentication's user lookup; counters come from Redis
+            data = self.unread()
+        self.assertEqual(data, {"rooms": {str(self.room.id): 2, str(self.other_room.id): 1}, "total": 3})
+        self.assertEqual(self.redis.hget(f"chat:unread:{self.advocates[1].id}", str(self.room.id)), "3")
+
+    def test_marking_read_resets_the_counter(self, mock_notify):
+        messages = self.send(self.room, self.advocates[0], count=3)
+        self.client.post(reverse("chatroom-read", args=[self.room.id]), {"message_id": str(messages[1].id)})
+        self.assertEqual(self.unread()["rooms"], {str(self.room.id): 1})
+
+        self.client.post(reverse("chatroom-read", args=[self.room.id]))
+        self.assertEqual(self.unread(), {"rooms": {}, "total": 0})
+
+    def test_counters_are_rebuilt_from_postgres_after_a_flush(self, mock_notify):
+        messages = self.send(self.room, self.advocates[0], count=3)
+        self.send(self.other_room, self.advocates[0], count=2)
+        # a read that bypassed the endpoint leaves the counter stale until a rebuild
+        Participant.objects.get(room=self.room, user=self.client_user).mark_read(messages[0])
+        self.redis.flushall()
+        self.assertEqual(self.unread()["total"], 0)
+
+        self.assertEqual(rebuild_unread_counters(), 3)
+        self.assertEqual(self.unread(), {"rooms": {str(self.room.id): 2, str(self.other_room.id): 2}, "total": 4})
+
+    def test_membership_changes_refresh_the_member_set(self, mock_notify):
+        self.assertEqual(len(get_room_members(self.other_room.id)), 2)
+        newcomer = User.objects.create(username="newcomer", role="advocate")
+        with self.captureOnCommitCallbacks(execute=True):
+            Participant.objects.create(room=self.other_room, user=newcomer)
+        self.send(self.other_room, self.advocates[0])
+        self.assertEqual(self.redis.hget(f"chat:unread:{newcomer.id}", str(self.other_room.id)), "1")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Participant.objects.filter(room=self.other_room, user=newcomer).update(is_removed=True)
+            Participant.objects.get(room=self.other_room, user=newcomer).save()
+        self.assertIsNone(self.redis.hget(f"chat:unread:{newcomer.id}", str(self.other_room.id)))
+        self.assertNotIn(str(newcomer.id), get_room_members(self.other_room.id))
+
+    def test_removal_during_a_fill_is_not_overwritten(self, mock_notify):
+        participant = Participant.objects.get(room=self.other_room, user=self.advocates[0])
+
+        def stale_load(room_id):
+            # the removal commits and invalidates while the query is running
+            Participant.objects.filter(pk=participant.pk).update(is_removed=True)
+            forget_membership(self.other_room.id, self.advocates[0].id)
+            return {str(self.client_user.id), str(self.advocates[0].id)}
+
+        with patch("chat.unread.load_room_members", side_effect=stale_load):
+            get_room_members(self.other_room.id)
+
+        self.send(self.other_room, self.client_user)
+        self.assertIsNone(self.redis.hget(f"chat:unread:{self.advocates[0].id}", str(self.other_room.id)))
+
+
+@skipUnless(fakeredis, "fakeredis is not installed")
+@patch("chat.signals.send_realtime_notification.delay")
+class MembershipCacheTests(FakeRedisMixin, APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username="client", role="client")
+        cls.room = ChatRoom.objects.create(name="case_5", room_type="group")
+        cls.other_room = ChatRoom.objects.create(name="case_6", room_type="group")
+        cls.participant = Participant.objects.create(room=cls.room, user=cls.user)
+
+    def setUp(self):
+        super().setUp()
+        get_token_cache().clear()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {make_token(user_id=self.user.id)}")
+
+    def test_all_rooms_of_a_user_are_loaded_once(self, mock_notify):
+        with self.assertNumQueries(1):
+            self.assertTrue(is_member(self.user.id, self.room.id))
+        with self.assertNumQueries(0):
+            self.assertTrue(is_member(self.user.id, self.room.id))
+            self.assertFalse(is_member(self.user.id, self.other_room.id))
+
+    def test_membership_changes_reach_the_views(self, mock_notify):
+        url = reverse("message-list-create", args=[self.room.id])
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.get(reverse("message-list-create", args=[self.other_room.id])).status_code, 404)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.participant.is_removed = True
+            self.participant.save()
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_404_NOT_FOUND)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Participant.objects.create(room=self.other_room, user=self.user)
+        self.assertTrue(is_member(self.user.id, self.other_room.id))
+
+    def test_falls_back_to_postgres_without_redis(self, mock_notify):
+        with patch("chat.unread.get_redis", side_effect=redis.ConnectionError("down")) as get_redis:
+            self.assertTrue(is_member(self.user.id, self.room.id))
+            self.assertFalse(is_member(self.user.id, self.other_room.id))
+        self.assertEqual(get_redis.call_count, 2)  # one failed round trip per check, not two
+
+    def test_removal_during_a_fill_is_not_overwritten(self, mock_notify):
+        if self.redis is None:
+            self.skipTest("fakeredis is not installed")
+
+        def stale_load(user_id):
+            # the removal commits and invalidates while the query is running
+            Participant.objects.filter(pk=self.participant.pk).update(is_removed=True)
+            forget_membership(self.room.id, self.user.id)
+            return {str(self.room.id)}
+
+        with patch("chat.membership.load_user_rooms", side_effect=stale_load):
+            get_user_rooms(self.user.id)
+
+        self.assertFalse(is_member(self.user.id, self.room.id))
+
+
+class MessageFanoutSignalTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username="client", role="client")
+        cls.room = ChatRoom.objects.create(name="case_1")
+
+    @patch("chat.signals.send_realtime_notification.delay")
+    def test_rest_and_admin_writes_fall_back_to_the_task_after_commit(self, mock_notify):
+        with self.captureOnCommitCallbacks(execute=True):
+            message = Message.objects.create(room=self.room, sender=self.user, content="from REST")
+        mock_notify.assert_called_once_with(message_id=str(message.id))
+
+    @patch("chat.signals.send_realtime_notification.delay")
+    def test_writers_that_broadcast_themselves_skip_the_task(self, mock_notify):
+        message = Message(room=self.room, sender=self.user, content="from the socket")
+        message.broadcast_on_save = False
+        with self.captureOnCommitCallbacks(execute=True):
+            message.save()
+        mock_notify.assert_not_called()
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class ChatConsumerTestCase(FakeRedisMixin, TransactionTestCase):
+    """Setup and socket helpers of the consumer tests; no tests of its own, so subclasses don't run them again."""
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create(username=f"client{uuid.uuid4().hex[:8]}", role="client")
+        self.room = ChatRoom.objects.create(name="case_9")
+        Participant.objects.create(room=self.room, user=self.user)
+        get_token_cache().clear()
+
+    def communicator(self, token=None, subprotocols=None, query=""):
+        path = f"/ws/chat/{self.room.name}/?" + (f"token={token}&" if token else "") + query
+        return WebsocketCommunicator(JWTAuthMiddleware(URLRouter(websocket_urlpatterns)), path, subprotocols=subprotocols)
+
+    async def connect(self, user=None):
+        communicator = self.communicator(make_token(user_id=(user or self.user).id))
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        await communicator.receive_json_from()  # greeting
+        if self.redis is not None:
+            self.snapshot = await communicator.receive_json_from()
+        return communicator
+
+
+class ChatConsumerFanoutTests(ChatConsumerTestCase):
+
+    @patch("chat.signals.send_realtime_notification.delay")
+    async def test_socket_message_is_delivered_once_without_a_task(self, mock_notify):
+        communicator = await self.connect()
+
+        await communicator.send_json_to({"message": "hello", "sender_id": self.user.id})
+        event = await communicator.receive_json_from()
+
+        self.assertEqual(event["message"]["content"], "hello")
+        mock_notify.assert_not_called()
+
+        # the same message reaching the group again (e.g. a late fallback) is dropped
+        await get_channel_layer().group_send("chat_case_9", {"type": "chat_message", "message": event["message"]})
+        self.assertTrue(await communicator.receive_nothing())
+        await communicator.disconnect()
+
+    @patch("chat.signals.send_realtime_notification.delay")
+    async def test_notifications_are_batched_across_disconnects_and_flushed_on_shutdown(self, mock_notify):
+        away = await User.objects.acreate(username=f"away{uuid.uuid4().hex[:8]}", role="client")
+        await Participant.objects.acreate(room=self.room, user=away)
+        communicator = await self.connect()
+        await communicator.send_json_to({"message": "hello"})
+        await communicator.receive_json_from()
+        await communicator.disconnect()
+
+        self.assertEqual(len(get_notification_buffer()), 1)  # left for the timer, not flushed per socket
+
+        shutdown = ApplicationCommunicator(lifespan, {"type": "lifespan"})
+        await shutdown.send_input({"type": "lifespan.startup"})
+        self.assertEqual(await shutdown.receive_output(), {"type": "lifespan.startup.complete"})
+        await shutdown.send_input({"type": "lifespan.shutdown"})
+        self.assertEqual(await shutdown.receive_output(), {"type": "lifespan.shutdown.complete"})
+
+        self.assertEqual(len(get_notification_buffer()), 0)
+        self.assertTrue(await Notification.objects.filter(user=away, group_key=f"chat:{self.room.pk}").aexists())
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS, CHAT_LAST_MESSAGE_AT_INTERVAL=60)
+class ChatConsumerQueryTests(ChatConsumerTestCase):
+
+    @patch("chat.signals.send_realtime_notification.delay")
+    async def test_steady_state_message_is_a_single_insert(self, mock_notify):
+        communicator = await self.connect()
+        await communicator.send_json_to({"message": "first", "sender_id": self.user.id})
+        await communicator.receive_json_from()
+
+        # the consumer's queries run in its own context, so count at the cursor
+        executed = []
+        execute = CursorWrapper._execute
+
+        def record(cursor, sql, *args):
+            executed.append(sql)
+            return execute(cursor, sql, *args)
+
+        with patch.object(CursorWrapper, "_execute", record):
+            await communicator.send_json_to({"message": "second", "sender_id": self.user.id})
+            event = await communicator.receive_json_from()
+
+        self.assertEqual(event["message"]["content"], "second")
+        self.assertEqual(len(executed), 1, executed)
+        self.assertTrue(executed[0].startswith("INSERT"))
+
+        await communicator.disconnect()
+        room = await ChatRoom.objects.aget(pk=self.room.pk)
+        self.assertEqual(room.last_message_at, await Message.objects.filter(content="second").values_list("timestamp", flat=True).aget())
+
+    async def test_handshake_requires_a_valid_token_of_a_participant(self):
+        outsider = await User.objects.acreate(username=f"outsider{uuid.uuid4().hex[:8]}", role="client")
+        for token in [None, make_token(user_id=self.user.id, expires_in=-10), make_token(user_id=outsider.id)]:
+            connected, _ = await self.communicator(token).connect()
+            self.assertFalse(connected)
+
+        communicator = self.communicator(subprotocols=["bearer", make_token(user_id=self.user.id)])
+        connected, subprotocol = await communicator.connect()
+        self.assertTrue(connected)
+        self.assertEqual(subprotocol, "bearer")
+        await communicator.disconnect()
+
+    async def test_spoofed_sender_is_rejected(self):
+        outsider = await User.objects.acreate(username=f"outsider{uuid.uuid4().hex[:8]}", role="client")
+        communicator = await self.connect()
+
+        await communicator.send_json_to({"message": "spoofed", "sender_id": outsider.id})
+        self.assertEqual(await communicator.receive_json_from(), {"error": "sender_id does not match this connection"})
+        await communicator.send_json_to({"message": "hi"})
+        self.assertEqual((await communicator.receive_json_from())["message"]["sender_id"], self.user.id)
+        self.assertFalse(await Message.objects.filter(content="spoofed").aexists())
+        await communicator.disconnect()
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS, CHAT_DELIVERY={"BATCH_WINDOW": 0.05, "MAX_BATCH": 100})
+class ChatConsumerDeliveryTests(ChatConsumerTestCase):
+
+    async def receive_msgpack(self, communicator):
+        frame = await communicator.receive_from()
+        self.assertIsInstance(frame, bytes)
+        return msgpack.unpackb(frame)
+
+    @patch("chat.signals.send_realtime_notification.delay")
+    async def test_msgpack_subprotocol_switches_both_directions(self, mock_notify):
+        communicator = self.communicator(make_token(user_id=self.user.id), subprotocols=["chat.msgpack"])
+        connected, subprotocol = await communicator.connect()
+        self.assertEqual((connected, subprotocol), (True, "chat.msgpack"))
+        self.assertIn("Connected", (await self.receive_msgpack(communicator))["message"])
+        if self.redis is not None:
+            await self.receive_msgpack(communicator)  # presence snapshot
+
+        await communicator.send_to(bytes_data=msgpack.packb({"message": "binary hello"}))
+        event = await self.receive_msgpack(communicator)
+        self.assertEqual(event["message"]["content"], "binary hello")
+        await communicator.disconnect()
+
+    async def test_batch_mode_coalesces_room_events(self):
+        communicator = self.communicator(make_token(user_id=self.user.id), query="batch=1")
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        await communicator.receive_json_from()  # greeting
+        if self.redis is not None:
+            await communicator.receive_json_from()
+
+        for i in range(3):
+            await get_channel_layer().group_send("chat_case_9", {"type": "chat_message", "message": {"id": str(i), "content": f"m{i}"}})
+        frame = await communicator.receive_json_from()
+        self.assertEqual(frame["type"], "batch")
+        self.assertEqual([event["message"]["content"] for event in frame["events"]], ["m0", "m1", "m2"])
+        self.assertTrue(await communicator.receive_nothing())
+        await communicator.disconnect()
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class ChatConsumerBackpressureTests(ChatConsumerTestCase):
+
+    def setUp(self):
+        super().setUp()
+        metrics.reset()
+
+    async def heartbeats(self, communicator, count):
+        for _ in range(count):
+            await communicator.send_json_to({"type": "heartbeat"})
+
+    @override_settings(CHAT_THROTTLE={"CONNECTION_RATE": 0.01, "CONNECTION_BURST": 2, "MAX_THROTTLED": 3})
+    async def test_flooding_socket_is_throttled_then_closed(self):
+        communicator = await self.connect()
+        await self.heartbeats(communicator, 3)
+        notice = await communicator.receive_json_from()
+        self.assertEqual(notice["error"], "rate limited")
+        self.assertGreater(notice["retry_after"], 0)
+
+        await self.heartbeats(communicator, 2)  # still throttled, but no further notices
+        self.assertTrue(await communicator.receive_nothing())
+        await self.heartbeats(communicator, 1)
+        self.assertEqual(await communicator.receive_output(), {"type": "websocket.close", "code": 4429})
+        self.assertEqual(metrics.snapshot()["frames_throttled_connection"], 4)
+        self.assertEqual(metrics.snapshot()["throttled_disconnects"], 1)
+
+    @override_settings(CHAT_THROTTLE={"USER_RATE": 0.01, "USER_BURST": 2})
+    async def test_user_budget_is_shared_by_their_sockets(self):
+        first, second = await self.connect(), await self.connect()
+        await self.heartbeats(first, 2)
+        self.assertTrue(await first.receive_nothing())
+
+        await self.heartbeats(second, 1)
+        self.assertEqual((await second.receive_json_from())["error"], "rate limited")
+        self.assertEqual(metrics.snapshot()["frames_throttled_user"], 1)
+        await first.disconnect()
+        await second.disconnect()
+
+    async def stalled_consumer(self, policy):
+        """A consumer whose client never reads: every websocket.send blocks."""
+        sent = []
+
+        async def base_send(message):
+            sent.append(message)
+            if message["type"] == "websocket.send":
+                await asyncio.Event().wait()
+
+        with override_settings(CHAT_DELIVERY={"SEND_QUEUE": 2, "SLOW_CONSUMER": policy}):
+            consumer = ChatConsumer()
+            consumer.setup_delivery(negotiate([]), batching=False)
+        consumer.base_send = base_send
+        consumer.user = SimpleNamespace(id=-1)
+        consumer.delivered = RecentMessageIds()
+        for i in range(5):
+            await consumer.chat_message({"message": {"id": str(i), "content": f"m{i}"}})
+            await asyncio.sleep(0)  # let the writer pick up the first frame
+        consumer.sender.cancel()
+        return sent
+
+    async def test_slow_consumer_is_closed_when_its_queue_fills(self):
+        sent = await self.stalled_consumer("close")
+        self.assertEqual([m["type"] for m in sent], ["websocket.send", "websocket.close"])
+        self.assertEqual(sent[-1]["code"], 1013)
+        self.assertEqual(metrics.snapshot()["slow_consumer_disconnects"], 1)
+
+    async def test_slow_consumer_can_drop_frames_instead(self):
+        sent = await self.stalled_consumer("drop")
+        self.assertEqual([m["type"] for m in sent], ["websocket.send"])
+        self.assertEqual(metrics.snapshot()["frames_dropped"], 2)
+
+    def test_metrics_endpoint_is_for_admins(self):
+        metrics.increment("frames_throttled_user", 3)
+        url = reverse("chat-metrics")
+        client = self.client.get(url, HTTP_AUTHORIZATION=f"Bearer {make_token(user_id=self.user.id, role='client')}")
+        self.assertEqual(client.status_code, status.HTTP_403_FORBIDDEN)
+        admin = self.client.get(url, HTTP_AUTHORIZATION=f"Bearer {make_token(user_id=self.user.id, role='admin')}")
+        self.assertEqual(admin.data["frames_throttled_user"], 3)
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class ReconnectSyncTests(ChatConsumerTestCase):
+
+    def setUp(self):
+        super().setUp()
+        start = timezone.now() - timedelta(minutes=5)
+        with patch("chat.signals.send_realtime_notification.delay"):
+            self.messages = [
+                Message.objects.create(room=self.room, sender=self.user, content=f"m{i}", timestamp=start + timedelta(seconds=i))
+                for i in range(6)
+            ]
+
+    async def reconnect(self, since):
+        communicator = self.communicator(make_token(user_id=self.user.id), query=urlencode({"since": since}))
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        await communicator.receive_json_from()  # greeting
+        if self.redis is not None:
+            await communicator.receive_json_from()
+        return communicator
+
+    @override_settings(CHAT_DELIVERY={"SYNC_BATCH": 2, "SYNC_MAX": 10})
+    async def test_missed_messages_are_replayed_in_batches_before_live_events(self):
+        communicator = await self.reconnect(str(self.messages[1].id))
+        batches = [await communicator.receive_json_from() for _ in range(2)]
+        self.assertEqual([b["type"] for b in batches], ["sync.batch", "sync.batch"])
+        self.assertEqual([[m["content"] for m in b["messages"]] for b in batches], [["m2", "m3"], ["m4", "m5"]])
+
+        done = await communicator.receive_json_from()
+        self.assertEqual((done["type"], done["count"]), ("sync.done", 4))
+        self.assertEqual(done["after"], encode_cursor(self.messages[-1]))
+
+        # a replayed message that also arrives live is not delivered twice
+        await get_channel_layer().group_send("chat_case_9", {"type": "chat_message", "message": batches[-1]["messages"][-1]})
+        self.assertTrue(await communicator.receive_nothing())
+        await communicator.disconnect()
+
+    async def test_since_accepts_a_cursor_or_a_timestamp(self):
+        communicator = await self.reconnect(encode_cursor(self.messages[3]))
+        self.assertEqual([m["content"] for m in (await communicator.receive_json_from())["messages"]], ["m4", "m5"])
+        await communicator.disconnect()
+
+        communicator = await self.reconnect(self.messages[4].timestamp.isoformat())
+        self.assertEqual([m["content"] for m in (await communicator.receive_json_from())["messages"]], ["m4", "m5"])
+        await communicator.disconnect()
+
+    @override_settings(CHAT_DELIVERY={"SYNC_MAX": 3})
+    async def test_large_or_unknown_gaps_are_left_to_rest_paging(self):
+        communicator = await self.reconnect(str(self.messages[0].id))
+        self.assertEqual(await communicator.receive_json_from(), {"type": "sync.gap", "after": encode_cursor(self.messages[0])})
+        self.assertTrue(await communicator.receive_nothing())
+        await communicator.disconnect()
+
+        communicator = await self.reconnect(str(uuid.uuid4()))
+        self.assertEqual(await communicator.receive_json_from(), {"type": "sync.gap", "after": None})
+        await communicator.disconnect()
+
+        communicator = await self.reconnect("yesterday")
+        self.assertEqual(await communicator.receive_json_from(), {"error": "invalid since"})
+        await communicator.disconnect()
+
+
+class ChatLoadTestCommandTests(TransactionTestCase):
+
+    def test_small_run_reports_latency_and_cleans_up(self):
+        out = io.StringIO()
+        call_command("chat_loadtest", clients=6, rooms=2, senders=0.5, rate=5, duration=0.4, drain=3, stdout=out)
+        report = out.getvalue()
+
+        delivered = next(line for line in report.splitlines() if line.startswith("delivered"))
+        sent, expected = delivered.split()[1].split("/")
+        self.assertEqual(sent, expected)
+        self.assertGreater(int(expected), 0)
+        self.assertIn("p99", report)
+        self.assertIn("KiB per connection", report)
+        self.assertFalse(ChatRoom.objects.filter(name__startswith="loadtest_").exists())
+        self.assertFalse(User.objects.filter(username__startswith="loadtest_").exists())
+
+
+@skipUnless(fakeredis, "fakeredis is not installed")
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class PresenceTests(ChatConsumerTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.other = User.objects.create(username=f"advocate{uuid.uuid4().hex[:8]}", role="advocate")
+        Participant.objects.create(room=self.room, user=self.other)
+
+    async def test_presence_and_typing_never_touch_postgres(self):
+        first = await self.connect()
+        self.assertEqual(self.snapshot, {"type": "presence.snapshot", "online": [self.user.id], "last_seen": {}})
+        await first.send_json_to({"type": "heartbeat"})
+        self.assertTrue(await first.receive_nothing())
+
+        second = await self.connect(self.other)
+        self.assertEqual(self.snapshot["online"], sorted([self.user.id, self.other.id]))
+        self.assertEqual(await first.receive_json_from(), {"type": "presence", "user_id": self.other.id, "status": "online", "last_seen": None})
+
+        executed = []
+        execute = CursorWrapper._execute
+
+        def record(cursor, sql, *args):
+            executed.append(sql)
+            return execute(cursor, sql, *args)
+
+
+        with patch.object(CursorWrapper, "_execute", record):
+            await second.send_json_to({"type": "typing", "typing": True})
+            self.assertEqual(await first.receive_json_from(), {"type": "typing", "user_id": self.other.id, "typing": True})
+            await second.send_json_to({"type": "typing", "typing": True})  # within TYPING_INTERVAL
+            self.assertTrue(await first.receive_nothing())
+            await second.send_json_to({"type": "typing", "typing": False})
+            self.assertEqual(await first.receive_json_from(), {"type": "typing", "user_id": self.other.id, "typing": False})
+            await second.send_json_to({"type": "heartbeat"})
+            self.assertTrue(await second.receive_nothing())
+        self.assertEqual(executed, [])
+
+        await second.disconnect()
+        offline = await first.receive_json_from()
+        self.assertEqual((offline["user_id"], offline["status"]), (self.other.id, "offline"))
+
+        third = await self.connect()
+        self.assertEqual(self.snapshot["online"], [self.user.id])
+        self.assertEqual(self.snapshot["last_seen"], {str(self.other.id): offline["last_seen"]})
+        await first.disconnect()
+        await third.disconnect()
+
+
+class MessageWriteBufferTests(FakeRedisMixin, TransactionTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.rooms = [ChatRoom.objects.create(name=f"buffer_{i}") for i in range(2)]
+
+    async def test_batches_are_flushed_in_acceptance_order(self):
+        buffer = MessageWriteBuffer(max_batch=4, flush_interval=60)
+        accepted = [await buffer.add(Message(room=self.rooms[i % 2], content=f"m{i}")) for i in range(10)]
+        self.assertEqual(len(buffer), 2)  # two full batches went out, the rest waits for the timer
+        await buffer.flush()
+
+        stored = [m async for m in Message.objects.order_by("timestamp", "id").values_list("content", flat=True)]
+        self.assertEqual(stored, [f"m{i}" for i in range(10)])
+        self.assertEqual(buffer.flushes, 3)
+        room = await ChatRoom.objects.aget(pk=self.rooms[1].pk)
+        self.assertEqual(room.last_message_at, accepted[-1].timestamp)
+
+    async def test_failed_batch_is_retried_without_reordering(self):
+        buffer = MessageWriteBuffer(max_batch=100, flush_interval=60)
+        for i in range(3):
+            await buffer.add(Message(room=self.rooms[0], content=f"m{i}"))
+
+        with patch.object(MessageWriteBuffer, "write_batch", side_effect=RuntimeError("db down")):
+            with self.assertRaises(RuntimeError):
+                await buffer.flush()
+        await buffer.add(Message(room=self.rooms[0], content="m3"))
+        await buffer.flush()
+
+        stored = [m async for m in Message.objects.order_by("timestamp").values_list("content", flat=True)]
+        self.assertEqual(stored, ["m0", "m1", "m2", "m3"])
+
+    async def test_rejected_rows_do_not_hold_up_the_buffer(self):
+        metrics.reset()
+        buffer = MessageWriteBuffer(max_batch=100, flush_interval=60, max_attempts=2)
+        orphan = await buffer.add(Message(room=self.rooms[0], content="orphan"))
+        await ChatRoom.objects.filter(pk=self.rooms[0].pk).adelete()
+        await buffer.add(Message(room=self.rooms[1], content="m0"))
+
+        with self.assertRaises(IntegrityError):
+            await buffer.flush()
+        await buffer.add(Message(room=self.rooms[1], content="m1"))
+        await buffer.flush()
+
+        stored = [m async for m in Message.objects.order_by("timestamp").values_list("content", flat=True)]
+        self.assertEqual(stored, ["m0", "m1"])
+        self.assertEqual(len(buffer), 0)
+        self.assertEqual(buffer.dropped, 1)
+        self.assertEqual(metrics.snapshot()["write_behind_dropped"], 1)
+        self.assertFalse(await Message.objects.filter(pk=orphan.pk).aexists())
@@ -0,0 +1,82 @@
+import time
+import weakref
+
+from django.conf import settings
+
+
+DEFAULT_THROTTLE = {
+    'CONNECTION_RATE': 10,      # frames per second one socket may sustain
+    'CONNECTION_BURST': 30,
+    'USER_RATE': 20,            # shared by all of a user's sockets in this process
+    'USER_BURST': 60,
+    'MAX_THROTTLED': 100,       # throttled frames in a row before the socket is closed
+}
+
+
+def get_throttle_config():
+    return {**DEFAULT_THROTTLE, **getattr(settings, 'CHAT_THROTTLE', {})}
+
+
+class TokenBucket:
+    """Refills `rate` tokens per second up to `burst`; each frame takes one."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def retry_after(self):
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+
+# Buckets live as long as one of the user's sockets holds a reference.
+_user_buckets = weakref.WeakValueDictionary()
+
+
+def user_bucket(user_id, config):
+    bucket = _user_buckets.get(user_id)
+    if bucket is None:
+        bucket = _user_buckets[user_id] = TokenBucket(config['USER_RATE'], config['USER_BURST'])
+    return bucket
+
+
+class FrameLimiter:
+    """
+    Admits a socket's incoming frames against its own bucket and its user's.
+    A frame only takes tokens when both buckets have one, so a refused frame
+    costs the client nothing.
+    """
+
+    def __init__(self, user_id, config=None):
+        self.config = config or get_throttle_config()
+        self.connection = TokenBucket(self.config['CONNECTION_RATE'], self.config['CONNECTION_BURST'])
+        self.user = user_bucket(user_id, self.config)
+        self.throttled = 0  # refused frames in a row
+        self.refused_by = None
+
+    def allow(self):
+        """None if the frame may proceed, else the scope that refused it ("connection" or "user")."""
+        self.connection.refill()
+        self.user.refill()
+        for scope, bucket in (('connection', self.connection), ('user', self.user)):
+            if bucket.tokens < 1:
+                self.throttled += 1
+                self.refused_by = bucket
+                return scope
+        self.connection.tokens -= 1
+        self.user.tokens -= 1
+        self.throttled = 0
+        return None
+
+    def retry_after(self):
+        return self.refused_by.retry_after()
+
+    @property
+    def exhausted(self):
+        return self.throttled > self.config['MAX_THROTTLED']
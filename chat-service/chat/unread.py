@@ -0,0 +1,163 @@
+from collections import Counter
+
+import redis
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from chat.models import Participant
+
+
+_redis_client = None
+
+
+def get_redis():
+    global _redis_client
+    if _redis_client is None:
+        _redis_client = redis.Redis.from_url(
+            settings.REDIS_URL,
+            decode_responses=True,
+            socket_connect_timeout=settings.REDIS_SOCKET_TIMEOUT,
+            socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+        )
+    return _redis_client
+
+
+@receiver(setting_changed)
+def reset_redis_client(setting, **kwargs):
+    global _redis_client
+    if setting in ('REDIS_URL', 'REDIS_SOCKET_TIMEOUT'):
+        _redis_client = None
+
+
+def unread_key(user_id):
+    """Hash of room id -> unread count for one user."""
+    return f"chat:unread:{user_id}"
+
+
+def members_key(room_id):
+    """Set of the active participants of a room, loaded from Postgres on demand."""
+    return f"chat:room:{room_id}:members"
+
+
+def members_version_key(room_id):
+    """Bumped on every invalidation, so a fill that read Postgres before it is discarded."""
+    return f"chat:room:{room_id}:members:version"
+
+
+def load_room_members(room_id):
+    return {
+        str(user_id) for user_id in
+        Participant.objects.filter(room_id=room_id, is_removed=False).values_list("user_id", flat=True)
+    }
+
+
+def get_room_members(room_id, client=None):
+    """
+    Ids (as strings) of the room's active participants: one SMEMBERS, or one
+    query on a miss. Like chat.membership.get_user_rooms, the fill watches the
+    version key, so a removal that commits while the query runs is not undone
+    by caching the pre-removal members.
+    """
+    client = client or get_redis()
+    key = members_key(room_id)
+    pipe = client.pipeline()
+    try:
+        pipe.watch(key, members_version_key(room_id))
+        members = pipe.smembers(key)
+        if not members:
+            members = load_room_members(room_id)
+            if members:
+                pipe.multi()
+                pipe.sadd(key, *members)
+                pipe.expire(key, settings.CHAT_ROOM_MEMBERS_TTL)
+                pipe.execute()
+    except redis.WatchError:
+        pass  # invalidated meanwhile; the next call loads again
+    finally:
+        pipe.reset()
+    return members
+
+
+def count_new_messages(messages):
+    """
+    Bump the unread counter of every participant except the sender, for each
+    room in `messages`. One round trip per room for membership plus one for all
+    increments; Redis errors are logged and left for rebuild_unread_counters.
+    """
+    try:
+        client = get_redis()
+        per_room = {}
+        for message in messages:
+            per_room.setdefault(message.room_id, Counter())[message.sender_id] += 1
+
+        pipe = client.pipeline(transaction=False)
+        for room_id, senders in per_room.items():
+            total = sum(senders.values())
+            for member in get_room_members(room_id, client):
+                count = total - senders.get(int(member), 0)
+                if count:
+                    pipe.hincrby(unread_key(member), str(room_id), count)
+        pipe.execute()
+    except redis.RedisError as e:
+        print("Unread counter update failed:", e)
+
+
+def set_unread(user_id, room_id, count):
+    """Called when a read is marked, with the exact count left after it."""
+    try:
+        get_redis().hset(unread_key(user_id), str(room_id), count)
+    except redis.RedisError as e:
+        print("Unread counter reset failed:", e)
+
+
+def clear_unread(user_id, room_id):
+    try:
+        get_redis().hdel(unread_key(user_id), str(room_id))
+    except redis.RedisError as e:
+        print("Unread counter reset failed:", e)
+
+
+def get_unread(user_id):
+    """All non-zero counters of a user, {room_id: count}, in one HGETALL."""
+    counters = get_redis().hgetall(unread_key(user_id))
+    return {room_id: int(count) for room_id, count in counters.items() if int(count) > 0}
+
+
+def rebuild_unread_counters(user_ids=None, batch_size=1000):
+    """
+    Recompute the counters from Postgres, e.g. after a Redis flush or to undo
+    drift from deleted messages. Users are rewritten in batches of whole hashes.
+    Returns the number of users rebuilt.
+    """
+    participants = Participant.objects.filter(is_removed=False).order_by("user_id")
+    if user_ids is not None:
+        participants = participants.filter(user_id__in=user_ids)
+
+    client = get_redis()
+    rebuilt = set()
+    counters = {}
+
+    def write(batch):
+        pipe = client.pipeline(transaction=False)
+        for user_id, rooms in batch.items():
+            pipe.delete(unread_key(user_id))
+            if rooms:
+                pipe.hset(unread_key(user_id), mapping=rooms)
+        pipe.execute()
+
+    rows = participants.with_unread_count().values_list("user_id", "room_id", "unread_count")
+    for user_id, room_id, count in rows.iterator(chunk_size=batch_size):
+        if user_id not in counters and len(counters) >= batch_size:
+            write(counters)
+            counters = {}
+        rooms = counters.setdefault(user_id, {})
+        if count:
+            rooms[str(room_id)] = count
+        rebuilt.add(user_id)
+    write(counters)
+
+    if user_ids is not None:
+        # users without any active room still get their stale hash cleared
+        write({user_id: {} for user_id in user_ids if user_id not in rebuilt})
+    return len(rebuilt)
@@ -0,0 +1,133 @@
+import hashlib
+import tempfile
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+from chat.models import Message, UploadChunk, UploadSession
+
+
+DEFAULT_UPLOADS = {
+    'CHUNK_SIZE': 5 * 1024 * 1024,
+    'MAX_SIZE': 512 * 1024 * 1024,
+    'SESSION_TTL': 24 * 3600,       # unfinished uploads are discarded after this many seconds
+    'ACCEL_REDIRECT_PREFIX': '',    # e.g. '/protected/' to let nginx serve downloads
+}
+
+BLOCK_SIZE = 64 * 1024
+
+
+def get_upload_config():
+    return {**DEFAULT_UPLOADS, **getattr(settings, 'CHAT_UPLOADS', {})}
+
+
+def read_blocks(stream, limit):
+    """Blocks of a request body, stopping one byte past `limit` so oversize bodies are caught."""
+    remaining = limit + 1
+    while remaining > 0:
+        block = stream.read(min(BLOCK_SIZE, remaining))
+        if not block:
+            return
+        remaining -= len(block)
+        yield block
+
+
+def store_chunk(session, index, stream, sha256):
+    """
+    Verify one chunk against its expected size and checksum and keep it.
+    Re-sending a chunk replaces it, so clients can simply retry.
+    """
+    if not 0 <= index < session.total_chunks:
+        raise ValidationError({"index": f"Must be between 0 and {session.total_chunks - 1}."})
+    expected_size = session.expected_chunk_size(index)
+
+    digest = hashlib.sha256()
+    size = 0
+    with tempfile.SpooledTemporaryFile(max_size=1024 * 1024) as part:
+        for block in read_blocks(stream, expected_size):
+            digest.update(block)
+            size += len(block)
+            part.write(block)
+        if size != expected_size:
+            raise ValidationError({"size": f"Chunk {index} must be {expected_size} bytes, got {size}."})
+        if digest.hexdigest() != sha256.lower():
+            raise ValidationError({"sha256": f"Checksum mismatch for chunk {index}."})
+
+        part.seek(0)
+        path = session.chunk_path(index)
+        default_storage.delete(path)
+        default_storage.save(path, File(part, name=path))
+
+    UploadChunk.objects.update_or_create(
+        session=session, index=index, defaults={'size': size, 'sha256': digest.hexdigest()}
+    )
+
+
+class AssembledUpload(File):
+    """
+    The chunks of a session read back in order, so storage receives the final
+    file as a stream without it ever being assembled in memory or on local disk.
+    """
+
+    def __init__(self, session):
+        super().__init__(None, name=session.file_name)
+        self.session = session
+        self.size = session.total_size
+        self.sha256 = hashlib.sha256()
+
+    def chunks(self, chunk_size=None):
+        for index in range(self.session.total_chunks):
+            with default_storage.open(self.session.chunk_path(index), 'rb') as part:
+                for block in iter(lambda: part.read(chunk_size or BLOCK_SIZE), b''):
+                    self.sha256.update(block)
+                    yield block
+
+    def multiple_chunks(self, chunk_size=None):
+        return True
+
+    def close(self):
+        pass
+
+
+def missing_chunks(session):
+    received = set(session.chunks.values_list('index', flat=True))
+    return [index for index in range(session.total_chunks) if index not in received]
+
+
+def complete_upload(session, content='', reply_to=None):
+    """Assemble the upload into Message.file and post the message."""
+    if missing_chunks(session):
+        raise ValidationError({"missing_chunks": "Upload is incomplete."})
+
+    message = Message(room=session.room, sender_id=session.user_id, content=content or '', reply_to=reply_to)
+    upload = AssembledUpload(session)
+    message.file.save(session.file_name, upload, save=False)
+    if session.sha256 and upload.sha256.hexdigest() != session.sha256.lower():
+        message.file.delete(save=False)
+        raise ValidationError({"sha256": "Checksum mismatch for the assembled file."})
+
+    with transaction.atomic():
+        message.save()
+        discard_upload(session)
+    return message
+
+
+def discard_upload(session):
+    for index in session.chunks.values_list('index', flat=True):
+        default_storage.delete(session.chunk_path(index))
+    session.delete()
+
+
+def cleanup_stale_uploads():
+    cutoff = timezone.now() - timedelta(seconds=get_upload_config()['SESSION_TTL'])
+    stale = UploadSession.objects.filter(created_at__lt=cutoff)
+    count = 0
+    for session in stale.iterator():
+        discard_upload(session)
+        count += 1
+    return count
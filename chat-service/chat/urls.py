@@ -1,9 +1,44 @@
 from django.urls import path
-from .views import ChatRoomListCreateView, ChatRoomDetailView, MessageListCreateView, MessageDetailView
+from .views import (
+    ChatRoomListCreateView,
+    ChatRoomDetailView,
+    ChatRoomParticipantsView,
+    ChatRoomReadView,
+    ChatMetricsView,
+    ChatRoomExportView,
+    ChatExportCreateView,
+    ChatExportDetailView,
+    ChatExportFileView,
+    MessageListCreateView,
+    MessageDetailView,
+    MessageFileView,
+    PrivateRoomView,
+    MessageSearchView,
+    UnreadCountersView,
+    UploadChunkView,
+    UploadCompleteView,
+    UploadSessionCreateView,
+    UploadSessionDetailView,
+)
 
 urlpatterns = [
     path('chatrooms/', ChatRoomListCreateView.as_view(), name='chatroom-list-create'),
+    path('chatrooms/private/', PrivateRoomView.as_view(), name='chatroom-private'),
     path('chatrooms/<uuid:pk>/', ChatRoomDetailView.as_view(), name='chatroom-detail'),
+    path('chatrooms/<uuid:pk>/participants/', ChatRoomParticipantsView.as_view(), name='chatroom-participants'),
+    path('chatrooms/<uuid:pk>/read/', ChatRoomReadView.as_view(), name='chatroom-read'),
     path('chatrooms/<uuid:room_id>/messages/', MessageListCreateView.as_view(), name='message-list-create'),
+    path('chatrooms/<uuid:room_id>/export/<str:export_format>/', ChatRoomExportView.as_view(), name='chatroom-export'),
+    path('chatrooms/<uuid:room_id>/exports/', ChatExportCreateView.as_view(), name='export-create'),
+    path('chatrooms/<uuid:room_id>/uploads/', UploadSessionCreateView.as_view(), name='upload-create'),
     path('messages/<uuid:pk>/', MessageDetailView.as_view(), name='message-detail'),
+    path('messages/<uuid:pk>/file/', MessageFileView.as_view(), name='message-file'),
+    path('exports/<uuid:pk>/', ChatExportDetailView.as_view(), name='export-detail'),
+    path('exports/<uuid:pk>/file/', ChatExportFileView.as_view(), name='export-file'),
+    path('uploads/<uuid:pk>/', UploadSessionDetailView.as_view(), name='upload-detail'),
+    path('uploads/<uuid:pk>/chunks/<int:index>/', UploadChunkView.as_view(), name='upload-chunk'),
+    path('uploads/<uuid:pk>/complete/', UploadCompleteView.as_view(), name='upload-complete'),
+    path('search/', MessageSearchView.as_view(), name='message-search'),
+    path('unread/', UnreadCountersView.as_view(), name='unread-counters'),
+    path('metrics/', ChatMetricsView.as_view(), name='chat-metrics'),
 ]
@@ -1,20 +1,189 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+import jwt
 import requests
+from requests.adapters import HTTPAdapter
 from django.conf import settings
 
-def validate_token(token):
+
+DEFAULT_TOKEN_VERIFICATION = {
+    'MODE': 'local',            # 'local' verifies the signature here, 'remote' asks user-service
+    'REMOTE_FALLBACK': False,   # ask user-service when local verification rejects a token
+    'CACHE_SIZE': 10000,
+    'CACHE_TTL': 300,           # seconds, never longer than the token's own exp
+    'REMOTE_TIMEOUT': 3,
+    'REMOTE_POOL_SIZE': 20,
+}
+
+
+def get_verification_config():
+    return {**DEFAULT_TOKEN_VERIFICATION, **getattr(settings, 'TOKEN_VERIFICATION', {})}
+
+
+class TokenCache:
+    """
+    Bounded LRU cache of validated user data with a per-entry TTL.
+    Entries are keyed by the SHA-256 of the token, never by the token itself.
+    """
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key_for(token):
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def get(self, token):
+        key = self.key_for(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            deadline, user_data = entry
+            if deadline <= time.monotonic():
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return user_data
+
+    def set(self, token, user_data, expires_at=None):
+        ttl = self.ttl
+        if expires_at is not None:
+            ttl = min(ttl, expires_at - time.time())
+        if ttl <= 0:
+            return
+        key = self.key_for(token)
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, user_data)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+_token_cache = None
+_session = None
+_init_lock = threading.Lock()
+
+
+def get_token_cache():
+    global _token_cache
+    if _token_cache is None:
+        with _init_lock:
+            if _token_cache is None:
+                config = get_verification_config()
+                _token_cache = TokenCache(config['CACHE_SIZE'], config['CACHE_TTL'])
+    return _token_cache
+
+
+def get_session():
+    """
+    Keep-alive session shared by every remote introspection call in this process.
+    """
+    global _session
+    if _session is None:
+        with _init_lock:
+            if _session is None:
+                pool_size = get_verification_config()['REMOTE_POOL_SIZE']
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                _session = session
+    return _session
+
+
+def verify_token_locally(token):
+    """
+    Checks the JWT signature and expiry with the key shared with user-service.
+    Raises jwt.InvalidTokenError when the token is not acceptable.
+    """
+    jwt_settings = settings.SIMPLE_JWT
+    key = jwt_settings.get('VERIFYING_KEY') or jwt_settings['SIGNING_KEY']
+    claims = jwt.decode(token, key, algorithms=[jwt_settings.get('ALGORITHM', 'HS256')])
+    if claims.get('token_type', 'access') != 'access':
+        raise jwt.InvalidTokenError("Not an access token")
+    if claims.get('user_id') is None:
+        raise jwt.InvalidTokenError("Token has no user_id claim")
+    return {
+        'valid': True,
+        'id': claims['user_id'],
+        'role': claims.get('role'),
+        'username': claims.get('username'),
+        'exp': claims.get('exp'),
+    }
+
+
+def introspect_token_remotely(token):
     """
     Sends JWT token to user-service to verify.
     """
     try:
-        response = requests.get(
+        response = get_session().get(
             f"{settings.USER_SERVICE_URL}/auth/validate-token/",
-            headers={"Authorization": f"Bearer {token}"}
+            headers={"Authorization": f"Bearer {token}"},
+            timeout=get_verification_config()['REMOTE_TIMEOUT'],
         )
         if response.status_code == 200:
             data = response.json()
             if data.get("valid"):
-                return data  
+                return data
         return None
     except Exception as e:
         print("Error validating token:", e)
         return None
+
+
+def validate_token(token):
+    """
+    Returns the user data for a valid token or None.
+    Cached results are served first, then local verification, then user-service.
+    """
+    cache = get_token_cache()
+    user_data = cache.get(token)
+    if user_data is not None:
+        return user_data
+
+    config = get_verification_config()
+    if config['MODE'] == 'local':
+        try:
+            user_data = verify_token_locally(token)
+        except jwt.ExpiredSignatureError:
+            return None
+        except jwt.InvalidTokenError:
+            if not config['REMOTE_FALLBACK']:
+                return None
+
+    if user_data is None:
+        user_data = introspect_token_remotely(token)
+
+    if user_data:
+        cache.set(token, user_data, expires_at=user_data.get('exp'))
+    return user_data
@@ -1,10 +1,37 @@
+import io
+import uuid
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
+from redis import RedisError
+from django.contrib.postgres.search import SearchHeadline, SearchQuery, SearchRank
+from django.db import transaction
+from django.db.models import F, FloatField
+from django.db.models.functions import Cast
 from django.shortcuts import get_object_or_404
-from chat.models import ChatRoom, Message, Participant
-from chat.serializers import ChatRoomSerializer, MessageSerializer
-from chat.permissions import IsAuthenticatedViaUserService
+from chat import metrics
+from chat.downloads import attachment_response
+from chat.exports import FORMATS, export_response
+from chat.membership import get_user_rooms, require_member
+from chat.models import ChatExport, ChatRoom, Message, Participant, UploadSession, User
+from chat.serializers import (
+    ChatExportSerializer,
+    ChatRoomSerializer,
+    ChatRoomInboxSerializer,
+    MessageSearchResultSerializer,
+    MarkReadSerializer,
+    MessageSerializer,
+    ParticipantSerializer,
+    PrivateRoomSerializer,
+    ReadReceiptSerializer,
+    UploadCompleteSerializer,
+    UploadSessionSerializer,
+)
+from chat.permissions import IsAdminViaUserService, IsAuthenticatedViaUserService
+from chat.pagination import MessageCursorPagination, SearchCursorPagination
+from chat.tasks import export_chat_room_task
+from chat.unread import get_unread, set_unread
+from chat.uploads import complete_upload, discard_upload, get_upload_config, missing_chunks, store_chunk
 
 
 class ChatRoomListCreateView(APIView):
@@ -12,8 +39,8 @@ class ChatRoomListCreateView(APIView):
 
     def get(self, request):
         user_id = request.user_data["id"]
-        chatrooms = ChatRoom.objects.filter(participants__user_id=user_id)
-        serializer = ChatRoomSerializer(chatrooms, many=True)
+        chatrooms = ChatRoom.objects.inbox(user_id)
+        serializer = ChatRoomInboxSerializer(chatrooms, many=True)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
     def post(self, request):
@@ -25,29 +52,73 @@ class ChatRoomListCreateView(APIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+class PrivateRoomView(APIView):
+    """
+    POST {"user_id": <other user>} returns the caller's one-to-one room with
+    that user, creating it on first use (201). Private rooms are found by
+    their user pair, so clients never have to agree on a room name.
+    """
+    permission_classes = [IsAuthenticatedViaUserService]
+
+    def post(self, request):
+        serializer = PrivateRoomSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        user_id = request.user_data["id"]
+        other_id = serializer.validated_data["user_id"]
+        if other_id == user_id:
+            return Response({"user_id": ["Cannot open a private room with yourself."]}, status=status.HTTP_400_BAD_REQUEST)
+
+        chatroom, created = ChatRoom.objects.private_room(user_id, other_id), False
+        if chatroom is None:
+            get_object_or_404(User, pk=other_id)
+            chatroom, created = ChatRoom.objects.get_or_create_private(user_id, other_id)
+        return Response(
+            ChatRoomSerializer(chatroom).data,
+            status=status.HTTP_201_CREATED if created else status.HTTP_200_OK,
+        )
+
+
 class ChatRoomDetailView(APIView):
     permission_classes = [IsAuthenticatedViaUserService]
 
     def get(self, request, pk):
         user_id = request.user_data["id"]
-        chatroom = get_object_or_404(ChatRoom, pk=pk, participants__user_id=user_id)
+        require_member(user_id, pk)
+        chatroom = get_object_or_404(ChatRoom.objects.prefetch_related("participants__user"), pk=pk)
         serializer = ChatRoomSerializer(chatroom)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
 
+class ChatRoomParticipantsView(APIView):
+    permission_classes = [IsAuthenticatedViaUserService]
+
+    def get(self, request, pk):
+        user_id = request.user_data["id"]
+        require_member(user_id, pk)
+        participants = Participant.objects.filter(room_id=pk).select_related("user")
+        serializer = ParticipantSerializer(participants, many=True)
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+
 class MessageListCreateView(APIView):
     permission_classes = [IsAuthenticatedViaUserService]
 
     def get(self, request, room_id):
         user_id = request.user_data["id"]
-        chatroom = get_object_or_404(ChatRoom, id=room_id, participants__user_id=user_id)
-        messages = Message.objects.filter(room=chatroom).order_by("timestamp")
-        serializer = MessageSerializer(messages, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        require_member(user_id, room_id)
+        chatroom = get_object_or_404(ChatRoom, id=room_id)
+        messages = Message.objects.filter(room=chatroom).select_related("sender")
+        paginator = MessageCursorPagination()
+        # no message predates its room, so history reads stop at the room's creation
+        page = paginator.paginate_queryset(messages, request, floor=chatroom.created_at)
+        serializer = MessageSerializer(page, many=True)
+        return paginator.get_paginated_response(page, serializer.data)
 
     def post(self, request, room_id):
         user_id = request.user_data["id"]
-        chatroom = get_object_or_404(ChatRoom, id=room_id, participants__user_id=user_id)
+        require_member(user_id, room_id)
+        chatroom = get_object_or_404(ChatRoom, id=room_id)
         serializer = MessageSerializer(data=request.data, context={"request": request})
         if serializer.is_valid():
             serializer.save(room=chatroom, sender_id=user_id)
@@ -75,11 +146,237 @@ class MessageDetailView(APIView):
         return Response({"detail": "Message deleted"}, status=status.HTTP_204_NO_CONTENT)
 
 
-class MarkMessageReadView(APIView):
+class ChatRoomReadView(APIView):
+    """
+    GET returns every participant's read watermark (read receipts);
+    POST advances the caller's watermark to `message_id`, or to the latest
+    message when it is omitted.
+    """
+    permission_classes = [IsAuthenticatedViaUserService]
+
+    def get(self, request, pk):
+        user_id = request.user_data["id"]
+        require_member(user_id, pk)
+        participants = Participant.objects.filter(room_id=pk, is_removed=False)
+        serializer = ReadReceiptSerializer(participants, many=True)
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+    def post(self, request, pk):
+        user_id = request.user_data["id"]
+        participant = get_object_or_404(Participant, room_id=pk, user_id=user_id, is_removed=False)
+        serializer = MarkReadSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        messages = Message.objects.filter(room_id=pk)
+        message_id = serializer.validated_data.get("message_id")
+        if message_id:
+            message = get_object_or_404(messages, pk=message_id)
+        else:
+            message = messages.order_by("-timestamp", "-id").first()
+        if message is not None:
+            participant.mark_read(message)
+        data = ReadReceiptSerializer(participant).data
+        data["unread_count"] = participant.unread_messages().count()
+        set_unread(user_id, pk, data["unread_count"])
+        return Response(data, status=status.HTTP_200_OK)
+
+
+class UnreadCountersView(APIView):
+    """Unread counts of every room of the caller, served from Redis."""
+    permission_classes = [IsAuthenticatedViaUserService]
+
+    def get(self, request):
+        user_id = request.user_data["id"]
+        try:
+            rooms = get_unread(user_id)
+        except RedisError:
+            rooms = {
+                str(room_id): count for room_id, count in
+                Participant.objects.filter(user_id=user_id, is_removed=False)
+                .with_unread_count().filter(unread_count__gt=0)
+                .values_list("room_id", "unread_count")
+            }
+        return Response({"rooms": rooms, "total": sum(rooms.values())}, status=status.HTTP_200_OK)
+
+
+class MessageSearchView(APIView):
+    """
+    Full-text search over the caller's rooms, optionally narrowed with
+    `room=<id>`. Uses the GIN-indexed Message.search_vector; `q` accepts
+    websearch syntax ("quoted phrases", -excluded, or).
+    """
+    permission_classes = [IsAuthenticatedViaUserService]
+
+    def get(self, request):
+        user_id = request.user_data["id"]
+        text = request.query_params.get("q", "").strip()
+        if not text:
+            return Response({"q": "This parameter is required."}, status=status.HTTP_400_BAD_REQUEST)
+
+        query = SearchQuery(text, search_type="websearch", config="english")
+        # the caller's rooms come from the membership cache instead of a join
+        messages = Message.objects.filter(search_vector=query, deleted=False, room_id__in=get_user_rooms(user_id))
+        room_id = request.query_params.get("room")
+        if room_id:
+            try:
+                messages = messages.filter(room_id=uuid.UUID(room_id))
+            except ValueError:
+                return Response({"room": "Must be a room id."}, status=status.HTTP_400_BAD_REQUEST)
+        messages = messages.select_related("sender").annotate(
+            # ts_rank is a real; as a double it survives the round trip through a cursor
+            rank=Cast(SearchRank(F("search_vector"), query), FloatField()),
+            headline=SearchHeadline(
+                "content", query, config="english",
+                start_sel="<mark>", stop_sel="</mark>", max_fragments=2,
+            ),
+        )
+
+        paginator = SearchCursorPagination()
+        page = paginator.paginate_queryset(messages, request)
+        serializer = MessageSearchResultSerializer(page, many=True)
+        return paginator.get_paginated_response(page, serializer.data)
+
+
+class UploadSessionCreateView(APIView):
+    """
+    Starts a resumable upload into a room. The client then PUTs each chunk
+    and completes the session, which posts the message with the file.
+    """
+    permission_classes = [IsAuthenticatedViaUserService]
+
+    def post(self, request, room_id):
+        user_id = request.user_data["id"]
+        require_member(user_id, room_id)
+        chatroom = get_object_or_404(ChatRoom, id=room_id)
+        serializer = UploadSessionSerializer(data=request.data)
+        if serializer.is_valid():
+            session = serializer.save(room=chatroom, user_id=user_id, chunk_size=get_upload_config()["CHUNK_SIZE"])
+            return Response(UploadSessionSerializer(session).data, status=status.HTTP_201_CREATED)
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+class UploadSessionDetailView(APIView):
+    """GET shows which chunks arrived, so an interrupted client knows where to resume."""
+    permission_classes = [IsAuthenticatedViaUserService]
+
+    def get(self, request, pk):
+        user_id = request.user_data["id"]
+        session = get_object_or_404(UploadSession, pk=pk, user_id=user_id)
+        require_member(user_id, session.room_id)
+        return Response(UploadSessionSerializer(session).data, status=status.HTTP_200_OK)
+
+    def delete(self, request, pk):
+        session = get_object_or_404(UploadSession, pk=pk, user_id=request.user_data["id"])
+        discard_upload(session)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class UploadChunkView(APIView):
+    """
+    PUT the raw bytes of one chunk with its hex SHA-256 in X-Chunk-Sha256.
+    The body is streamed and verified, never parsed or buffered whole.
+    """
+    permission_classes = [IsAuthenticatedViaUserService]
+
+    def put(self, request, pk, index):
+        user_id = request.user_data["id"]
+        session = get_object_or_404(UploadSession, pk=pk, user_id=user_id)
+        require_member(user_id, session.room_id)
+        sha256 = request.headers.get("X-Chunk-Sha256")
+        if not sha256:
+            return Response({"sha256": "X-Chunk-Sha256 header is required."}, status=status.HTTP_400_BAD_REQUEST)
+        store_chunk(session, index, request.stream or io.BytesIO(), sha256)
+        return Response(UploadSessionSerializer(session).data, status=status.HTTP_200_OK)
+
+
+class UploadCompleteView(APIView):
     permission_classes = [IsAuthenticatedViaUserService]
 
     def post(self, request, pk):
         user_id = request.user_data["id"]
-        message = get_object_or_404(Message, pk=pk)
-        message.read_by.add(user_id)
-        return Response({"detail": "Message marked as read."}, status=status.HTTP_200_OK)
+        session = get_object_or_404(UploadSession.objects.select_related("room"), pk=pk, user_id=user_id)
+        require_member(user_id, session.room_id)
+        serializer = UploadCompleteSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        missing = missing_chunks(session)
+        if missing:
+            return Response({"missing_chunks": missing}, status=status.HTTP_400_BAD_REQUEST)
+        reply_to = None
+        if serializer.validated_data.get("reply_to"):
+            reply_to = get_object_or_404(Message, pk=serializer.validated_data["reply_to"], room=session.room)
+        message = complete_upload(session, serializer.validated_data["content"], reply_to)
+        return Response(MessageSerializer(message).data, status=status.HTTP_201_CREATED)
+
+
+class MessageFileView(APIView):
+    permission_classes = [IsAuthenticatedViaUserService]
+
+    def get(self, request, pk):
+        user_id = request.user_data["id"]
+        message = get_object_or_404(Message, pk=pk, deleted=False)
+        require_member(user_id, message.room_id)
+        if not message.file:
+            return Response({"detail": "Message has no attachment."}, status=status.HTTP_404_NOT_FOUND)
+        return attachment_response(request, message.file)
+
+
+class ChatRoomExportView(APIView):
+    """
+    The room's full history as one NDJSON or CSV download, each message with
+    its attachment's manifest entry, streamed instead of paged.
+    """
+    permission_classes = [IsAuthenticatedViaUserService]
+
+    def get(self, request, room_id, export_format):
+        require_member(request.user_data["id"], room_id)
+        chatroom = get_object_or_404(ChatRoom, id=room_id)
+        if export_format not in FORMATS:
+            return Response({"format": f"Must be one of: {', '.join(FORMATS)}."}, status=status.HTTP_400_BAD_REQUEST)
+        return export_response(request, chatroom, export_format)
+
+
+class ChatExportCreateView(APIView):
+    """Queues a background export, a zip with the attachments themselves; poll it at exports/<id>/."""
+    permission_classes = [IsAuthenticatedViaUserService]
+
+    def post(self, request, room_id):
+        user_id = request.user_data["id"]
+        require_member(user_id, room_id)
+        chatroom = get_object_or_404(ChatRoom, id=room_id)
+        serializer = ChatExportSerializer(data=request.data)
+        if serializer.is_valid():
+            export = serializer.save(room=chatroom, user_id=user_id)
+            transaction.on_commit(lambda: export_chat_room_task.delay(export.id))
+            return Response(ChatExportSerializer(export).data, status=status.HTTP_202_ACCEPTED)
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+class ChatExportDetailView(APIView):
+    permission_classes = [IsAuthenticatedViaUserService]
+
+    def get(self, request, pk):
+        user_id = request.user_data["id"]
+        export = get_object_or_404(ChatExport, pk=pk, user_id=user_id)
+        require_member(user_id, export.room_id)
+        return Response(ChatExportSerializer(export).data, status=status.HTTP_200_OK)
+
+
+class ChatExportFileView(APIView):
+    permission_classes = [IsAuthenticatedViaUserService]
+
+    def get(self, request, pk):
+        user_id = request.user_data["id"]
+        export = get_object_or_404(ChatExport, pk=pk, user_id=user_id)
+        require_member(user_id, export.room_id)
+        if export.status != "done" or not export.file:
+            return Response({"detail": "Export is not ready."}, status=status.HTTP_404_NOT_FOUND)
+        return attachment_response(request, export.file)
+
+
+class ChatMetricsView(APIView):
+    """Websocket throttling and backpressure counters of the worker serving the request."""
+    permission_classes = [IsAdminViaUserService]
+
+    def get(self, request):
+        return Response(metrics.snapshot(), status=status.HTTP_200_OK)
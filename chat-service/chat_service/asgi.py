@@ -1,14 +1,24 @@
 import os
 from django.core.asgi import get_asgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'chat_service.settings')
+
+# Set up Django before the routing imports pull in models
+django_asgi_app = get_asgi_application()
+
 from channels.routing import ProtocolTypeRouter, URLRouter
-from channels.auth import AuthMiddlewareStack
+from chat.lifespan import flush_on_reactor_shutdown, lifespan
+from chat.middleware import JWTAuthMiddleware
 import chat.routing
-
-os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'your_project_name.settings')
+import notifications.routing
 
 application = ProtocolTypeRouter({
-    "http": get_asgi_application(),
-    "websocket": AuthMiddlewareStack(
-        URLRouter(chat.routing.websocket_urlpatterns)
+    "http": django_asgi_app,
+    "websocket": JWTAuthMiddleware(
+        URLRouter(chat.routing.websocket_urlpatterns + notifications.routing.websocket_urlpatterns)
     ),
+    "lifespan": lifespan,
 })
+
+# whatever the worker's buffers still hold is written out when it stops
+flush_on_reactor_shutdown()
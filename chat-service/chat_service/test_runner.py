@@ -0,0 +1,29 @@
+from django.db import connections
+from django.db.models.signals import pre_migrate
+from django.test.runner import DiscoverRunner
+
+
+def create_users_table(using, **kwargs):
+    """
+    chat.User is unmanaged: in every environment the users table belongs to
+    user-service. The test database starts empty, so create it here before
+    the chat migrations add foreign keys to it.
+    """
+    from chat.models import User
+
+    connection = connections[using]
+    if User._meta.db_table in connection.introspection.table_names():
+        return
+    with connection.schema_editor() as editor:
+        sql, params = editor.table_sql(User)
+        editor.execute(sql, params)
+
+
+class ChatTestRunner(DiscoverRunner):
+
+    def setup_databases(self, **kwargs):
+        pre_migrate.connect(create_users_table, dispatch_uid="chat_create_users_table")
+        try:
+            return super().setup_databases(**kwargs)
+        finally:
+            pre_migrate.disconnect(dispatch_uid="chat_create_users_table")
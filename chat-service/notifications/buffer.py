@@ -0,0 +1,64 @@
+import asyncio
+import weakref
+
+from channels.db import database_sync_to_async
+
+from notifications.services import fan_out, get_notification_config, notify_chat_messages
+
+
+class ChatNotificationBuffer:
+    """
+    Collects the messages ChatConsumer accepts on this worker and turns them
+    into notifications once per flush interval: a single membership query,
+    presence lookup, upsert and fan-out for everything that arrived in the
+    interval, however many messages and rooms that is. A busy room therefore
+    bumps each recipient's notification once a second instead of per message.
+
+    Notifications are best effort: a flush that fails is logged and dropped,
+    the messages themselves are already stored.
+    """
+
+    def __init__(self, flush_interval=1.0):
+        self.flush_interval = flush_interval
+        self._pending = []
+        self._lock = asyncio.Lock()
+        self._flush_task = None
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, payload):
+        self._pending.append(payload)
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.ensure_future(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_interval)
+        await self.flush()
+
+    async def flush(self):
+        if self._flush_task is not None and self._flush_task is not asyncio.current_task():
+            self._flush_task.cancel()
+        self._flush_task = None
+        async with self._lock:
+            payloads, self._pending = self._pending, []
+            if not payloads:
+                return
+            try:
+                notifications = await database_sync_to_async(notify_chat_messages)(payloads)
+                await fan_out(notifications)
+            except Exception as e:
+                print("Chat notification flush failed:", e)
+
+
+_buffers = weakref.WeakKeyDictionary()
+
+
+def get_notification_buffer():
+    """One buffer per event loop, i.e. per ASGI worker process."""
+    loop = asyncio.get_running_loop()
+    buffer = _buffers.get(loop)
+    if buffer is None:
+        buffer = ChatNotificationBuffer(flush_interval=get_notification_config()['CHAT_FLUSH_INTERVAL'])
+        _buffers[loop] = buffer
+    return buffer
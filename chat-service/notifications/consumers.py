@@ -0,0 +1,66 @@
+import json
+
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncWebsocketConsumer
+
+from .services import mark_delivered, mark_read, notification_group, unread_count
+
+
+class NotificationConsumer(AsyncWebsocketConsumer):
+    """
+    A user's notification feed, one socket per device. It gets the unread
+    count on connect and then {"type": "notifications", "items": [...]} for
+    each batch fanned out to the user (see notifications.services.fan_out);
+    notifications a socket received are left out of the mail digests.
+    Clients send {"type": "read", "ids": [...]} (or without ids, everything).
+    """
+
+    async def connect(self):
+        user = self.scope.get('user')
+        if user is None or not user.is_authenticated:
+            await self.close(code=4401)
+            return
+        self.user_id = user.id
+        self.group_name = notification_group(self.user_id)
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        await self.accept(subprotocol=self.scope.get('auth_subprotocol'))
+        await self.send_json({'type': 'notifications.unread', 'count': await self.get_unread_count()})
+
+    async def disconnect(self, close_code):
+        if getattr(self, 'group_name', None) is not None:
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+
+    async def receive(self, text_data=None, bytes_data=None):
+        try:
+            data = json.loads(text_data or '')
+        except ValueError:
+            await self.send_json({'error': "invalid frame"})
+            return
+        if data.get('type') != 'read':
+            await self.send_json({'error': "unknown frame type"})
+            return
+        ids = data.get('ids')
+        if ids is not None and not (isinstance(ids, list) and all(isinstance(i, int) for i in ids)):
+            await self.send_json({'error': "ids must be a list of notification ids"})
+            return
+        await self.read(ids)
+        await self.send_json({'type': 'notifications.unread', 'count': await self.get_unread_count()})
+
+    async def notification_batch(self, event):
+        await self.send_json({'type': 'notifications', 'items': event['items']})
+        await self.delivered([item['id'] for item in event['items']])
+
+    async def send_json(self, data):
+        await self.send(text_data=json.dumps(data))
+
+    @database_sync_to_async
+    def get_unread_count(self):
+        return unread_count(self.user_id)
+
+    @database_sync_to_async
+    def delivered(self, ids):
+        return mark_delivered(self.user_id, ids)
+
+    @database_sync_to_async
+    def read(self, ids):
+        return mark_read(self.user_id, ids)
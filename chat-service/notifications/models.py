@@ -1,3 +1,45 @@
+from django.conf import settings
 from django.db import models
+from django.db.models import Q
 
-# Create your models here.
+
+class Notification(models.Model):
+    """
+    One entry in a user's inbox. Events that share a group_key (e.g. every
+    message of one chat room) collapse into a single unread row whose count
+    goes up, so a busy room costs one row per recipient, not one per message.
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='notifications')
+    kind = models.CharField(max_length=50)
+    title = models.CharField(max_length=255)
+    body = models.TextField(blank=True)
+    data = models.JSONField(default=dict, blank=True)
+    group_key = models.CharField(max_length=255, blank=True, default='')
+    count = models.PositiveIntegerField(default=1)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    read_at = models.DateTimeField(null=True, blank=True)
+    # set when a connected socket received it, or a digest mail listed it
+    delivered_at = models.DateTimeField(null=True, blank=True)
+    digested_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-updated_at', '-id']
+        indexes = [
+            models.Index(fields=['user', '-updated_at', '-id'], name='notification_inbox_idx'),
+            models.Index(fields=['user'], name='notification_unread_idx', condition=Q(read_at__isnull=True)),
+            models.Index(
+                fields=['updated_at'], name='notification_digest_idx',
+                condition=Q(read_at__isnull=True, delivered_at__isnull=True, digested_at__isnull=True),
+            ),
+        ]
+        constraints = [
+            # target of the upsert in notifications.services.store
+            models.UniqueConstraint(
+                fields=['user', 'group_key'], name='notification_open_group_uniq',
+                condition=Q(read_at__isnull=True) & ~Q(group_key=''),
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} for user {self.user_id}: {self.title}"
@@ -0,0 +1,50 @@
+import base64
+import binascii
+from datetime import datetime
+
+from django.db.models import Q
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+
+from chat.pagination import MessageCursorPagination
+
+
+class NotificationCursorPagination(MessageCursorPagination):
+    """
+    Keyset pagination over the inbox, newest (updated_at, id) first, served
+    by notification_inbox_idx. `cursor=<cursor>` continues after the last row
+    of a page. A notification bumped while paging moves to the top, so it is
+    seen again on the next refresh rather than twice in one walk.
+    """
+    page_size = 20
+    max_page_size = 100
+
+    @staticmethod
+    def encode(row):
+        raw = f"{row.updated_at.isoformat()}|{row.id}"
+        return base64.urlsafe_b64encode(raw.encode()).decode()
+
+    @staticmethod
+    def decode(value):
+        try:
+            updated_at, notification_id = base64.urlsafe_b64decode(value.encode()).decode().split("|")
+            return datetime.fromisoformat(updated_at), int(notification_id)
+        except (ValueError, binascii.Error, UnicodeDecodeError):
+            raise ValidationError({"cursor": "Invalid cursor."})
+
+    def paginate_queryset(self, queryset, request):
+        limit = self.get_page_size(request)
+        cursor = request.query_params.get("cursor")
+        if cursor:
+            updated_at, notification_id = self.decode(cursor)
+            queryset = queryset.filter(Q(updated_at__lt=updated_at) | Q(updated_at=updated_at, id__lt=notification_id))
+        rows = list(queryset.order_by("-updated_at", "-id")[:limit + 1])
+        self.has_more = len(rows) > limit
+        return rows[:limit]
+
+    def get_paginated_response(self, page, data):
+        return Response({
+            "results": data,
+            "has_more": self.has_more,
+            "cursor": self.encode(page[-1]) if page and self.has_more else None,
+        })
@@ -0,0 +1,14 @@
+import hmac
+
+from rest_framework import permissions
+
+from notifications.services import get_notification_config
+
+
+class HasServiceToken(permissions.BasePermission):
+    """Other services (case-service) posting events authenticate with the shared X-Service-Token."""
+
+    def has_permission(self, request, view):
+        expected = get_notification_config()['SERVICE_TOKEN']
+        token = request.headers.get("X-Service-Token", "")
+        return bool(expected) and hmac.compare_digest(token.encode(), expected.encode())
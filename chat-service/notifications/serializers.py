@@ -0,0 +1,26 @@
+from rest_framework import serializers
+from .models import Notification
+
+
+class NotificationSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Notification
+        fields = ['id', 'kind', 'title', 'body', 'data', 'count', 'created_at', 'updated_at', 'read_at']
+
+
+class NotificationReadSerializer(serializers.Serializer):
+    # without ids every notification of the caller is marked read
+    ids = serializers.ListField(child=serializers.IntegerField(), required=False, max_length=1000)
+
+
+class NotificationEventSerializer(serializers.Serializer):
+    user_ids = serializers.ListField(child=serializers.IntegerField(), allow_empty=False, max_length=10000)
+    kind = serializers.CharField(max_length=50)
+    title = serializers.CharField(max_length=255)
+    body = serializers.CharField(required=False, allow_blank=True, default='')
+    data = serializers.JSONField(required=False, default=dict)
+    group_key = serializers.CharField(max_length=255, required=False, allow_blank=True, default='')
+
+
+class NotificationEventBatchSerializer(serializers.Serializer):
+    events = NotificationEventSerializer(many=True, allow_empty=False, max_length=1000)
@@ -0,0 +1,229 @@
+import asyncio
+import json
+from collections import defaultdict
+
+import redis
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+from chat import unread
+from chat.models import ChatRoom, Participant
+from chat.presence import online_users
+from notifications.models import Notification
+
+
+DEFAULT_NOTIFICATIONS = {
+    'CHAT_FLUSH_INTERVAL': 1.0,   # seconds chat messages are collected before they become notifications
+    'PREVIEW_LENGTH': 100,
+    'UPSERT_BATCH': 1000,         # rows per INSERT ... ON CONFLICT statement
+    'FANOUT_CONCURRENCY': 100,    # group_send calls in flight at once
+    'DIGEST_DELAY': 600,          # seconds an undelivered notification waits before it goes into a digest
+    'DIGEST_BATCH': 500,          # users per digest query and SMTP connection
+    'DIGEST_MAX_ITEMS': 20,       # notifications listed in one digest mail
+    'SERVICE_TOKEN': '',          # X-Service-Token for the events endpoint; empty disables it
+}
+
+
+def get_notification_config():
+    return {**DEFAULT_NOTIFICATIONS, **getattr(settings, 'NOTIFICATIONS', {})}
+
+
+def notification_group(user_id):
+    return f"notifications_{user_id}"
+
+
+def make_event(user_id, kind, title, body='', data=None, group_key='', count=1):
+    return {
+        'user_id': user_id,
+        'kind': kind,
+        'title': title[:255],
+        'body': body,
+        'data': data or {},
+        'group_key': group_key,
+        'count': count,
+    }
+
+
+def collapse(events):
+    """Merge events for the same open group: one statement may not upsert a row twice."""
+    merged, ungrouped = {}, []
+    for event in events:
+        if not event['group_key']:
+            ungrouped.append(event)
+            continue
+        key = (event['user_id'], event['group_key'])
+        if key in merged:
+            event = {**event, 'count': merged[key]['count'] + event['count']}
+        merged[key] = event
+    return ungrouped + list(merged.values())
+
+
+def store(events):
+    """
+    Write events to the inbox with one INSERT ... ON CONFLICT per UPSERT_BATCH
+    rows. An event whose group_key matches an unread notification of the same
+    user bumps that row's count and content and makes it pending again,
+    instead of adding a row. Returns the notifications written.
+    """
+    table = connection.ops.quote_name(Notification._meta.db_table)
+    batch = get_notification_config()['UPSERT_BATCH']
+    now = timezone.now()
+    rows = collapse(events)
+    ids = []
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), batch):
+            chunk = rows[start:start + batch]
+            values = ", ".join(["(%s, %s, %s, %s, %s::jsonb, %s, %s, %s, %s)"] * len(chunk))
+            params = []
+            for row in chunk:
+                params += [
+                    row['user_id'], row['kind'], row['title'], row['body'], json.dumps(row['data']),
+                    row['group_key'], row['count'], now, now,
+                ]
+            cursor.execute(
+                f"INSERT INTO {table} (user_id, kind, title, body, data, group_key, count, created_at, updated_at) "
+                f"VALUES {values} "
+                # must match the predicate of notification_open_group_uniq
+                f"ON CONFLICT (user_id, group_key) WHERE read_at IS NULL AND NOT (group_key = '') "
+                f"DO UPDATE SET kind = EXCLUDED.kind, title = EXCLUDED.title, body = EXCLUDED.body, "
+                f"data = EXCLUDED.data, count = {table}.count + EXCLUDED.count, "
+                f"updated_at = EXCLUDED.updated_at, delivered_at = NULL, digested_at = NULL "
+                f"RETURNING id",
+                params,
+            )
+            ids += [row[0] for row in cursor.fetchall()]
+    return list(Notification.objects.filter(pk__in=ids).order_by('user_id', 'updated_at', 'id')) if ids else []
+
+
+def serialize_notification(notification):
+    return {
+        'id': notification.id,
+        'kind': notification.kind,
+        'title': notification.title,
+        'body': notification.body,
+        'data': notification.data,
+        'count': notification.count,
+        'created_at': notification.created_at.isoformat(),
+        'updated_at': notification.updated_at.isoformat(),
+        'read_at': notification.read_at.isoformat() if notification.read_at else None,
+    }
+
+
+async def fan_out(notifications, channel_layer=None):
+    """
+    Push notifications to the users' sockets (NotificationConsumer): one
+    notification_batch event per user, however many of their notifications
+    changed, with at most FANOUT_CONCURRENCY group sends in flight.
+    """
+    channel_layer = channel_layer or get_channel_layer()
+    per_user = defaultdict(list)
+    for notification in notifications:
+        per_user[notification.user_id].append(serialize_notification(notification))
+    sends = [
+        (notification_group(user_id), {'type': 'notification_batch', 'items': items})
+        for user_id, items in per_user.items()
+    ]
+    concurrency = get_notification_config()['FANOUT_CONCURRENCY']
+    for start in range(0, len(sends), concurrency):
+        await asyncio.gather(*(
+            channel_layer.group_send(group, event) for group, event in sends[start:start + concurrency]
+        ))
+
+
+def fan_out_sync(notifications):
+    if notifications:
+        async_to_sync(fan_out)(notifications)
+
+
+def notify(user_ids, kind, title, body='', data=None, group_key=''):
+    """Store one event for each user and push it to those connected. Returns the notifications."""
+    notifications = store([make_event(user_id, kind, title, body, data, group_key) for user_id in set(user_ids)])
+    fan_out_sync(notifications)
+    return notifications
+
+
+def connected_users(room_ids):
+    """Who has a socket open in each room; they see new messages live and are not notified."""
+    try:
+        return online_users(room_ids, unread.get_redis())
+    except redis.RedisError as e:
+        print("Presence lookup for notifications failed:", e)
+        return {}
+
+
+def preview(payload, length):
+    text = payload['content'] or payload.get('file_name') or ''
+    if len(text) > length:
+        text = text[:length] + '…'
+    return f"{payload['sender']}: {text}" if payload.get('sender') else text
+
+
+def chat_message_events(payloads):
+    """
+    Notification events for new chat messages, given as serialized by
+    chat.fanout.serialize_message. Per room, every participant who did not
+    send, mute or currently watch the room gets one event counting the
+    messages and previewing the latest. One query for the rooms, one for the
+    participants and one Redis round trip, however many messages.
+    """
+    per_room = defaultdict(list)
+    for payload in payloads:
+        per_room[payload['room']].append(payload)
+    if not per_room:
+        return []
+
+    room_ids = list(per_room)
+    names = {str(pk): name for pk, name in ChatRoom.objects.filter(pk__in=room_ids).values_list('pk', 'name')}
+    members = defaultdict(list)
+    participants = Participant.objects.filter(room_id__in=room_ids, is_removed=False, is_muted=False)
+    for room_id, user_id in participants.values_list('room_id', 'user_id'):
+        members[str(room_id)].append(user_id)
+    present = connected_users(room_ids)
+    length = get_notification_config()['PREVIEW_LENGTH']
+
+    events = []
+    for room_id, messages in per_room.items():
+        if room_id not in names:
+            continue
+        for user_id in members[room_id]:
+            if user_id in present.get(room_id, ()):
+                continue
+            received = [message for message in messages if message['sender_id'] != user_id]
+            if not received:
+                continue
+            latest = received[-1]
+            events.append(make_event(
+                user_id, 'chat.message', f"New messages in {names[room_id]}",
+                body=preview(latest, length),
+                data={'room_id': room_id, 'room': names[room_id], 'message_id': latest['id']},
+                group_key=f"chat:{room_id}",
+                count=len(received),
+            ))
+    return events
+
+
+def notify_chat_messages(payloads):
+    """Store the notifications for new chat messages. Returns them, for fan_out."""
+    events = chat_message_events(payloads)
+    return store(events) if events else []
+
+
+def unread_count(user_id):
+    return Notification.objects.filter(user_id=user_id, read_at__isnull=True).count()
+
+
+def mark_delivered(user_id, ids):
+    return Notification.objects.filter(
+        user_id=user_id, pk__in=ids, delivered_at__isnull=True
+    ).update(delivered_at=timezone.now())
+
+
+def mark_read(user_id, ids=None):
+    """Mark the given notifications, or all of them, read. Returns how many changed."""
+    notifications = Notification.objects.filter(user_id=user_id, read_at__isnull=True)
+    if ids is not None:
+        notifications = notifications.filter(pk__in=ids)
+    return notifications.update(read_at=timezone.now())
@@ -0,0 +1,10 @@
+from celery import shared_task
+from notifications.digests import send_digests
+
+
+@shared_task
+def send_notification_digests_task():
+    """
+    Mails each user with pending notifications a single digest of them
+    """
+    return send_digests()
@@ -1,3 +1,234 @@
-from django.test import TestCase
+import time
+import uuid
+from datetime import timedelta
+from unittest.mock import patch
 
-# Create your tests here.
+import jwt
+from channels.db import database_sync_to_async
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.core import mail
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from chat.fanout import serialize_message
+from chat.middleware import JWTAuthMiddleware
+from chat.models import ChatRoom, Message, Participant, User
+from chat.utils.auth import get_token_cache
+from notifications.buffer import ChatNotificationBuffer
+from notifications.digests import send_digests
+from notifications.models import Notification
+from notifications.routing import websocket_urlpatterns
+from notifications.services import make_event, notify_chat_messages, store
+
+
+IN_MEMORY_CHANNEL_LAYERS = {"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}}
+
+
+def make_token(user_id, **claims):
+    payload = {"token_type": "access", "user_id": user_id, "jti": uuid.uuid4().hex, "exp": int(time.time()) + 3600, **claims}
+    return jwt.encode(payload, settings.SIMPLE_JWT["SIGNING_KEY"], algorithm="HS256")
+
+
+class NotificationStoreTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username="client", role="client")
+
+    def test_events_of_an_open_group_collapse_into_one_row(self):
+        store([make_event(self.user.id, "case.note", "Note added", group_key="case:1")] * 3)
+        first = Notification.objects.get()
+        first.delivered_at = timezone.now()
+        first.save()
+
+        store([make_event(self.user.id, "case.note", "Another note", group_key="case:1")])
+
+        notification = Notification.objects.get()
+        self.assertEqual((notification.count, notification.title), (4, "Another note"))
+        self.assertIsNone(notification.delivered_at)  # pending again for the socket or the digest
+
+    def test_read_and_ungrouped_notifications_are_not_reused(self):
+        store([make_event(self.user.id, "case.note", "Note", group_key="case:1")])
+        Notification.objects.update(read_at=timezone.now())
+        store([make_event(self.user.id, "case.note", "Note", group_key="case:1")])
+        store([make_event(self.user.id, "case.update", "Updated")] * 2)
+
+        self.assertEqual(Notification.objects.filter(group_key="case:1").count(), 2)
+        self.assertEqual(Notification.objects.filter(group_key="").count(), 2)
+
+
+class ChatNotificationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.room = ChatRoom.objects.create(name="case_3", room_type="group")
+        cls.sender, cls.away, cls.watching, cls.muted, cls.removed = [
+            User.objects.create(username=name, role="client") for name in ["sender", "away", "watching", "muted", "removed"]
+        ]
+        Participant.objects.create(room=cls.room, user=cls.sender)
+        Participant.objects.create(room=cls.room, user=cls.away)
+        Participant.objects.create(room=cls.room, user=cls.watching)
+        Participant.objects.create(room=cls.room, user=cls.muted, is_muted=True)
+        Participant.objects.create(room=cls.room, user=cls.removed, is_removed=True)
+
+    def payloads(self, count):
+        return [
+            serialize_message(Message.objects.create(room=self.room, sender=self.sender, content=f"message {i}"))
+            for i in range(count)
+        ]
+
+    def test_only_absent_participants_are_notified_once_per_room(self):
+        payloads = self.payloads(5)
+        present = {str(self.room.pk): {self.watching.id}}
+        with patch("notifications.services.connected_users", return_value=present), self.assertNumQueries(4):
+            notifications = notify_chat_messages(payloads)
+
+        self.assertEqual([n.user_id for n in notifications], [self.away.id])
+        self.assertEqual(notifications[0].count, 5)
+        self.assertEqual(notifications[0].body, "sender: message 4")
+        self.assertEqual(notifications[0].data["message_id"], payloads[-1]["id"])
+
+    def test_later_messages_bump_the_same_notification(self):
+        with patch("notifications.services.connected_users", return_value={}):
+            notify_chat_messages(self.payloads(2))
+            notify_chat_messages(self.payloads(1))
+
+        self.assertEqual(
+            dict(Notification.objects.values_list("user_id", "count")),
+            {self.away.id: 3, self.watching.id: 3},
+        )
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class NotificationConsumerTests(TransactionTestCase):
+
+    def setUp(self):
+        suffix = uuid.uuid4().hex[:8]
+        self.user = User.objects.create(username=f"away{suffix}", role="client")
+        self.sender = User.objects.create(username=f"sender{suffix}", role="client")
+        self.room = ChatRoom.objects.create(name=f"case_{suffix}", room_type="group")
+        Participant.objects.create(room=self.room, user=self.user)
+        Participant.objects.create(room=self.room, user=self.sender)
+        get_token_cache().clear()
+
+    async def connect(self):
+        application = JWTAuthMiddleware(URLRouter(websocket_urlpatterns))
+        communicator = WebsocketCommunicator(application, f"/ws/notifications/?token={make_token(self.user.id)}")
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    @patch("chat.signals.send_realtime_notification.delay")
+    @patch("notifications.services.connected_users", return_value={})
+    async def test_buffered_chat_messages_reach_the_socket_as_one_batch(self, *mocks):
+        communicator = await self.connect()
+        self.assertEqual(await communicator.receive_json_from(), {"type": "notifications.unread", "count": 0})
+
+        buffer = ChatNotificationBuffer(flush_interval=60)
+        for i in range(3):
+            message = await database_sync_to_async(Message.objects.create)(room=self.room, sender=self.sender, content=f"hi {i}")
+            buffer.add(serialize_message(message))
+        await buffer.flush()
+
+        frame = await communicator.receive_json_from()
+        self.assertEqual(frame["type"], "notifications")
+        self.assertEqual([item["count"] for item in frame["items"]], [3])
+        self.assertTrue(await communicator.receive_nothing())
+
+        # what reached a socket is left out of the digests
+        notification = await database_sync_to_async(Notification.objects.get)(user=self.user)
+        self.assertIsNotNone(notification.delivered_at)
+
+        await communicator.send_json_to({"type": "read", "ids": [notification.id]})
+        self.assertEqual(await communicator.receive_json_from(), {"type": "notifications.unread", "count": 0})
+        await communicator.disconnect()
+
+    async def test_socket_without_a_token_is_refused(self):
+        communicator = WebsocketCommunicator(JWTAuthMiddleware(URLRouter(websocket_urlpatterns)), "/ws/notifications/")
+        connected, code = await communicator.connect()
+        self.assertFalse(connected)
+        self.assertEqual(code, 4401)
+
+
+@override_settings(NOTIFICATIONS={"DIGEST_DELAY": 600, "DIGEST_MAX_ITEMS": 2})
+class NotificationDigestTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username="client", role="client", email="client@example.com")
+        cls.no_email = User.objects.create(username="nomail", role="client")
+
+    def add(self, user, title, age, **fields):
+        notification = Notification.objects.create(user=user, kind="case.update", title=title, **fields)
+        Notification.objects.filter(pk=notification.pk).update(updated_at=timezone.now() - timedelta(seconds=age))
+        return notification
+
+    def test_pending_notifications_go_out_as_one_mail_per_user(self):
+        for i in range(3):
+            self.add(self.user, f"Update {i}", age=700 + i)
+        recent = self.add(self.user, "Just now", age=10)
+        delivered = self.add(self.user, "Seen live", age=700, delivered_at=timezone.now())
+        self.add(self.no_email, "Nowhere to send", age=700)
+
+        self.assertEqual(send_digests(), {"users": 2, "sent": 1, "failed": 0})
+
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ["client@example.com"])
+        self.assertIn("Update 0", mail.outbox[0].body)
+        self.assertIn("... and 1 more", mail.outbox[0].body)
+        self.assertEqual(Notification.objects.filter(digested_at__isnull=False).count(), 4)
+        self.assertFalse(Notification.objects.filter(pk__in=[recent.pk, delivered.pk], digested_at__isnull=False).exists())
+
+        self.assertEqual(send_digests(), {"users": 0, "sent": 0, "failed": 0})
+        self.assertEqual(len(mail.outbox), 1)
+
+
+@override_settings(NOTIFICATIONS={"SERVICE_TOKEN": "case-secret"}, CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class NotificationAPITests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username="client", role="client")
+        for i in range(5):
+            Notification.objects.create(user=cls.user, kind="case.update", title=f"Update {i}")
+
+    def setUp(self):
+        get_token_cache().clear()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {make_token(self.user.id)}")
+
+    def test_inbox_pages_newest_first_with_the_unread_count(self):
+        Notification.objects.filter(title="Update 4").update(read_at=timezone.now())
+        first = self.client.get(reverse("notification-list"), {"limit": 3})
+        second = self.client.get(reverse("notification-list"), {"limit": 3, "cursor": first.data["cursor"]})
+        unread = self.client.get(reverse("notification-list"), {"unread": "1"})
+
+        self.assertEqual([n["title"] for n in first.data["results"]], ["Update 4", "Update 3", "Update 2"])
+        self.assertEqual([n["title"] for n in second.data["results"]], ["Update 1", "Update 0"])
+        self.assertFalse(second.data["has_more"])
+        self.assertEqual(first.data["unread_count"], 4)
+        self.assertEqual(len(unread.data["results"]), 4)
+
+    def test_mark_read(self):
+        ids = list(Notification.objects.values_list("id", flat=True)[:2])
+        response = self.client.post(reverse("notification-read"), {"ids": ids}, format="json")
+        self.assertEqual(response.data, {"marked": 2, "unread_count": 3})
+        response = self.client.post(reverse("notification-read"), {}, format="json")
+        self.assertEqual(response.data, {"marked": 3, "unread_count": 0})
+
+    def test_events_need_the_service_token(self):
+        self.client.credentials()
+        event = {"user_ids": [self.user.id, 999999], "kind": "case.document", "title": "New document", "group_key": "case:8"}
+        url = reverse("notification-events")
+
+        refused = self.client.post(url, {"events": [event]}, format="json", HTTP_X_SERVICE_TOKEN="wrong")
+        accepted = self.client.post(url, {"events": [event, event]}, format="json", HTTP_X_SERVICE_TOKEN="case-secret")
+
+        self.assertEqual(refused.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(accepted.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(accepted.data, {"stored": 1, "unknown_users": [999999]})
+        self.assertEqual(Notification.objects.get(group_key="case:8").count, 2)
@@ -1,3 +1,68 @@
-from django.shortcuts import render
+from rest_framework.views import APIView
+from rest_framework.response import Response
+from rest_framework import status
+from chat.models import User
+from chat.permissions import IsAuthenticatedViaUserService
+from notifications.models import Notification
+from notifications.pagination import NotificationCursorPagination
+from notifications.permissions import HasServiceToken
+from notifications.serializers import (
+    NotificationEventBatchSerializer,
+    NotificationReadSerializer,
+    NotificationSerializer,
+)
+from notifications.services import fan_out_sync, make_event, mark_read, store, unread_count
 
-# Create your views here.
+
+class NotificationListView(APIView):
+    """The caller's inbox, newest first; ?unread=1 leaves out what was read."""
+    permission_classes = [IsAuthenticatedViaUserService]
+
+    def get(self, request):
+        user_id = request.user_data["id"]
+        notifications = Notification.objects.filter(user_id=user_id)
+        if request.query_params.get("unread") == "1":
+            notifications = notifications.filter(read_at__isnull=True)
+        paginator = NotificationCursorPagination()
+        page = paginator.paginate_queryset(notifications, request)
+        response = paginator.get_paginated_response(page, NotificationSerializer(page, many=True).data)
+        response.data["unread_count"] = unread_count(user_id)
+        return response
+
+
+class NotificationReadView(APIView):
+    permission_classes = [IsAuthenticatedViaUserService]
+
+    def post(self, request):
+        serializer = NotificationReadSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        user_id = request.user_data["id"]
+        marked = mark_read(user_id, serializer.validated_data.get("ids"))
+        return Response({"marked": marked, "unread_count": unread_count(user_id)}, status=status.HTTP_200_OK)
+
+
+class NotificationEventView(APIView):
+    """
+    Events from other services, e.g. case activity. All events of a request
+    are stored with one upsert and pushed with one fan-out.
+    """
+    authentication_classes = []
+    permission_classes = [HasServiceToken]
+
+    def post(self, request):
+        serializer = NotificationEventBatchSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        events = serializer.validated_data["events"]
+        requested = {user_id for event in events for user_id in event["user_ids"]}
+        known = set(User.objects.filter(pk__in=requested).values_list("id", flat=True))
+        notifications = store([
+            make_event(user_id, event["kind"], event["title"], event["body"], event["data"], event["group_key"])
+            for event in events for user_id in set(event["user_ids"]) & known
+        ])
+        fan_out_sync(notifications)
+        return Response(
+            {"stored": len(notifications), "unknown_users": sorted(requested - known)},
+            status=status.HTTP_202_ACCEPTED,
+        )
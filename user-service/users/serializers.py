@@ -1,7 +1,11 @@
 from rest_framework import serializers
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
 from django.core.validators import RegexValidator
+from django.db import IntegrityError, transaction
 from .models import ClientProfile, AdvocateProfile, Specialization
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date
 
 User = get_user_model()
@@ -58,6 +62,69 @@ class UserRegisterSerializer(serializers.ModelSerializer):
 
 
 
+class AdvocateBulkRegisterSerializer(serializers.ListSerializer):
+    """
+    Bulk onboarding path used by AdvocateRegisterSerializer(many=True).
+    Uniqueness is checked for the whole batch with one IN query per field
+    and rows are inserted with bulk_create inside a single transaction.
+    """
+    UNIQUE_FIELDS = (
+        ('username', User, 'username', "Username already exists"),
+        ('email', User, 'email', "Email already exists"),
+        ('bar_council_id', AdvocateProfile, 'bar_council_id', "Bar council ID already exists"),
+    )
+
+    def to_internal_value(self, data):
+        rows = super().to_internal_value(data)
+        errors = [{} for _ in rows]
+
+        for field, model, lookup, message in self.UNIQUE_FIELDS:
+            seen = {}
+            for index, row in enumerate(rows):
+                value = row[field]
+                if value in seen:
+                    errors[index].setdefault(field, []).append(f"Duplicate value in payload (row {seen[value]})")
+                else:
+                    seen[value] = index
+            taken = set(
+                model.objects.filter(**{f"{lookup}__in": list(seen)}).values_list(lookup, flat=True)
+            )
+            for value in taken:
+                errors[seen[value]].setdefault(field, []).append(message)
+
+        if any(errors):
+            raise serializers.ValidationError(errors)
+        return rows
+
+    def create(self, validated_data):
+        workers = getattr(settings, 'PASSWORD_HASHING_WORKERS', 8)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            hashed = list(pool.map(make_password, [row['password'] for row in validated_data]))
+
+        users = [
+            User(
+                username=row['username'],
+                email=row['email'],
+                password=password,
+                role='advocate'
+            )
+            for row, password in zip(validated_data, hashed)
+        ]
+        try:
+            with transaction.atomic():
+                users = User.objects.bulk_create(users, batch_size=500)
+                AdvocateProfile.objects.bulk_create(
+                    [
+                        AdvocateProfile(user=user, bar_council_id=row['bar_council_id'])
+                        for user, row in zip(users, validated_data)
+                    ],
+                    batch_size=500
+                )
+        except IntegrityError:
+            raise serializers.ValidationError("Username, email or bar council ID already exists")
+        return users
+
+
 class AdvocateRegisterSerializer(serializers.ModelSerializer):
     password = serializers.CharField(write_only=True)
     confirm_password = serializers.CharField(write_only=True)
@@ -69,16 +136,25 @@ class AdvocateRegisterSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ['username', 'email', 'password', 'confirm_password', 'bar_council_id']
+        # uniqueness is checked in validate_username or by the bulk serializer
+        extra_kwargs = {'username': {'validators': []}}
+        list_serializer_class = AdvocateBulkRegisterSerializer
+
+    def in_bulk(self):
+        # AdvocateBulkRegisterSerializer checks uniqueness for the whole batch at once
+        return isinstance(self.parent, AdvocateBulkRegisterSerializer)
 
     def validate_username(self, value):
-        if User.objects.filter(username=value).exists():
+        value = User.normalize_username(value)
+        if not self.in_bulk() and User.objects.filter(username=value).exists():
             raise serializers.ValidationError("Username already exists")
         if not value.isalnum():
             raise serializers.ValidationError("Username must be alphanumeric")
         return value
 
     def validate_email(self, value):
-        if User.objects.filter(email=value).exists():
+        value = User.objects.normalize_email(value)
+        if not self.in_bulk() and User.objects.filter(email=value).exists():
             raise serializers.ValidationError("Email already exists")
         return value
 
@@ -94,7 +170,7 @@ class AdvocateRegisterSerializer(serializers.ModelSerializer):
         return value
 
     def validate_bar_council_id(self, value):
-        if AdvocateProfile.objects.filter(bar_council_id=value).exists():
+        if not self.in_bulk() and AdvocateProfile.objects.filter(bar_council_id=value).exists():
             raise serializers.ValidationError("Bar council ID already exists")
         return value
 
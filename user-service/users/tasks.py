@@ -1,16 +1,165 @@
+import json
+import redis
 from celery import shared_task
-from django.core.mail import send_mail
+from django.core.mail import EmailMessage, get_connection
 from django.conf import settings
+from django.contrib.auth import get_user_model
 
-@shared_task
-def send_welcome_email_task(email, username):
-    try:
-        send_mail(
-            subject="Welcome to Our Platform",
-            message=f"Hello {username},\n\nThank you for registering!",
-            from_email=settings.DEFAULT_FROM_EMAIL,
-            recipient_list=[email],
-            fail_silently=False
+User = get_user_model()
+
+USER_INFO_FIELDS = ("id", "username", "email", "role")
+
+WELCOME_EMAIL_QUEUE_KEY = "users:welcome_emails:pending"
+WELCOME_EMAIL_FLUSH_KEY = "users:welcome_emails:flush_scheduled"
+WELCOME_EMAIL_PROCESSING_KEY = "users:welcome_emails:processing"
+WELCOME_EMAIL_LOCK_KEY = "users:welcome_emails:flush_lock"
+
+_redis_client = None
+
+
+def get_redis():
+    global _redis_client
+    if _redis_client is None:
+        _redis_client = redis.Redis.from_url(
+            settings.REDIS_URL,
+            socket_connect_timeout=settings.REDIS_SOCKET_TIMEOUT,
+            socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
         )
+    return _redis_client
+
+
+def build_welcome_email(email, username, connection=None):
+    return EmailMessage(
+        subject="Welcome to Our Platform",
+        body=f"Hello {username},\n\nThank you for registering!",
+        from_email=settings.DEFAULT_FROM_EMAIL,
+        to=[email],
+        connection=connection
+    )
+
+
+def queue_welcome_emails(recipients):
+    """
+    Collects (email, username) pairs in Redis instead of enqueueing one task per user.
+    The pending mails are flushed after WELCOME_EMAIL_BATCH_WINDOW seconds, or right
+    away once WELCOME_EMAIL_BATCH_SIZE mails are waiting.
+    """
+    if not recipients:
+        return
+    try:
+        client = get_redis()
+        pending = client.rpush(WELCOME_EMAIL_QUEUE_KEY, *[json.dumps([e, u]) for e, u in recipients])
+        if pending >= settings.WELCOME_EMAIL_BATCH_SIZE:
+            flush_welcome_emails_task.delay()
+        else:
+            schedule_welcome_email_flush(client)
+    except redis.RedisError as e:
+        print(f"Welcome email queue unavailable, sending directly: {e}")
+        for email, username in recipients:
+            send_welcome_email_task.delay(email, username)
+
+
+def queue_welcome_email(email, username):
+    queue_welcome_emails([(email, username)])
+
+
+@shared_task(bind=True, max_retries=3, default_retry_delay=60)
+def send_welcome_email_task(self, email, username):
+    try:
+        build_welcome_email(email, username).send(fail_silently=False)
     except Exception as e:
         print(f"Failed to send welcome email: {e}")
+        raise self.retry(exc=e)
+
+
+@shared_task
+def send_welcome_emails_task(recipients):
+    """
+    Sends a batch of welcome mails over one SMTP connection.
+    Mails that fail are retried individually through send_welcome_email_task.
+    """
+    connection = get_connection(fail_silently=False)
+    failed = []
+    try:
+        connection.open()
+        for email, username in recipients:
+            try:
+                connection.send_messages([build_welcome_email(email, username, connection)])
+            except Exception as e:
+                print(f"Failed to send welcome email to {email}: {e}")
+                failed.append((email, username))
+    except Exception as e:
+        print(f"Failed to open SMTP connection: {e}")
+        failed = list(recipients)
+    finally:
+        connection.close()
+
+    for email, username in failed:
+        send_welcome_email_task.apply_async((email, username), countdown=60)
+    return {"sent": len(recipients) - len(failed), "failed": len(failed)}
+
+
+def schedule_welcome_email_flush(client):
+    if client.set(WELCOME_EMAIL_FLUSH_KEY, 1, nx=True, ex=settings.WELCOME_EMAIL_BATCH_WINDOW * 2):
+        flush_welcome_emails_task.apply_async(countdown=settings.WELCOME_EMAIL_BATCH_WINDOW)
+
+
+@shared_task
+def flush_welcome_emails_task():
+    """
+    Sends the pending welcome mails in batches. Each batch is moved to a
+    processing list and only dropped from it once sent, so mails taken by a
+    flush that crashed are picked up again by the next one. One flush runs at
+    a time; the others reschedule themselves.
+    """
+    client = get_redis()
+    lock = client.lock(WELCOME_EMAIL_LOCK_KEY, timeout=settings.WELCOME_EMAIL_FLUSH_LOCK_TIMEOUT)
+    if not lock.acquire(blocking=False):
+        schedule_welcome_email_flush(client)
+        return
+    try:
+        # Clear the flag first so mails queued during the flush schedule the next one
+        client.delete(WELCOME_EMAIL_FLUSH_KEY)
+        # Left behind by a flush that died mid-batch: back to the head of the queue
+        while client.lmove(WELCOME_EMAIL_PROCESSING_KEY, WELCOME_EMAIL_QUEUE_KEY, "RIGHT", "LEFT"):
+            pass
+        batch_size = settings.WELCOME_EMAIL_BATCH_SIZE
+        while True:
+            pipe = client.pipeline(transaction=False)
+            for _ in range(batch_size):
+                pipe.lmove(WELCOME_EMAIL_QUEUE_KEY, WELCOME_EMAIL_PROCESSING_KEY, "LEFT", "RIGHT")
+            items = [item for item in pipe.execute() if item is not None]
+            if not items:
+                break
+            send_welcome_emails_task([json.loads(item) for item in items])
+            try:
+                lock.reacquire()
+            except redis.exceptions.LockNotOwnedError:
+                # The batch outlasted the lock and another flush took over; the
+                # processing list is its business now
+                print("Welcome email flush lost its lock, stopping")
+                return
+            client.delete(WELCOME_EMAIL_PROCESSING_KEY)
+    except Exception:
+        # The unsent batch stays in the processing list for the next flush
+        schedule_welcome_email_flush(client)
+        raise
+    finally:
+        try:
+            lock.release()
+        except redis.exceptions.LockError:
+            pass  # expired, and possibly held by another flush by now
+
+
+@shared_task(name="user_service.tasks.get_user_info")
+def get_user_info(user_id):
+    return User.objects.filter(id=user_id).values(*USER_INFO_FIELDS).first()
+
+
+@shared_task(name="user_service.tasks.get_users_info")
+def get_users_info(user_ids):
+    """
+    Bulk variant of get_user_info: one query for the whole id list.
+    Unknown ids are simply absent from the result.
+    """
+    return list(User.objects.filter(id__in=set(user_ids)).values(*USER_INFO_FIELDS))
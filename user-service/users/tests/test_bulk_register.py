@@ -0,0 +1,83 @@
+from unittest.mock import patch
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APITestCase
+from rest_framework import status
+from django.contrib.auth import get_user_model
+
+from users.models import AdvocateProfile
+
+User = get_user_model()
+
+
+def advocate_rows(count, start=0):
+    return [
+        {
+            "username": f"advocate{i}",
+            "email": f"advocate{i}@gmail.com",
+            "password": "AdvocatePass123",
+            "confirm_password": "AdvocatePass123",
+            "bar_council_id": f"BAR{i}",
+        }
+        for i in range(start, start + count)
+    ]
+
+
+@override_settings(PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"])
+@patch("users.views.queue_welcome_emails")
+class BulkAdvocateRegisterTests(APITestCase):
+
+    url = reverse("advocate-register")
+
+    def test_batch_is_created_with_a_fixed_number_of_queries(self, mock_welcome):
+        with CaptureQueriesContext(connection) as small:
+            response = self.client.post(self.url, advocate_rows(2), format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        with CaptureQueriesContext(connection) as large:
+            response = self.client.post(self.url, advocate_rows(50, start=2), format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        self.assertEqual(len(small), len(large))
+        self.assertEqual(User.objects.filter(role="advocate").count(), 52)
+        self.assertEqual(AdvocateProfile.objects.count(), 52)
+        self.assertTrue(User.objects.get(username="advocate10").check_password("AdvocatePass123"))
+
+    def test_duplicates_inside_the_payload_are_reported_per_row(self, mock_welcome):
+        rows = advocate_rows(3)
+        rows[2]["email"] = rows[0]["email"]
+
+        response = self.client.post(self.url, rows, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data[0], {})
+        self.assertIn("email", response.data[2])
+        self.assertFalse(User.objects.exists())
+
+    def test_existing_users_and_bar_council_ids_are_rejected(self, mock_welcome):
+        self.client.post(self.url, advocate_rows(1), format="json")
+        rows = advocate_rows(2, start=1)
+        rows[1]["bar_council_id"] = "BAR0"
+
+        response = self.client.post(self.url, rows, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("bar_council_id", response.data[1])
+        self.assertEqual(User.objects.count(), 1)
+
+    def test_usernames_are_compared_after_normalization(self, mock_welcome):
+        self.client.post(self.url, advocate_rows(1), format="json")
+        rows = advocate_rows(3, start=1)
+        # fullwidth spellings, NFKC-normalized to "advocate0" and "advocate1"
+        rows[1]["username"] = "\uff41dvocate0"
+        rows[2]["username"] = "\uff41dvocate1"
+
+        response = self.client.post(self.url, rows, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data[0], {})
+        self.assertEqual(response.data[1]["username"], ["Username already exists"])
+        self.assertIn("Duplicate value in payload (row 0)", response.data[2]["username"])
+        self.assertEqual(User.objects.count(), 1)
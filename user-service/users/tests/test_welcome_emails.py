@@ -0,0 +1,155 @@
+import json
+import socketserver
+import threading
+from unittest import skipUnless
+from unittest.mock import patch
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+from django.test import SimpleTestCase, override_settings
+
+from users.tasks import (
+    WELCOME_EMAIL_LOCK_KEY, WELCOME_EMAIL_PROCESSING_KEY, WELCOME_EMAIL_QUEUE_KEY,
+    flush_welcome_emails_task, send_welcome_emails_task,
+)
+
+
+class DebuggingSMTPHandler(socketserver.StreamRequestHandler):
+    """Just enough SMTP to accept mail locally and record what was delivered."""
+
+    def reply(self, line):
+        self.wfile.write(f"{line}\r\n".encode())
+
+    def handle(self):
+        self.server.connections += 1
+        recipients = []
+        self.reply("220 localhost debugging SMTP")
+        for raw in self.rfile:
+            command = raw.decode().strip().upper()
+            if command.startswith(("EHLO", "HELO")):
+                self.reply("250 localhost")
+            elif command.startswith("MAIL FROM"):
+                recipients = []
+                self.reply("250 OK")
+            elif command.startswith("RCPT TO"):
+                address = raw.decode().split(":", 1)[1].strip().strip("<>")
+                if address in self.server.rejected:
+                    self.reply("550 Mailbox unavailable")
+                else:
+                    recipients.append(address)
+                    self.reply("250 OK")
+            elif command == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                for line in self.rfile:
+                    if line in (b".\r\n", b".\n"):
+                        break
+                self.server.delivered.extend(recipients)
+                self.reply("250 OK")
+            elif command == "QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("250 OK")
+
+
+class DebuggingSMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+
+    def __init__(self, rejected=()):
+        super().__init__(("127.0.0.1", 0), DebuggingSMTPHandler)
+        self.rejected = set(rejected)
+        self.delivered = []
+        self.connections = 0
+
+
+class WelcomeEmailBatchTests(SimpleTestCase):
+
+    def setUp(self):
+        self.smtp = DebuggingSMTPServer(rejected={"bounce@gmail.com"})
+        threading.Thread(target=self.smtp.serve_forever, daemon=True).start()
+        self.addCleanup(self.smtp.server_close)
+        self.addCleanup(self.smtp.shutdown)
+        settings_override = override_settings(
+            EMAIL_BACKEND="django.core.mail.backends.smtp.EmailBackend",
+            EMAIL_HOST="127.0.0.1",
+            EMAIL_PORT=self.smtp.server_address[1],
+            EMAIL_USE_TLS=False,
+            EMAIL_HOST_USER="",
+            EMAIL_HOST_PASSWORD="",
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    @patch("users.tasks.send_welcome_email_task.apply_async")
+    def test_batch_uses_one_connection_and_retries_failures(self, mock_retry):
+        recipients = [
+            ("one@gmail.com", "one"),
+            ("bounce@gmail.com", "bounce"),
+            ("two@gmail.com", "two"),
+        ]
+
+        result = send_welcome_emails_task(recipients)
+
+        self.assertEqual(result, {"sent": 2, "failed": 1})
+        self.assertEqual(self.smtp.delivered, ["one@gmail.com", "two@gmail.com"])
+        self.assertEqual(self.smtp.connections, 1)
+        mock_retry.assert_called_once_with(("bounce@gmail.com", "bounce"), countdown=60)
+
+
+@skipUnless(fakeredis, "fakeredis is not installed")
+@override_settings(WELCOME_EMAIL_BATCH_SIZE=2)
+class WelcomeEmailFlushTests(SimpleTestCase):
+
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis()
+        patcher = patch("users.tasks.get_redis", return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.redis.rpush(WELCOME_EMAIL_QUEUE_KEY, *[json.dumps([f"{name}@gmail.com", name]) for name in ("one", "two", "three")])
+
+    @patch("users.tasks.flush_welcome_emails_task.apply_async")
+    @patch("users.tasks.send_welcome_emails_task")
+    def test_batch_survives_a_failed_send(self, mock_send, mock_schedule):
+        mock_send.side_effect = ConnectionRefusedError("SMTP down")
+
+        with self.assertRaises(ConnectionRefusedError):
+            flush_welcome_emails_task()
+
+        self.assertEqual(self.redis.llen(WELCOME_EMAIL_PROCESSING_KEY), 2)
+        self.assertFalse(self.redis.exists(WELCOME_EMAIL_LOCK_KEY))
+        mock_schedule.assert_called_once()
+
+        mock_send.side_effect = None
+        flush_welcome_emails_task()
+
+        sent = [recipient for call in mock_send.call_args_list[1:] for recipient in call.args[0]]
+        self.assertEqual([username for _, username in sent], ["one", "two", "three"])
+        self.assertFalse(self.redis.exists(WELCOME_EMAIL_QUEUE_KEY))
+        self.assertFalse(self.redis.exists(WELCOME_EMAIL_PROCESSING_KEY))
+
+    @patch("users.tasks.flush_welcome_emails_task.apply_async")
+    @patch("users.tasks.send_welcome_emails_task")
+    def test_flush_waits_for_the_running_one(self, mock_send, mock_schedule):
+        self.redis.set(WELCOME_EMAIL_LOCK_KEY, 1)
+
+        flush_welcome_emails_task()
+
+        mock_send.assert_not_called()
+        self.assertEqual(self.redis.llen(WELCOME_EMAIL_QUEUE_KEY), 3)
+        mock_schedule.assert_called_once_with(countdown=10)
+
+    @patch("users.tasks.send_welcome_emails_task")
+    def test_flush_that_lost_its_lock_leaves_the_new_holder_alone(self, mock_send):
+        def slow_send(recipients):
+            # the lock expires during the send and another flush takes it
+            self.redis.set(WELCOME_EMAIL_LOCK_KEY, "other")
+
+        mock_send.side_effect = slow_send
+
+        flush_welcome_emails_task()
+
+        mock_send.assert_called_once()
+        self.assertEqual(self.redis.get(WELCOME_EMAIL_LOCK_KEY), b"other")
+        self.assertEqual(self.redis.llen(WELCOME_EMAIL_PROCESSING_KEY), 2)
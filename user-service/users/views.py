@@ -13,7 +13,7 @@ from users.serializers import (
     ClientProfileSerializer,
     AdvocateProfileSerializer
 )
-from users.tasks import send_welcome_email_task
+from users.tasks import queue_welcome_email, queue_welcome_emails
 
 User = get_user_model()
 
@@ -36,7 +36,7 @@ class UserRegisterView(APIView):
         serializer = UserRegisterSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         user = serializer.save()
-        send_welcome_email_task.delay(user.email, user.username)
+        queue_welcome_email(user.email, user.username)
         return custom_response(
             "User registered successfully",
             status_code=201,
@@ -53,8 +53,7 @@ class AdvocateRegisterView(APIView):
         users = serializer.save()  # this is now a list
 
         # Send emails and prepare response
-        for user in users:
-            send_welcome_email_task.delay(user.email, user.username)
+        queue_welcome_emails([(user.email, user.username) for user in users])
 
         user_ids = [user.id for user in users]
         return custom_response(
@@ -114,7 +113,7 @@ class GoogleLoginView(APIView):
         })
 
         if created:
-            send_welcome_email_task.delay(user.email, user.username)
+            queue_welcome_email(user.email, user.username)
 
         return custom_response(
             "Google login successful",